@@ -0,0 +1,5 @@
+"""
+Standalone benchmarks. Run from the repository root, e.g.:
+
+  python -m bench.links_store
+"""
@@ -0,0 +1,67 @@
+"""
+Broadcast one message to N connected devices.
+
+Usage:
+  python -m bench.broadcast [--devices 10000] [--latency 0.002] [--slow 20]
+
+Fake devices take ``--latency`` seconds per send; ``--slow`` of them never
+finish (a stalled headset). "sequential" is the old one-await-per-device
+pattern with no timeout, so it is only run without stalled devices and with
+a small sample; fan-out uses send_to_many() with per-recipient timeouts.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fanout import send_to_many, summarize
+
+
+class _FakeSocket:
+    def __init__(self, latency, stalled=False):
+        self.latency = latency
+        self.stalled = stalled
+        self.received = 0
+
+    async def send(self, message):
+        if self.stalled:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(self.latency)
+        self.received += 1
+
+
+async def bench(devices, latency, slow, timeout, sample):
+    message = json.dumps({"type": "discord_message", "text": "Shop closes in 10 minutes"})
+
+    healthy = [(f"dev{i}", _FakeSocket(latency)) for i in range(sample)]
+    start = time.perf_counter()
+    for _, ws in healthy:
+        await ws.send(message)
+    sequential = (time.perf_counter() - start) / sample * devices
+
+    targets = [(f"dev{i}", _FakeSocket(latency, stalled=i < slow)) for i in range(devices)]
+    start = time.perf_counter()
+    results = await send_to_many(targets, message, timeout=timeout)
+    fanout = time.perf_counter() - start
+    delivered = sum(1 for e in results.values() if e is None)
+    assert delivered == devices - slow
+
+    print(f"{devices} devices, {latency * 1000:.1f} ms per send, {slow} stalled, {timeout:.1f} s per-recipient timeout")
+    print(f"  sequential awaits: {sequential:8.2f} s (extrapolated from {sample}; stalled devices would block forever)")
+    print(f"  send_to_many:      {fanout:8.2f} s")
+    print("  " + summarize(results, max_listed=2).replace("\n", "\n  "))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.002)
+    parser.add_argument("--slow", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--sample", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(bench(args.devices, args.latency, args.slow, args.timeout, args.sample))
+
+
+if __name__ == "__main__":
+    main()
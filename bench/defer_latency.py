@@ -0,0 +1,208 @@
+"""
+Slash-command defer latency while devices flood the WebSocket server.
+
+Usage:
+  python -m bench.defer_latency [--seconds 10] [--connections 200] [--apps 200]
+
+Discord drops an interaction that is not acknowledged within 3 s, so what
+matters is how long a command waits before `interaction.response.defer()`.
+For each mode server_ws.main() runs in a child process (no Discord
+connection, DB in a temporary directory):
+
+  single   everything on one event loop (the default)
+  thread   WS_THREAD=1: WebSocket server and device state on their own loop
+
+with and without a flood: a separate process opens ``--connections``
+sockets that send `hello` and then library_response frames of ``--apps``
+apps as fast as the server reads them. Every 50 ms a timer thread hands
+the bot loop a /link call (through a stub Interaction), as the gateway
+does when an interaction arrives; the delay from that hand-off to defer()
+is recorded. Reported: p50/p99/max defer latency and device frames the
+server handled per second. If uvloop is installed each mode also runs
+with USE_UVLOOP=0 for comparison.
+
+Both loops share the GIL, and the flood process shares the machine: on a
+single core the thread mode bounds the wait by the interpreter's switch
+interval instead of by the device loop's backlog, but cannot add capacity.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import websockets
+
+from bench.e2e import StubInteraction, _Response
+from bench.ws_workers import REPO, _free_port, _wait_for_port
+
+PROBE_INTERVAL = 0.05
+
+
+async def _flood(port, connections, apps, stop):
+    uri = f"ws://127.0.0.1:{port}"
+    frame = json.dumps({
+        "type": "library_response",
+        "request_id": "flood",
+        "apps": [{"name": f"App {i}", "package": f"com.example.app{i}"} for i in range(apps)],
+    })
+
+    async def device(i):
+        async with websockets.connect(uri, ping_interval=None, max_size=None) as ws:
+            await ws.send(json.dumps({"type": "hello", "device_id": f"flood-{i:05d}", "device_name": "Flood"}))
+            await ws.recv()
+            while not stop.is_set():
+                # send() waits while the server is not reading
+                await ws.send(frame)
+
+    await asyncio.gather(*(device(i) for i in range(connections)), return_exceptions=True)
+
+
+def _flood_main(port, connections, apps, stop):
+    asyncio.run(_flood(port, connections, apps, stop))
+
+
+class _TimedResponse(_Response):
+    async def defer(self, **kwargs):
+        self.interaction.deferred_at = time.perf_counter()
+
+
+async def _measure(S, seconds):
+    loop = asyncio.get_running_loop()
+    latencies = []
+
+    async def probe(queued_at):
+        interaction = StubInteraction(1)
+        interaction.response = _TimedResponse(interaction)
+        await S.link_cmd.callback(interaction)
+        latencies.append(interaction.deferred_at - queued_at)
+
+    def timer(stop):
+        while not stop.wait(PROBE_INTERVAL):
+            queued_at = time.perf_counter()
+            loop.call_soon_threadsafe(lambda t=queued_at: loop.create_task(probe(t)))
+
+    def handled():
+        return sum(c[0] + c[2] for c in S.messages.traffic.values())
+
+    frames = handled()
+    stop = threading.Event()
+    thread = threading.Thread(target=timer, args=(stop,), daemon=True)
+    thread.start()
+    await asyncio.sleep(seconds)
+    stop.set()
+    thread.join()
+    return latencies, handled() - frames
+
+
+async def _child_run(S, port, seconds):
+    server = asyncio.create_task(S.main())
+    # main() binds the port on the device loop; wait without blocking this one
+    await asyncio.get_running_loop().run_in_executor(None, _wait_for_port, port)
+    await asyncio.sleep(float(os.environ["DEFER_BENCH_WARMUP"]))
+    try:
+        return await _measure(S, seconds)
+    finally:
+        server.cancel()
+        try:
+            await server
+        except asyncio.CancelledError:
+            pass
+
+
+def _child(seconds):
+    import loop_thread
+    import server_ws as S
+    S.command_limits.rate = 0
+    port = S.WEBSOCKET_PORT
+    latencies, frames = loop_thread.run(_child_run(S, port, seconds))
+    ms = sorted(x * 1000 for x in latencies)
+    print(json.dumps({
+        "loop": loop_thread.LOOP_IMPL,
+        "probes": len(ms),
+        "p50_ms": ms[len(ms) // 2] if ms else None,
+        "p99_ms": ms[min(len(ms) - 1, int(len(ms) * 0.99))] if ms else None,
+        "max_ms": ms[-1] if ms else None,
+        "frames_per_s": frames / seconds,
+    }))
+
+
+def run(mode, flood, args, uvloop=True):
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            PYTHONPATH=REPO,
+            RUN_DISCORD_BOT="0",
+            METRICS_PORT="0",
+            PC_LOCAL_IP="127.0.0.1",
+            WEBSOCKET_PORT=str(port),
+            WS_THREAD="1" if mode == "thread" else "0",
+            WS_MAX_PER_IP=str(args.connections + 10),
+            USE_UVLOOP="1" if uvloop else "0",
+            LOG_LEVEL="ERROR",
+            DEFER_BENCH_WARMUP="2.0" if flood else "0.5",
+        )
+        child = subprocess.Popen(
+            [sys.executable, "-m", "bench.defer_latency", "--child", "--seconds", str(args.seconds)],
+            cwd=tmp, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        flooder = None
+        try:
+            if flood:
+                _wait_for_port(port)
+                ctx = multiprocessing.get_context("spawn")
+                stop = ctx.Event()
+                flooder = ctx.Process(target=_flood_main, args=(port, args.connections, args.apps, stop))
+                flooder.start()
+            out, _ = child.communicate()
+        finally:
+            if flooder is not None:
+                stop.set()
+                flooder.join(10)
+                if flooder.is_alive():
+                    flooder.terminate()
+            if child.poll() is None:
+                child.kill()
+    if child.returncode != 0 or not out.strip():
+        print(f"  {mode:<6} failed (exit status {child.returncode})")
+        return
+    r = json.loads(out.strip().splitlines()[-1])
+    label = f"{mode} ({r['loop']})"
+    print(
+        f"  {label:<18} {'flood' if flood else 'idle':<5}  {r['probes']:4d} probes  "
+        f"defer p50 {r['p50_ms'] or 0:8.2f} ms  p99 {r['p99_ms'] or 0:8.2f} ms  max {r['max_ms'] or 0:8.2f} ms  "
+        f"{r['frames_per_s']:8.0f} device frames/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--apps", type=int, default=200)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args.seconds)
+        return
+
+    try:
+        import uvloop  # noqa: F401
+        loops = (True, False)
+    except ImportError:
+        loops = (True,)
+    print(f"{os.cpu_count()} CPU(s); {args.connections} flooding sockets, {args.apps} apps per frame")
+    for mode in ("single", "thread"):
+        for uvloop in loops:
+            for flood in (False, True):
+                run(mode, flood, args, uvloop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Registry microbenchmark with N concurrent fake connections.
+
+Usage:
+  python -m bench.device_registry [--connections 50000] [--shards 1]
+
+N fake connections are held open at once. Each phase runs one operation per
+connection: register (hello), lookup (/send and /vrlibrary), add + resolve
+a pending request (library round trip) and unregister (disconnect). The old
+dict + global asyncio.Lock pattern from server_ws.py runs the same phases.
+Operations are awaited back to back rather than gathered so task scheduling
+does not drown out the per-operation cost being compared.
+"""
+import argparse
+import asyncio
+import time
+
+from device_registry import DeviceRegistry
+
+
+class _LockedDicts:
+    def __init__(self):
+        self.connected_devices = {}
+        self.pending_requests = {}
+        self.lock = asyncio.Lock()
+
+    async def register(self, device_id, ws):
+        async with self.lock:
+            self.connected_devices[device_id] = ws
+
+    async def lookup(self, device_id, ws):
+        async with self.lock:
+            return self.connected_devices.get(device_id)
+
+    async def round_trip(self, device_id, ws):
+        fut = asyncio.get_running_loop().create_future()
+        async with self.lock:
+            self.pending_requests[(device_id, "1")] = fut
+        async with self.lock:
+            self.pending_requests.pop((device_id, "1"), None).set_result(None)
+
+    async def unregister(self, device_id, ws):
+        async with self.lock:
+            if self.connected_devices.get(device_id) is ws:
+                del self.connected_devices[device_id]
+
+
+class _Registry:
+    def __init__(self, shards):
+        self.registry = DeviceRegistry(shards=shards)
+
+    async def register(self, device_id, ws):
+        self.registry.register(device_id, ws)
+
+    async def lookup(self, device_id, ws):
+        return self.registry.get(device_id)
+
+    async def round_trip(self, device_id, ws):
+        fut = asyncio.get_running_loop().create_future()
+        self.registry.add_pending(device_id, "1", fut)
+        self.registry.pop_pending(device_id, "1").set_result(None)
+
+    async def unregister(self, device_id, ws):
+        self.registry.unregister(device_id, ws)
+
+
+async def _phases(impl, devices):
+    results = {}
+    for phase in ("register", "lookup", "round_trip", "unregister"):
+        op = getattr(impl, phase)
+        start = time.perf_counter()
+        for device_id, ws in devices:
+            await op(device_id, ws)
+        results[phase] = len(devices) / (time.perf_counter() - start)
+    return results
+
+
+async def bench(connections, shards):
+    devices = [(f"dev{i}", object()) for i in range(connections)]
+    legacy = await _phases(_LockedDicts(), devices)
+    impl = _Registry(shards)
+    registry = await _phases(impl, devices)
+    assert len(impl.registry) == 0 and impl.registry.pending_count() == 0
+
+    print(f"{connections} concurrent fake connections (ops/s per phase)")
+    print(f"  {'phase':12s} {'dicts+Lock':>12s} {'DeviceRegistry':>15s}")
+    for phase in legacy:
+        print(f"  {phase:12s} {legacy[phase]:12.0f} {registry[phase]:15.0f}  ({registry[phase] / legacy[phase]:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=50000)
+    parser.add_argument("--shards", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(bench(args.connections, args.shards))
+
+
+if __name__ == "__main__":
+    main()
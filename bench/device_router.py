@@ -0,0 +1,116 @@
+"""
+Cross-process device routing over a shared SQLite file.
+
+Usage:
+  python -m bench.device_router [--devices 10000] [--calls 200] [--poll 0.05]
+
+Two nodes (each with its own SharedLinksStore, registry and DeviceRouter,
+as two server processes would have) share one temporary DB. Node B holds
+the devices; node A routes to them. Reports the cost of registering a
+connect storm in device_routes and the latency of sends and get_library
+calls from A to B, next to the same operations on B itself.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from device_registry import DeviceRegistry
+from device_router import DeviceRouter
+from device_rpc import DeviceRPC
+from storage import create_store
+
+
+class _FakeSocket:
+    def __init__(self, device_id, rpc):
+        self.device_id = device_id
+        self.rpc = rpc
+
+    async def send(self, message):
+        data = json.loads(message)
+        if data.get("type") == "get_library":
+            loop = asyncio.get_running_loop()
+            loop.call_soon(self.rpc.resolve, self.device_id, data["request_id"], {"apps": ["Beat Saber"]})
+
+
+async def _node(db_file, node_id, poll):
+    store = create_store("shared-sqlite", db_file, change_poll_interval=poll)
+    await store.open()
+    registry = DeviceRegistry()
+    rpc = DeviceRPC(registry)
+    router = DeviceRouter(store, registry, rpc, node_id=node_id, poll_interval=poll)
+    await router.open()
+    return store, registry, rpc, router
+
+
+def _ms(samples):
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"p50 {statistics.median(samples) * 1000:7.2f} ms  p99 {p99 * 1000:7.2f} ms"
+
+
+async def _timed(n, fn):
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        await fn(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def bench(devices, calls, poll):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "links.db")
+        a_store, _, _, a = await _node(db_file, "A", poll)
+        b_store, b_registry, b_rpc, b = await _node(db_file, "B", poll)
+        try:
+            start = time.perf_counter()
+            for i in range(devices):
+                device_id = f"dev{i}"
+                b_registry.register(device_id, _FakeSocket(device_id, b_rpc))
+                b.device_connected(device_id)
+            queued = time.perf_counter() - start
+            # wait until B's poller has written every route
+            while b.stats()["queued_routes"] or len(await a.locate([f"dev{devices - 1}"])) == 0:
+                await asyncio.sleep(poll / 2)
+            settled = time.perf_counter() - start
+            print(f"{devices} connects: queued in {queued * 1000:.1f} ms, all routes visible to A after {settled * 1000:.1f} ms")
+
+            message = json.dumps({"type": "discord_message", "text": "hi"})
+            pick = [f"dev{i * 7919 % devices}" for i in range(calls)]
+            local_send = await _timed(calls, lambda i: b.send_many([pick[i]], message))
+            remote_send = await _timed(calls, lambda i: a.send_many([pick[i]], message))
+            local_call = await _timed(calls, lambda i: b.call(pick[i], "get_library", None, 5))
+            remote_call = await _timed(calls, lambda i: a.call(pick[i], "get_library", None, 5))
+            print(f"poll interval {poll * 1000:.0f} ms, {calls} sequential ops each")
+            print(f"  send on owning node    {_ms(local_send)}")
+            print(f"  send via other node    {_ms(remote_send)}")
+            print(f"  call on owning node    {_ms(local_call)}")
+            print(f"  call via other node    {_ms(remote_call)}")
+
+            start = time.perf_counter()
+            results, offline = await a.send_many([f"dev{i}" for i in range(devices)], message)
+            elapsed = time.perf_counter() - start
+            delivered = sum(1 for e in results.values() if e is None)
+            assert delivered == devices and not offline
+            print(f"  send_many to all {devices} devices via other node: {elapsed * 1000:.1f} ms")
+        finally:
+            for router, store in ((a, a_store), (b, b_store)):
+                router.close()
+                store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--poll", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(bench(args.devices, args.calls, args.poll))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Throughput of DeviceRPC with many concurrent calls per device.
+
+Usage:
+  python -m bench.device_rpc [--devices 100] [--calls 50] [--in-flight 4] [--latency 0.005]
+
+Each fake device answers every request after ``--latency`` seconds through
+the same `resolve()` path ws_handler uses, so the numbers cover request id
+allocation, per-device queueing, the pending table and JSON encoding.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from device_registry import DeviceRegistry
+from device_rpc import DeviceRPC
+
+
+class _LoopbackDevice:
+    def __init__(self, device_id, rpc, latency):
+        self.device_id = device_id
+        self.rpc = rpc
+        self.latency = latency
+        self.in_flight = 0
+        self.max_seen = 0
+
+    async def send(self, raw):
+        msg = json.loads(raw)
+        if msg["type"] == "cancel":
+            return
+        self.in_flight += 1
+        self.max_seen = max(self.max_seen, self.in_flight)
+        asyncio.get_running_loop().call_later(self.latency, self._reply, msg["request_id"])
+
+    def _reply(self, request_id):
+        self.in_flight -= 1
+        self.rpc.resolve(self.device_id, request_id, ["Beat Saber", "VRChat"])
+
+
+async def bench(devices, calls, in_flight, latency):
+    registry = DeviceRegistry()
+    rpc = DeviceRPC(registry, max_in_flight=in_flight, default_timeout=60)
+    fakes = []
+    for d in range(devices):
+        fake = _LoopbackDevice(f"dev{d}", rpc, latency)
+        registry.register(fake.device_id, fake)
+        fakes.append(fake)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        rpc.call(fake.device_id, "get_library") for fake in fakes for _ in range(calls)
+    ))
+    elapsed = time.perf_counter() - start
+    assert len(results) == devices * calls and registry.pending_count() == 0
+    assert max(f.max_seen for f in fakes) <= in_flight
+
+    total = devices * calls
+    # with a per-device limit, each device needs ceil(calls / in_flight) round trips
+    floor = -(-calls // in_flight) * latency
+    print(f"{devices} devices x {calls} concurrent calls, max {in_flight} in flight per device, {latency * 1000:.1f} ms device latency")
+    print(f"  {total / elapsed:9.0f} calls/s  ({elapsed:.2f} s total, latency-bound minimum {floor:.2f} s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.005)
+    args = parser.parse_args()
+    asyncio.run(bench(args.devices, args.calls, args.in_flight, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Mass disconnect with outstanding `get_library` requests.
+
+Usage:
+  python -m bench.disconnect_storm [--devices 10000] [--requests 2]
+
+Every device has ``--requests`` pending library requests when all of them
+drop at once. The old global (device_id, request_id) table had to be scanned
+in full for every disconnect (O(N^2) for the storm); the registry's
+per-device index only touches the disconnecting device's own requests.
+"""
+import argparse
+import asyncio
+import time
+
+from device_registry import DeviceRegistry
+
+
+async def _legacy(devices, per_device):
+    loop = asyncio.get_running_loop()
+    lock = asyncio.Lock()
+    pending_requests = {}
+    futures = []
+    for d in range(devices):
+        for r in range(per_device):
+            fut = loop.create_future()
+            pending_requests[(f"dev{d}", str(r))] = fut
+            futures.append(fut)
+
+    async def disconnect(device_id):
+        # the finally block of ws_handler before the registry
+        async with lock:
+            keys = [k for k in list(pending_requests.keys()) if k[0] == device_id]
+            for k in keys:
+                fut = pending_requests.pop(k, None)
+                if fut and not fut.done():
+                    fut.set_exception(ConnectionError("Device disconnected"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(disconnect(f"dev{d}") for d in range(devices)))
+    elapsed = time.perf_counter() - start
+    assert not pending_requests
+    for fut in futures:
+        fut.exception()
+    return elapsed
+
+
+async def _registry(devices, per_device):
+    loop = asyncio.get_running_loop()
+    registry = DeviceRegistry()
+    sockets = [object() for _ in range(devices)]
+    futures = []
+    for d in range(devices):
+        registry.register(f"dev{d}", sockets[d])
+        for r in range(per_device):
+            fut = loop.create_future()
+            registry.add_pending(f"dev{d}", str(r), fut)
+            futures.append(fut)
+
+    async def disconnect(device_id, ws):
+        registry.unregister(device_id, ws)
+        registry.fail_pending(device_id, ConnectionError("Device disconnected"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(disconnect(f"dev{d}", sockets[d]) for d in range(devices)))
+    elapsed = time.perf_counter() - start
+    assert registry.pending_count() == 0 and len(registry) == 0
+    assert all(isinstance(fut.exception(), ConnectionError) for fut in futures)
+    return elapsed
+
+
+async def bench(devices, per_device, skip_legacy):
+    print(f"{devices} devices disconnecting with {per_device} outstanding get_library requests each")
+    registry = await _registry(devices, per_device)
+    if not skip_legacy:
+        legacy = await _legacy(devices, per_device)
+        print(f"  global table scan:  {legacy:8.3f} s")
+    print(f"  per-device index:   {registry:8.3f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2)
+    parser.add_argument("--skip-legacy", action="store_true", help="only run the registry (the old path is quadratic)")
+    args = parser.parse_args()
+    asyncio.run(bench(args.devices, args.requests, args.skip_legacy))
+
+
+if __name__ == "__main__":
+    main()
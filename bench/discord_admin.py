@@ -0,0 +1,239 @@
+"""
+Wiping application commands across many guilds against a local Discord stub.
+
+Usage:
+  python -m bench.discord_admin [--guilds 100] [--commands 5] [--latency-ms 40]
+
+`StubDiscord` is a small aiohttp server with the REST routes the admin
+scripts use (application info, guild list, list / delete / bulk-overwrite
+commands). Each request takes ``--latency-ms`` and every (route, guild)
+bucket allows 5 requests per 2 seconds, answered with Discord's
+``X-RateLimit-*`` headers and 429s past the limit; there is also a global
+limit of 50 requests per second. Compared:
+
+  sequential   the old clean_resync.py flow: list, then delete each command
+               with one awaited request at a time (retrying 429s)
+  AdminClient  discord_admin.AdminClient.wipe_commands(): every guild at
+               once, one bulk overwrite per guild, rate-limit aware
+  deletes      one scope at a time, AdminClient.delete_command() for all of
+               its commands at once: concurrent requests on one route and
+               guild before its bucket is known (a stall is reported after
+               ``--timeout``)
+
+The stub is also handy for trying the scripts offline:
+DISCORD_API_BASE=http://127.0.0.1:<port> python clean_resync.py --all-guilds
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from discord_admin import AdminClient
+
+APP_ID = "100000000000000001"
+
+
+class StubDiscord:
+    def __init__(self, guilds, commands, latency=0.04, limit=5, window=2.0, global_limit=50):
+        self.latency = latency
+        self.limit = limit
+        self.window = window
+        self.global_limit = global_limit
+        self.guild_ids = [str(200000000000000000 + i) for i in range(guilds)]
+        self.commands = {None: self._make(commands)}
+        for guild_id in self.guild_ids:
+            self.commands[guild_id] = self._make(commands)
+        # (bucket, major) -> [window start, used]
+        self._buckets = {}
+        self._global = [0.0, 0]
+        self.requests = 0
+        self.rejected = 0
+        self._runner = None
+        self.port = None
+
+    @staticmethod
+    def _make(n):
+        return {str(300000000000000000 + i): {"id": str(300000000000000000 + i), "name": f"cmd{i}",
+                                              "description": f"Command {i}"} for i in range(n)}
+
+    def _limit(self, bucket, major):
+        """Return (headers, retry_after or None) for one request on (bucket, major)."""
+        now = time.monotonic()
+        if now - self._global[0] >= 1.0:
+            self._global[:] = [now, 0]
+        if self._global[1] >= self.global_limit:
+            return {"X-RateLimit-Global": "true"}, 1.0 - (now - self._global[0])
+        self._global[1] += 1
+        state = self._buckets.get((bucket, major))
+        if state is None or now - state[0] >= self.window:
+            state = self._buckets[(bucket, major)] = [now, 0]
+        reset_after = self.window - (now - state[0])
+        headers = {
+            "X-RateLimit-Bucket": bucket,
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+        }
+        if state[1] >= self.limit:
+            headers["X-RateLimit-Remaining"] = "0"
+            return headers, reset_after
+        state[1] += 1
+        headers["X-RateLimit-Remaining"] = str(self.limit - state[1])
+        return headers, None
+
+    async def _handle(self, request, bucket, major, respond):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        headers, retry_after = self._limit(bucket, major)
+        if retry_after is not None:
+            self.rejected += 1
+            is_global = "X-RateLimit-Global" in headers
+            return web.json_response(
+                {"message": "You are being rate limited.", "retry_after": round(retry_after, 3), "global": is_global},
+                status=429, headers=headers,
+            )
+        status, body = respond()
+        if body is None:
+            return web.Response(status=status, headers=headers)
+        return web.json_response(body, status=status, headers=headers)
+
+    async def app_info(self, request):
+        return await self._handle(request, "app", None, lambda: (200, {"id": APP_ID}))
+
+    async def guilds(self, request):
+        after = int(request.query.get("after", 0))
+        limit = int(request.query.get("limit", 200))
+        page = [{"id": g} for g in self.guild_ids if int(g) > after][:limit]
+        return await self._handle(request, "guilds", None, lambda: (200, page))
+
+    def _scope(self, request):
+        return request.match_info.get("guild_id")
+
+    async def list_commands(self, request):
+        scope = self._scope(request)
+        return await self._handle(request, "list", scope, lambda: (200, list(self.commands[scope].values())))
+
+    async def overwrite_commands(self, request):
+        scope = self._scope(request)
+        body = await request.json()
+
+        def respond():
+            self.commands[scope] = {c["id"]: c for c in body}
+            return 200, body
+        return await self._handle(request, "overwrite", scope, respond)
+
+    async def delete_command(self, request):
+        scope = self._scope(request)
+
+        def respond():
+            self.commands[scope].pop(request.match_info["command_id"], None)
+            return 204, None
+        return await self._handle(request, "delete", scope, respond)
+
+    async def start(self):
+        app = web.Application()
+        base = "/applications/{app_id}"
+        app.router.add_get("/oauth2/applications/@me", self.app_info)
+        app.router.add_get("/users/@me/guilds", self.guilds)
+        for prefix in (base, base + "/guilds/{guild_id}"):
+            app.router.add_get(prefix + "/commands", self.list_commands)
+            app.router.add_put(prefix + "/commands", self.overwrite_commands)
+            app.router.add_delete(prefix + "/commands/{command_id}", self.delete_command)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def remaining(self):
+        return sum(len(c) for c in self.commands.values())
+
+
+async def _sequential(base, token, guild_ids):
+    # clean_resync.py before discord_admin: one request at a time
+    headers = {"Authorization": f"Bot {token}"}
+
+    async def _call(session, method, url):
+        while True:
+            async with session.request(method, url, headers=headers) as r:
+                if r.status == 429:
+                    await asyncio.sleep((await r.json())["retry_after"])
+                    continue
+                return await r.json() if r.status == 200 else None
+
+    async with aiohttp.ClientSession() as session:
+        app_id = (await _call(session, "GET", f"{base}/oauth2/applications/@me"))["id"]
+        for guild_id in [None] + guild_ids:
+            prefix = f"{base}/applications/{app_id}" + (f"/guilds/{guild_id}" if guild_id else "")
+            for c in await _call(session, "GET", f"{prefix}/commands"):
+                await _call(session, "DELETE", f"{prefix}/commands/{c['id']}")
+
+
+async def _admin_client(base, token, guild_ids, concurrency, cache):
+    async with AdminClient(token, api_base=base, concurrency=concurrency, app_id_cache=cache) as client:
+        await client.wipe_commands(guild_ids)
+        return client.rate_limited
+
+
+async def _admin_deletes(base, token, guild_ids, concurrency, cache):
+    async with AdminClient(token, api_base=base, concurrency=concurrency, app_id_cache=cache) as client:
+        for guild_id in [None] + guild_ids:
+            commands = await client.list_commands(guild_id)
+            await asyncio.gather(*(client.delete_command(c["id"], guild_id=guild_id) for c in commands))
+
+
+async def _run(label, args, fn):
+    stub = StubDiscord(args.guilds, args.commands, latency=args.latency_ms / 1000)
+    base = await stub.start()
+    try:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(fn(base, stub.guild_ids), args.timeout)
+        except asyncio.TimeoutError:
+            print(f"  {label:<26} stalled: not done within {args.timeout:.0f} s")
+            return
+        elapsed = time.perf_counter() - start
+    finally:
+        await stub.stop()
+    print(
+        f"  {label:<26} {elapsed:7.2f} s  {stub.requests:5d} requests  {stub.rejected:4d} x 429  "
+        f"{stub.remaining()} commands left"
+    )
+
+
+async def _main(args):
+    token = "stub-token"
+    print(f"{args.guilds} guilds + global, {args.commands} commands each, {args.latency_ms:.0f} ms per request")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = os.path.join(tmp, "app_id.json")
+        if not args.skip_sequential:
+            await _run("sequential (old)", args, lambda base, g: _sequential(base, token, g))
+        await _run(f"AdminClient x{args.concurrency}", args,
+                   lambda base, g: _admin_client(base, token, g, args.concurrency, cache))
+        await _run(f"AdminClient x{args.concurrency}, cached id", args,
+                   lambda base, g: _admin_client(base, token, g, args.concurrency, cache))
+        await _run("deletes, scope by scope", args,
+                   lambda base, g: _admin_deletes(base, token, g, args.concurrency, cache))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--commands", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--skip-sequential", action="store_true")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds before a run counts as stalled")
+    args = parser.parse_args()
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
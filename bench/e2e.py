@@ -0,0 +1,344 @@
+"""
+End-to-end load test: a simulated headset fleet and scripted slash commands.
+
+Usage:
+  python -m bench.e2e [--devices 2000] [--concurrency 200] [--out e2e.json] [--compare old.json]
+
+Runs server_ws in this process (WebSocket server on a free local port, DB in
+a temporary directory, no Discord connection) and drives it the way the
+bot does in production:
+
+  connect   every device opens a socket and sends `hello`
+  pair      /link for each device's user (through a stub Interaction), then
+            the device sends `pair` with the code from the reply
+  send      /send to each user's device; the device counts the message
+  library   /vrlibrary refresh=True; the device answers get_library with a
+            library_response of ``--apps`` apps
+  broadcast /broadcast from the bot's owner (a user without a device is
+            refused first); done when every device has the message
+  unlink    half the devices send `unlink`, /unlink covers the other half
+            (those devices receive force_unlink)
+
+Each phase reports operations/s and p50/p99/max latency (device side for
+frames, call-to-last-reply for commands). Memory per connection is the
+RSS growth over the connect phase divided by the device count; the fleet
+runs in the same process, so it includes the client end of each socket.
+Rate limits are switched off for the run.
+
+Results are written as JSON (``--out``, default e2e-<time>.json) with the
+git revision and parameters; ``--compare`` prints the change per phase
+against an earlier file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import subprocess
+import tempfile
+import time
+
+import websockets
+
+from bench.ws_workers import REPO, _free_port, _rss_kb
+
+
+class _Stats:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.started = None
+        self.finished = None
+
+    def summary(self):
+        ms = sorted(x * 1000 for x in self.latencies)
+        wall = (self.finished or time.perf_counter()) - self.started
+        return {
+            "ops": len(ms),
+            "errors": self.errors,
+            "seconds": round(wall, 3),
+            "ops_per_s": round(len(ms) / wall, 1) if wall > 0 else None,
+            "p50_ms": round(ms[len(ms) // 2], 3) if ms else None,
+            "p99_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.99))], 3) if ms else None,
+            "max_ms": round(ms[-1], 3) if ms else None,
+        }
+
+
+class _Response:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send_message(self, content=None, **kwargs):
+        self.interaction.sent.append(content)
+
+
+class _Followup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self.interaction.sent.append(content)
+
+
+class _User:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+class _Bot:
+    """Stands in for the Discord client: /broadcast asks it for the owner."""
+
+    def __init__(self, owner_id):
+        self.owner_id = owner_id
+
+    async def is_owner(self, user):
+        return user.id == self.owner_id
+
+
+class StubInteraction:
+    """The parts of discord.Interaction the slash commands use."""
+
+    def __init__(self, user_id):
+        self.user = _User(user_id)
+        self.response = _Response(self)
+        self.followup = _Followup(self)
+        self.sent = []
+
+
+class SimDevice:
+    def __init__(self, index, apps):
+        self.device_id = f"sim-{index:05d}"
+        self.user_id = 100000 + index
+        self.apps = apps
+        self.ws = None
+        self.replies = asyncio.Queue()
+        self.messages = 0
+        self.force_unlinked = asyncio.Event()
+        self._reader = None
+
+    async def connect(self, uri):
+        self.ws = await websockets.connect(uri, ping_interval=None, max_size=None)
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for frame in self.ws:
+                data = json.loads(frame)
+                mtype = data.get("type")
+                if mtype == "get_library":
+                    await self.ws.send(json.dumps({
+                        "type": "library_response",
+                        "request_id": data["request_id"],
+                        "version": "v1",
+                        "apps": self.apps,
+                    }))
+                elif mtype == "discord_message":
+                    self.messages += 1
+                elif mtype == "force_unlink":
+                    self.force_unlinked.set()
+                else:
+                    self.replies.put_nowait(data)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def request(self, frame):
+        await self.ws.send(json.dumps(frame))
+        return await asyncio.wait_for(self.replies.get(), 30)
+
+    async def close(self):
+        await self.ws.close()
+        await self._reader
+
+
+async def _phase(stats, items, concurrency, op):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(item):
+        async with sem:
+            start = time.perf_counter()
+            try:
+                ok = await op(item)
+            except Exception:
+                ok = False
+            if ok:
+                stats.latencies.append(time.perf_counter() - start)
+            else:
+                stats.errors += 1
+
+    stats.started = time.perf_counter()
+    await asyncio.gather(*(_one(item) for item in items))
+    stats.finished = time.perf_counter()
+    return stats
+
+
+OWNER_ID = 1
+
+
+async def _run(S, devices, concurrency, apps, broadcasts):
+    await S.init_db()
+    server = asyncio.create_task(S.run_websocket_server())
+    await asyncio.sleep(0.5)
+    uri = f"ws://127.0.0.1:{S.WEBSOCKET_PORT}"
+    app_list = [{"name": f"App {i}", "package": f"com.example.app{i}", "version": "1.0"} for i in range(apps)]
+    fleet = [SimDevice(i, app_list) for i in range(devices)]
+    phases = []
+
+    async def _command(cmd, user_id, **kwargs):
+        interaction = StubInteraction(user_id)
+        await cmd.callback(interaction, **kwargs)
+        return interaction.sent
+
+    async def connect(d):
+        await d.connect(uri)
+        reply = await d.request({"type": "hello", "device_id": d.device_id, "device_name": f"Sim {d.device_id}"})
+        return reply.get("ok")
+
+    async def pair(d):
+        sent = await _command(S.link_cmd, d.user_id)
+        code = re.search(r"`(\d{6})`", sent[-1]).group(1)
+        reply = await d.request({"type": "pair", "code": code, "device_id": d.device_id})
+        return reply.get("ok")
+
+    async def send(d):
+        sent = await _command(S.send_cmd, d.user_id, message="load test")
+        return sent and sent[-1].startswith("✅")
+
+    async def library(d):
+        sent = await _command(S.vrlibrary_cmd, d.user_id, refresh=True)
+        return sent and "last known" not in sent[-1] and not sent[-1].startswith(("⚠️", "⏱️", "❌"))
+
+    async def broadcast(_):
+        target = min(d.messages for d in fleet) + 1
+        sent = await _command(S.broadcast_cmd, OWNER_ID, message="load test")
+        if not sent or not sent[-1].startswith("📢"):
+            return False
+        deadline = time.perf_counter() + 10
+        while any(d.messages < target for d in fleet):
+            if time.perf_counter() > deadline:
+                return False
+            await asyncio.sleep(0.001)
+        return True
+
+    async def unlink(d):
+        if int(d.device_id[-5:]) % 2:
+            reply = await d.request({"type": "unlink", "device_id": d.device_id})
+            return reply.get("ok")
+        sent = await _command(S.unlink_cmd, d.user_id)
+        if not sent or "unlinked" not in sent[-1]:
+            return False
+        await asyncio.wait_for(d.force_unlinked.wait(), 10)
+        return True
+
+    rss_before = _rss_kb(os.getpid())
+    phases.append(await _phase(_Stats("connect"), fleet, concurrency, connect))
+    rss_after = _rss_kb(os.getpid())
+    for name, op in (("pair", pair), ("send", send), ("library", library)):
+        phases.append(await _phase(_Stats(name), fleet, concurrency, op))
+    refused = await _command(S.broadcast_cmd, fleet[0].user_id, message="load test")
+    if not refused or not refused[-1].startswith("❌"):
+        raise RuntimeError("/broadcast accepted a user who is not the bot's owner")
+    phases.append(await _phase(_Stats("broadcast"), range(broadcasts), 1, broadcast))
+    phases.append(await _phase(_Stats("unlink"), fleet, concurrency, unlink))
+
+    await asyncio.gather(*(d.close() for d in fleet if d.ws is not None), return_exceptions=True)
+    server.cancel()
+    S.router.close()
+    S.codes.close()
+    S.store.close()
+    return phases, (rss_after - rss_before) / max(1, devices)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_comparison(result, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"vs {baseline_path} ({baseline.get('revision')}):")
+    for name, now in result["phases"].items():
+        old = baseline.get("phases", {}).get(name)
+        if not old:
+            continue
+        parts = []
+        for key in ("ops_per_s", "p50_ms", "p99_ms"):
+            if old.get(key) and now.get(key) is not None:
+                parts.append(f"{key} {(now[key] - old[key]) / old[key]:+.0%}")
+        print(f"  {name:<9} " + "  ".join(parts))
+    old_kb = baseline.get("kb_per_connection")
+    if old_kb:
+        print(f"  memory    {(result['kb_per_connection'] - old_kb) / old_kb:+.0%} per connection")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--apps", type=int, default=200)
+    parser.add_argument("--broadcasts", type=int, default=5)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--compare", default=None)
+    args = parser.parse_args()
+
+    # server_ws keeps links.db in the working directory
+    cwd = os.getcwd()
+    tmp = tempfile.TemporaryDirectory()
+    os.chdir(tmp.name)
+    os.environ.update(
+        PC_LOCAL_IP="127.0.0.1",
+        WEBSOCKET_PORT=str(_free_port()),
+        RUN_DISCORD_BOT="0",
+        METRICS_PORT="0",
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    import server_ws as S
+    S.command_limits.rate = 0
+    S.pair_ip_limits.rate = 0
+    S.pair_device_limits.rate = 0
+    S.limiter.max_per_ip = S.limiter.max_connections = args.devices + 100
+    # no Discord connection, so /broadcast checks its owner against a stub
+    S.bot = _Bot(OWNER_ID)
+
+    phases, kb_per_conn = asyncio.run(_run(S, args.devices, args.concurrency, args.apps, args.broadcasts))
+    result = {
+        "benchmark": "e2e",
+        "revision": _git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": {
+            "devices": args.devices, "concurrency": args.concurrency, "apps": args.apps, "broadcasts": args.broadcasts,
+        },
+        "kb_per_connection": round(kb_per_conn, 1),
+        "phases": {p.name: p.summary() for p in phases},
+    }
+    print(f"{args.devices} devices, concurrency {args.concurrency}, {args.apps} apps per library")
+    for name, s in result["phases"].items():
+        print(
+            f"  {name:<9} {s['ops']:6d} ok {s['errors']:4d} failed  {s['ops_per_s'] or 0:8.0f} ops/s  "
+            f"p50 {s['p50_ms'] or 0:8.2f} ms  p99 {s['p99_ms'] or 0:8.2f} ms  max {s['max_ms'] or 0:8.2f} ms"
+        )
+    print(f"  memory    {kb_per_conn:.1f} KiB RSS per connection (server and client ends)")
+
+    out = os.path.join(cwd, args.out or f"e2e-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"saved {out}")
+    if args.compare:
+        _print_comparison(result, os.path.join(cwd, args.compare))
+    os.chdir(cwd)
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
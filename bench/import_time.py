@@ -0,0 +1,96 @@
+"""
+Start-up cost of the admin scripts, measured with ``python -X importtime``.
+
+Usage:
+  python -m bench.import_time [--runs 5] [--budget-ms 150]
+
+Imports each module in a fresh interpreter ``--runs`` times and reports the
+best cumulative import time from ``-X importtime``, plus which heavy
+packages came along. server_ws is listed for reference: it is what
+clean_resync.py and print_commands.py used to import for BOT_TOKEN.
+
+Also a guard: exits with status 1 if an admin script (or config.py) loads
+discord, websockets, aiohttp or server_ws at import, or takes longer than
+``--budget-ms``.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# not bench.ws_workers.REPO: that module imports websockets, which the
+# light setup checked here need not have
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (module, is an admin entry point that must stay light)
+MODULES = (
+    ("config", True),
+    ("clean_resync", True),
+    ("print_commands", True),
+    ("discord_admin", True),
+    ("server_ws", False),
+)
+HEAVY = ("discord", "websockets", "aiohttp", "server_ws")
+
+
+def _importtime(module):
+    """Return (cumulative microseconds, top-level packages imported, error) for ``import module``.
+
+    ``error`` is the last line of the traceback if the import failed, else None.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        lines = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        return None, set(), lines[-1] if lines else f"exit status {proc.returncode}"
+    total = None
+    loaded = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # the header line
+        name = name.strip()
+        loaded.add(name.split(".")[0])
+        if name == module:
+            total = int(cumulative)
+    return total, loaded, None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    args = parser.parse_args()
+
+    failures = []
+    print(f"best of {args.runs} fresh interpreters")
+    for module, light in MODULES:
+        best = error = None
+        for _ in range(args.runs):
+            us, loaded, error = _importtime(module)
+            if error:
+                break
+            best = us if best is None else min(best, us)
+        if error:
+            print(f"  {module:<16} import failed: {error}")
+            if light:
+                failures.append(f"{module} does not import: {error}")
+            continue
+        heavy = sorted(p for p in HEAVY if p in loaded and p != module)
+        print(f"  {module:<16} {best / 1000:8.1f} ms   heavy: {', '.join(heavy) or '-'}")
+        if light:
+            if heavy:
+                failures.append(f"{module} imports {', '.join(heavy)}")
+            if best / 1000 > args.budget_ms:
+                failures.append(f"{module} takes {best / 1000:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Peak memory and time to turn a device library into a /vrlibrary reply.
+
+Usage:
+  python -m bench.library_render [--apps 5000] [--chunk 500]
+
+"single frame" decodes one library_response holding every app (with the
+icon/metadata fields headsets typically include) and formats every name, as
+/vrlibrary used to. "chunked + paged" feeds library_chunk frames through
+LibraryCache and renders only the first page with LibraryPager.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from library_cache import LibraryCache
+from library_view import LibraryPager
+
+
+def _apps(n):
+    return [
+        {"name": f"Some VR App {i}", "package": f"com.vendor.app{i}", "version": "1.2.3",
+         "icon": "iVBORw0KGgo" * 40, "size": 123456789}
+        for i in range(n)
+    ]
+
+
+def _single_frame(raw):
+    data = json.loads(raw)
+    lines = [f"- {a.get('name') or a.get('title') or str(a)}" for a in data["apps"]]
+    return "\n".join(lines)
+
+
+def _chunked(frames):
+    cache = LibraryCache()
+    reply = None
+    for raw in frames:
+        reply = cache.add_chunk("dev", json.loads(raw))
+    snap = cache.apply_reply("dev", reply)
+    return LibraryPager(1, "dev", snap).render()
+
+
+def _measure(fn, arg):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(arg)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apps", type=int, default=5000)
+    parser.add_argument("--chunk", type=int, default=500)
+    args = parser.parse_args()
+
+    apps = _apps(args.apps)
+    single = json.dumps({"type": "library_response", "request_id": "1", "apps": apps})
+    frames = [
+        json.dumps({"type": "library_chunk", "request_id": "1", "apps": apps[i:i + args.chunk],
+                    "done": i + args.chunk >= len(apps)})
+        for i in range(0, len(apps), args.chunk)
+    ]
+    del apps
+
+    print(f"{args.apps} apps ({len(single) / 1e6:.1f} MB as one frame, {args.chunk} per chunk)")
+    for label, fn, arg in (("single frame", _single_frame, single), ("chunked + paged", _chunked, frames)):
+        elapsed, peak = _measure(fn, arg)
+        print(f"  {label:16s} peak {peak / 1e6:7.2f} MB  {elapsed * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Show that the `hello` (device_id) and `pair` (code) lookups stay constant
+time as the devices and pair_codes tables grow.
+
+Usage:
+  python -m bench.links_lookup [--sizes 10000 1000000] [--lookups 20000]
+
+For each table size the script checks the query plans use the indexes
+added by the schema migrations and reports the mean lookup time. The pair
+path consumes the code with an indexed DELETE; the timing below uses the
+equivalent SELECT so every run sees the same rows. Exits non-zero if either
+statement falls back to a full table scan.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import links_store
+import pairing_codes
+from links_store import LinksStore
+
+SQL_PAIR_LOOKUP = "SELECT user_id FROM pair_codes WHERE code=? AND expires_at > ?"
+
+
+def _build(db_file, rows):
+    store = LinksStore(db_file, pool_size=1)
+    store.open_sync()
+    store.close()
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.executemany(
+            "INSERT INTO devices (device_id, user_id, device_name) VALUES (?, ?, ?)",
+            ((f"dev{i}", f"user{i}", f"Quest-{i}") for i in range(rows)),
+        )
+        conn.executemany(
+            "INSERT INTO pair_codes (code, user_id, expires_at) VALUES (?, ?, ?)",
+            ((f"c{i}", f"user{i}", time.time() + 3600) for i in range(rows)),
+        )
+    conn.close()
+
+
+def _get_user_by_code_sync(conn, code):
+    row = conn.execute(SQL_PAIR_LOOKUP, (code, 0)).fetchone()
+    return row[0] if row else None
+
+
+def _time_lookups(conn, fn, keys):
+    start = time.perf_counter()
+    for key in keys:
+        fn(conn, key)
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+
+def bench(sizes, lookups):
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            db_file = os.path.join(tmp, f"links_{rows}.db")
+            _build(db_file, rows)
+            conn = sqlite3.connect(db_file)
+            statements = (
+                ("hello", links_store.SQL_USER_BY_DEVICE, ("x",)),
+                ("pair", pairing_codes.SQL_CONSUME_CODE, ("x", 0)),
+            )
+            for label, sql, params in statements:
+                plan = " ".join(r[-1] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+                if "USING" not in plan:
+                    print(f"  {label}: full scan at {rows} rows: {plan}")
+                    ok = False
+            rnd = random.Random(rows)
+            picks = [rnd.randrange(rows) for _ in range(lookups)]
+            hello_us = _time_lookups(conn, links_store._get_user_by_device_sync, [f"dev{n}" for n in picks])
+            pair_us = _time_lookups(conn, _get_user_by_code_sync, [f"c{n}" for n in picks])
+            conn.close()
+            print(f"rows={rows:>9}  hello lookup {hello_us:6.2f} us  pair lookup {pair_us:6.2f} us")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+    if not bench(args.sizes, args.lookups):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Compare the pooled `LinksStore` with the old connect-per-call pattern.
+
+Usage:
+  python -m bench.links_store [--rows 5000] [--ops 20000] [--concurrency 200]
+
+Both variants run the same `hello` path (device lookup followed by a
+device_name update) against a temporary DB. Device names are stable, as they
+are for real reconnects, so the store's cache can skip unchanged writes; its
+counters are printed after the run.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from links_store import LinksStore
+
+
+def _seed(db_file, rows):
+    store = LinksStore(db_file, pool_size=1)
+    store.open_sync()
+    store.close()
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.executemany(
+            "INSERT INTO devices (device_id, user_id, device_name) VALUES (?, ?, ?)",
+            ((f"dev{i}", f"user{i}", f"Quest-{i}") for i in range(rows)),
+        )
+    conn.close()
+
+
+def _legacy_get_user_by_device(db_file, device_id):
+    conn = sqlite3.connect(db_file)
+    cur = conn.cursor()
+    cur.execute("SELECT user_id FROM devices WHERE device_id=?", (device_id,))
+    row = cur.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def _legacy_set_device(db_file, user_id, device_id, device_name):
+    conn = sqlite3.connect(db_file)
+    cur = conn.cursor()
+    cur.execute("UPDATE devices SET user_id=?, device_name=? WHERE device_id=?", (user_id, device_name, device_id))
+    conn.commit()
+    conn.close()
+
+
+async def _run(ops, concurrency, one_op):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def worker(i):
+        async with sem:
+            await one_op(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(ops)))
+    return ops / (time.perf_counter() - start)
+
+
+async def bench(rows, ops, concurrency):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "links.db")
+        _seed(db_file, rows)
+        rnd = random.Random(1)
+        picks = [rnd.randrange(rows) for _ in range(ops)]
+
+        async def legacy_op(i):
+            n = picks[i]
+            user_id = await asyncio.to_thread(_legacy_get_user_by_device, db_file, f"dev{n}")
+            if user_id:
+                await asyncio.to_thread(_legacy_set_device, db_file, user_id, f"dev{n}", f"Quest-{n}")
+
+        # write-behind off: both variants commit every name change immediately
+        store = LinksStore(db_file, write_behind=False)
+        await store.open()
+
+        async def pooled_op(i):
+            n = picks[i]
+            user_id = await store.get_user_by_device(f"dev{n}")
+            if user_id:
+                await store.update_device_name(user_id, f"dev{n}", f"Quest-{n}")
+
+        try:
+            legacy = await _run(ops, concurrency, legacy_op)
+            pooled = await _run(ops, concurrency, pooled_op)
+            stats = store.stats()
+        finally:
+            store.close()
+
+    print(f"rows={rows} ops={ops} concurrency={concurrency}")
+    print(f"  connect-per-call: {legacy:10.0f} hello ops/s")
+    print(f"  LinksStore:       {pooled:10.0f} hello ops/s  ({pooled / legacy:.1f}x)")
+    print("  store stats: " + ", ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in stats.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(bench(args.rows, args.ops, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Caller-side cost of logging on the device message path.
+
+Usage:
+  python -m bench.log_overhead [--records 100000] [--stall-us 200]
+
+Logs ``--records`` "Device connected" lines with (a) the old setup:
+logging.basicConfig and an eagerly formatted f-string, (b)
+log_setup.setup_logging with lazy %-arguments and the background writer,
+no rate cap, (c) the same with JSON lines, and (d) with the default rate
+cap of 20 lines per second per message. Each runs once against a plain
+file and once against a sink that stalls ``--stall-us`` per write, like a
+slow terminal or a full pipe. Reported: time spent in the logging call on
+the caller's (event loop's) thread, and the time until the writer thread
+has drained its queue. With a fast sink on one core the writer thread
+competes with the caller for the GIL, so the queue only pays off when the
+sink stalls or records are capped.
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from log_setup import setup_logging, stop_logging
+
+# setup_logging turns these off; the old setup had them on
+_SRCFILE = logging._srcfile
+
+
+def _reset():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def _emit_fstring(n):
+    for i in range(n):
+        device_id, device_name = f"quest-{i % 5000}", "Living room Quest"
+        logging.info(f"Device connected: {device_id} (name={device_name})")
+
+
+def _emit_lazy(n):
+    for i in range(n):
+        device_id, device_name = f"quest-{i % 5000}", "Living room Quest"
+        logging.info("Device connected: %s (name=%s)", device_id, device_name)
+
+
+class _StallingSink:
+    def __init__(self, f, stall):
+        self.f = f
+        self.stall = stall
+
+    def write(self, text):
+        time.sleep(self.stall)
+        return self.f.write(text)
+
+    def flush(self):
+        self.f.flush()
+
+
+def _run(label, n, path, configure, emit, stall=0.0):
+    _reset()
+    with open(path, "w") as f:
+        sink = _StallingSink(f, stall) if stall else f
+        listener = configure(sink)
+        start = time.perf_counter()
+        emit(n)
+        caller = time.perf_counter() - start
+        if listener is not None:
+            stop_logging()
+        drained = time.perf_counter() - start
+    _reset()
+    lines = sum(1 for _ in open(path))
+    print(f"  {label:<34} {caller / n * 1e6:6.2f} us/call on caller, {drained:6.2f} s to drain, {lines} lines")
+
+
+def _basic(sink):
+    logging._srcfile = _SRCFILE
+    logging.logMultiprocessing = True
+    logging.basicConfig(level=logging.INFO, stream=sink, force=True)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--stall-us", type=float, default=200.0)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.log")
+        for stall, n in ((0.0, args.records), (args.stall_us / 1e6, args.records // 10)):
+            print(f"{n} INFO records, " + (f"sink stalls {args.stall_us:.0f} us per write" if stall else "plain file"))
+            _run("basicConfig + f-string (old)", n, path, _basic, _emit_fstring, stall)
+            _run("setup_logging text, lazy", n, path, lambda s: setup_logging(stream=s, rate=0), _emit_lazy, stall)
+            _run("setup_logging json, lazy", n, path, lambda s: setup_logging(stream=s, fmt="json", rate=0), _emit_lazy, stall)
+            _run("setup_logging text, capped 20/s", n, path, lambda s: setup_logging(stream=s), _emit_lazy, stall)
+
+
+if __name__ == "__main__":
+    main()
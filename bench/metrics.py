@@ -0,0 +1,77 @@
+"""
+Cost of the metrics instrumentation on the hot paths.
+
+Usage:
+  python -m bench.metrics [--ops 200000] [--queries 20000]
+
+Reports the per-call cost of Counter.inc and Histogram.observe, the time to
+render a /metrics scrape, and the LinksStore.run round trip for a trivial
+helper with and without the query observer that feeds db_query_seconds.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from links_store import LinksStore
+from metrics import MetricsRegistry
+
+
+def _noop_sync(conn):
+    return None
+
+
+def _per_call_ns(fn, ops):
+    start = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - start) / ops * 1e9
+
+
+async def _store_us(store, queries):
+    start = time.perf_counter()
+    for _ in range(queries):
+        await store.run(_noop_sync)
+    return (time.perf_counter() - start) / queries * 1e6
+
+
+async def _store_bench(queries, observer):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LinksStore(os.path.join(tmp, "links.db"))
+        await store.open()
+        store.observer = observer
+        try:
+            await _store_us(store, 500)
+            return await _store_us(store, queries)
+        finally:
+            store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args()
+    registry = MetricsRegistry(prefix="bench_")
+    counter = registry.counter("frames_total", "frames", ("type",))
+    histogram = registry.histogram("query_seconds", "queries", ("helper",))
+    print(f"Counter.inc          {_per_call_ns(lambda: counter.inc('hello'), args.ops):7.0f} ns")
+    print(f"Histogram.observe    {_per_call_ns(lambda: histogram.observe(0.0031, '_noop_sync'), args.ops):7.0f} ns")
+    for i in range(20):
+        histogram.observe(0.001 * i, f"_helper_{i}_sync")
+    start = time.perf_counter()
+    body = registry.render()
+    print(f"render (21 series)   {(time.perf_counter() - start) * 1e3:7.2f} ms, {len(body)} bytes")
+
+    def observer(helper, wait, elapsed):
+        histogram.observe(wait, helper)
+        histogram.observe(elapsed, helper)
+
+    plain = asyncio.run(_store_bench(args.queries, None))
+    observed = asyncio.run(_store_bench(args.queries, observer))
+    print(f"LinksStore.run       {plain:7.1f} us plain, {observed:7.1f} us with observer ({observed - plain:+.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
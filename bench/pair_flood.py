@@ -0,0 +1,141 @@
+"""
+Load test: latency for legitimate devices while a client floods `pair`.
+
+Usage:
+  python -m bench.pair_flood [--devices 20] [--flooders 50] [--seconds 5]
+
+Starts server_ws (RUN_DISCORD_BOT=0, shared-sqlite backend, so every
+unknown code costs a DB lookup) in a temporary directory, then runs four
+phases: no flood, a flood with the pair limits off
+(PAIR_ATTEMPTS_PER_MINUTE=0), a flood with the default limits (per
+device_id only) and one with PAIR_IP_ATTEMPTS_PER_MINUTE=10 as well. During
+each phase ``--devices`` clients send a `hello` every 50 ms and time the
+ack; a separate process opens ``--flooders`` sockets from 127.0.0.2 that
+send `pair` with random codes as fast as the replies come back. Reported:
+hello round-trip p50/p99 and the flood's attempts/s and rejected share.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from bench.ws_workers import REPO, _free_port, _wait_for_port
+
+FLOOD_ADDR = "127.0.0.2"
+
+
+async def _flood(port, sockets, seconds, results):
+    uri = f"ws://127.0.0.1:{port}"
+    deadline = time.monotonic() + seconds
+    counts = {"sent": 0, "rate_limited": 0}
+
+    async def _attacker(i):
+        async with websockets.connect(uri, ping_interval=None, local_addr=(FLOOD_ADDR, 0)) as ws:
+            while time.monotonic() < deadline:
+                code = f"{random.randrange(1000000):06d}"
+                await ws.send(json.dumps({"type": "pair", "code": code, "device_id": f"flood-{i}-{code}"}))
+                reply = json.loads(await ws.recv())
+                counts["sent"] += 1
+                counts["rate_limited"] += reply.get("reason") == "rate_limited"
+
+    await asyncio.gather(*(_attacker(i) for i in range(sockets)))
+    results.put(counts)
+
+
+def _flood_main(port, sockets, seconds, results):
+    asyncio.run(_flood(port, sockets, seconds, results))
+
+
+async def _devices(port, devices, seconds):
+    uri = f"ws://127.0.0.1:{port}"
+    latencies = []
+
+    async def _device(i):
+        async with websockets.connect(uri, ping_interval=None) as ws:
+            hello = json.dumps({"type": "hello", "device_id": f"legit-{i}"})
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                await ws.send(hello)
+                await ws.recv()
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.05)
+
+    await asyncio.gather(*(_device(i) for i in range(devices)))
+    return latencies
+
+
+def run(label, devices, flooders, seconds, pair_limit, ip_limit=None):
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            PYTHONPATH=REPO,
+            RUN_DISCORD_BOT="0",
+            PC_LOCAL_IP="127.0.0.1",
+            WEBSOCKET_PORT=str(port),
+            LINKS_BACKEND="shared-sqlite",
+            WS_MAX_PER_IP=str(max(devices, flooders) + 10),
+        )
+        if pair_limit is not None:
+            env["PAIR_ATTEMPTS_PER_MINUTE"] = str(pair_limit)
+        if ip_limit is not None:
+            env["PAIR_IP_ATTEMPTS_PER_MINUTE"] = str(ip_limit)
+        server = subprocess.Popen(
+            [sys.executable, "-c", "import asyncio, server_ws; asyncio.run(server_ws.main())"],
+            cwd=tmp, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait_for_port(port)
+            time.sleep(0.5)
+            flood = None
+            if flooders:
+                ctx = multiprocessing.get_context("spawn")
+                results = ctx.Queue()
+                flood = ctx.Process(target=_flood_main, args=(port, flooders, seconds, results))
+                flood.start()
+                # let the flood ramp up first
+                time.sleep(0.5)
+            latencies = asyncio.run(_devices(port, devices, seconds))
+            counts = None
+            if flood is not None:
+                counts = results.get()
+                flood.join()
+        finally:
+            server.terminate()
+            server.wait()
+    ms = sorted(x * 1000 for x in latencies)
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+    line = f"{label:>22}: hello p50 {statistics.median(ms):7.2f} ms  p99 {p99:7.2f} ms"
+    if counts:
+        line += (
+            f"   flood {counts['sent'] / seconds:8.0f} pair/s, "
+            f"{counts['rate_limited'] / max(1, counts['sent']):4.0%} rate limited"
+        )
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--flooders", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+    print(f"{os.cpu_count()} CPU(s); {args.devices} devices, {args.flooders} flood sockets from {FLOOD_ADDR}")
+    run("no flood", args.devices, 0, args.seconds, None)
+    run("flood, limits off", args.devices, args.flooders, args.seconds, 0)
+    run("flood, default limits", args.devices, args.flooders, args.seconds, None)
+    run("flood, per-IP limit on", args.devices, args.flooders, args.seconds, None, 10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Frames per second through the device message dispatcher.
+
+Usage:
+  python -m bench.protocol [--frames 200000]
+
+Feeds a mix of hello, response, library_chunk and malformed frames through
+(a) the old ws_handler pattern (json.loads, an if-chain over the types,
+json.dumps for each reply) and (b) protocol.Dispatcher with trivial
+handlers, once with the installed fast codec and once with the stdlib json
+fallback. Handlers do no I/O, so the numbers are decode + validate +
+dispatch + reply encoding only.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import protocol
+
+FRAMES = [
+    json.dumps({"type": "hello", "device_id": "quest-1234", "device_name": "Living room Quest"}),
+    json.dumps({"type": "response", "request_id": "a1b2c3-42", "result": {"ok": True, "battery": 87}}),
+    json.dumps({"type": "library_chunk", "request_id": "a1b2c3-43",
+                "apps": [{"name": f"App {i}", "package": f"com.example.app{i}"} for i in range(20)]}),
+    json.dumps({"type": "hello", "device_id": "quest-5678"}),
+    "not json at all",
+]
+
+
+class _Sink:
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, message):
+        self.sent += 1
+
+
+async def _old_handler(ws, frames):
+    # ws_handler before protocol.py: parse, walk the chain, dumps every reply
+    for message in frames:
+        try:
+            data = json.loads(message)
+        except Exception:
+            continue
+        mtype = data.get("type")
+        if mtype == "hello":
+            if data.get("device_id"):
+                await ws.send(json.dumps({"type": "hello", "ok": True}))
+            continue
+        if mtype == "pair":
+            continue
+        if mtype == "unlink":
+            continue
+        if mtype == "response":
+            continue
+        if mtype in ("library_response", "library", "library_delta"):
+            continue
+        if mtype == "library_chunk":
+            continue
+
+
+def _dispatcher():
+    messages = protocol.Dispatcher()
+
+    @messages.handler("hello", required={"device_id": str}, optional={"device_name": str})
+    async def on_hello(conn, data):
+        conn.device_id = data["device_id"]
+        await conn.send(protocol.HELLO_OK, "hello")
+
+    @messages.handler("pair", required={"code": str, "device_id": str}, optional={"device_name": str})
+    @messages.handler("unlink", required={"device_id": str})
+    @messages.handler("library_response", required={"request_id": (str, int)})
+    async def on_other(conn, data):
+        pass
+
+    @messages.handler("response", required={"request_id": (str, int)})
+    async def on_response(conn, data):
+        pass
+
+    @messages.handler("library_chunk", required={"request_id": (str, int)}, optional={"apps": list})
+    async def on_chunk(conn, data):
+        pass
+
+    return messages
+
+
+async def _new_handler(ws, frames):
+    messages = _dispatcher()
+    conn = protocol.Connection(ws, messages.count_sent)
+    for message in frames:
+        await messages.dispatch(conn, message)
+
+
+def _run(label, fn, frames):
+    ws = _Sink()
+    start = time.perf_counter()
+    asyncio.run(fn(ws, frames))
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {len(frames) / elapsed:10.0f} frames/s  ({ws.sent} replies)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=200000)
+    args = parser.parse_args()
+    frames = [FRAMES[i % len(FRAMES)] for i in range(args.frames)]
+    print(f"{args.frames} frames, {len(FRAMES)}-frame mix")
+    _run("json + if-chain (old)", _old_handler, frames)
+    _run(f"Dispatcher ({protocol.CODEC})", _new_handler, frames)
+    if protocol.CODEC != "json":
+        # swap in the stdlib fallback the dispatcher uses without orjson/msgspec
+        fast = protocol.decode
+        protocol.decode = json.loads
+        try:
+            _run("Dispatcher (json fallback)", _new_handler, frames)
+        finally:
+            protocol.decode = fast
+
+
+if __name__ == "__main__":
+    main()
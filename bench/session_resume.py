@@ -0,0 +1,118 @@
+"""
+Reconnect storm after a restart: link lookups vs session tokens vs warm start.
+
+Usage:
+  python -m bench.session_resume [--devices 2000] [--concurrency 200]
+
+Runs server_ws in this process (as bench.e2e does) with ``--devices``
+linked devices. Each scenario empties the LinkCache, as a restart does,
+opens every socket and then times one `hello` per device:
+
+  lookup      hello without a session: `devices` lookup plus a queued
+              device_name write per device (the behaviour before tokens)
+  session     hello with the token from an earlier pair/hello: HMAC check,
+              no DB access
+  warm start  hello without a session after warm_start.load() preloaded
+              the cache from a shutdown snapshot
+
+Reported: hellos/s, p50/p99 hello round trip, and the SQLite reads and
+device_name rows written during the storm (after the write-behind queue
+drained). The fleet runs in the same process and on one core, so client
+work is part of every number.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+import warm_start
+from bench.e2e import SimDevice, _phase, _Stats
+from bench.ws_workers import _free_port
+
+
+async def _storm(S, fleet, concurrency, uri, label, tokens=None, warm=False):
+    store = S.store
+    await store.flush()
+    if warm:
+        snapshot = os.path.join(tempfile.gettempdir(), f"session-resume-{os.getpid()}.json")
+        warm_start.save(snapshot, S.DB_FILE, [d.device_id for d in fleet])
+    store.cache.clear()
+    if warm:
+        await warm_start.load(snapshot, store)
+    await _phase(_Stats("connect"), fleet, concurrency, lambda d: d.connect(uri))
+    before = store.stats()
+
+    async def hello(d):
+        frame = {"type": "hello", "device_id": d.device_id, "device_name": f"Sim {d.device_id}"}
+        if tokens:
+            frame["session"] = tokens[d.device_id]
+        reply = await d.request(frame)
+        if tokens is not None and "session" in reply:
+            tokens[d.device_id] = reply["session"]
+        return reply.get("ok")
+
+    stats = await _phase(_Stats(label), fleet, concurrency, hello)
+    await store.flush()
+    after = store.stats()
+    await asyncio.gather(*(d.close() for d in fleet), return_exceptions=True)
+    # let the server finish with the old sockets before the next storm
+    await asyncio.sleep(0.5)
+    s = stats.summary()
+    print(
+        f"  {label:<11} {s['ops']:6d} ok {s['errors']:3d} failed  {s['ops_per_s'] or 0:7.0f} hellos/s  "
+        f"p50 {s['p50_ms'] or 0:7.2f} ms  p99 {s['p99_ms'] or 0:7.2f} ms  "
+        f"{after['db_reads'] - before['db_reads']:5d} DB reads  "
+        f"{after['flushed_rows'] - before['flushed_rows']:5d} rows written"
+    )
+
+
+async def _run(S, devices, concurrency):
+    await S.init_db()
+    server = asyncio.create_task(S.run_websocket_server())
+    await asyncio.sleep(0.5)
+    uri = f"ws://127.0.0.1:{S.WEBSOCKET_PORT}"
+    fleet = [SimDevice(i, []) for i in range(devices)]
+    tokens = {}
+    for d in fleet:
+        await S.store.link_device(str(d.user_id), d.device_id, f"Sim {d.device_id}")
+        tokens[d.device_id] = S.sessions.issue(d.device_id, str(d.user_id), f"Sim {d.device_id}")
+
+    print(f"{devices} linked devices reconnecting, concurrency {concurrency}")
+    await _storm(S, fleet, concurrency, uri, "lookup")
+    await _storm(S, fleet, concurrency, uri, "session", tokens=tokens)
+    await _storm(S, fleet, concurrency, uri, "warm start", warm=True)
+    print(f"  tokens: {S.sessions.stats()}")
+
+    server.cancel()
+    S.router.close()
+    S.codes.close()
+    S.store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    tmp = tempfile.TemporaryDirectory()
+    os.chdir(tmp.name)
+    os.environ.update(
+        PC_LOCAL_IP="127.0.0.1",
+        WEBSOCKET_PORT=str(_free_port()),
+        RUN_DISCORD_BOT="0",
+        METRICS_PORT="0",
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    import server_ws as S
+    S.limiter.max_per_ip = S.limiter.max_connections = args.devices + 100
+    try:
+        asyncio.run(_run(S, args.devices, args.concurrency))
+    finally:
+        os.chdir(cwd)
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
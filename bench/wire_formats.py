@@ -0,0 +1,84 @@
+"""
+Size and decode cost of a library_response in each wire format.
+
+Usage:
+  python -m bench.wire_formats [--apps 100 1000 5000]
+
+Builds a realistic library reply (name, package, version, icon URL, size)
+and reports its payload size as JSON text, MessagePack and CBOR (whichever
+are installed), each raw and after permessage-deflate with the server's
+settings (server_ws.WS_DEFLATE_WINDOW_BITS / WS_DEFLATE_MEM_LEVEL), plus
+how long protocol's decoder takes to turn it back into a dict.
+"""
+import argparse
+import time
+import zlib
+
+import protocol
+
+# kept in sync with server_ws; importing it would pull in discord.py
+WINDOW_BITS = 12
+MEM_LEVEL = 5
+
+
+def _library(n):
+    return {
+        "type": "library_response",
+        "request_id": "a1b2c3-7",
+        "version": "2024-06-01T12:00:00Z",
+        "apps": [
+            {
+                "name": f"Example App {i}",
+                "package": f"com.example.vendor{i % 37}.app{i}",
+                "version": f"1.{i % 10}.{i % 7}",
+                "icon": f"https://cdn.example.com/icons/{i:06d}.png",
+                "size_bytes": 50_000_000 + i * 1234,
+                "installed": True,
+            }
+            for i in range(n)
+        ],
+    }
+
+
+def _deflate(payload):
+    # a fresh compressor per message: the worst case (no context takeover)
+    c = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -WINDOW_BITS, MEM_LEVEL)
+    return len(c.compress(payload) + c.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def _decode_us(decode, payload, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(payload)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apps", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    formats = [("json", protocol.encode, protocol.decode)]
+    for name, (decode, encode) in protocol.BINARY_CODECS.items():
+        formats.append((name, encode, decode))
+    missing = {"msgpack", "cbor"} - set(protocol.BINARY_CODECS)
+    if missing:
+        print(f"(not installed: {', '.join(sorted(missing))})")
+    for n in args.apps:
+        reply = _library(n)
+        print(f"{n} apps")
+        baseline = None
+        for name, encode, decode in formats:
+            payload = encode(reply)
+            raw = payload.encode() if isinstance(payload, str) else payload
+            deflated = _deflate(raw)
+            baseline = baseline or len(raw)
+            print(
+                f"  {name:<8} {len(raw) / 1024:9.1f} KiB raw ({len(raw) / baseline:4.0%})  "
+                f"{deflated / 1024:8.1f} KiB deflated ({deflated / baseline:4.0%})  "
+                f"decode {_decode_us(decode, payload, args.repeat):9.0f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
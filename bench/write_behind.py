@@ -0,0 +1,77 @@
+"""
+Reconnect storm: N linked devices send `hello` at the same moment.
+
+Usage:
+  python -m bench.write_behind [--devices 10000]
+
+Compares a store that commits each device_name update on its own with the
+write-behind mode that batches them. Each run starts with a cold cache and
+fresh names, as after a server restart where every headset reports in.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from links_store import LinksStore
+
+
+def _seed(db_file, devices):
+    store = LinksStore(db_file, pool_size=1)
+    store.open_sync()
+    store.close()
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.executemany(
+            "INSERT INTO devices (device_id, user_id, device_name) VALUES (?, ?, ?)",
+            ((f"dev{i}", f"user{i}", "old") for i in range(devices)),
+        )
+    conn.close()
+
+
+async def _storm(db_file, devices, write_behind):
+    store = LinksStore(db_file, write_behind=write_behind)
+    await store.open()
+
+    async def hello(i):
+        # same steps as the hello branch of ws_handler
+        user_id = await store.get_user_by_device(f"dev{i}")
+        if user_id:
+            await store.update_device_name(user_id, f"dev{i}", f"Quest-{i}-{write_behind}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(hello(i) for i in range(devices)))
+    await store.flush()
+    elapsed = time.perf_counter() - start
+    stats = store.stats()
+    store.close()
+
+    conn = sqlite3.connect(db_file)
+    written = conn.execute("SELECT COUNT(*) FROM devices WHERE device_name=?", (f"Quest-0-{write_behind}",)).fetchone()[0]
+    conn.close()
+    assert written == 1, "device_name update was lost"
+    return elapsed, stats
+
+
+async def bench(devices):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "links.db")
+        _seed(db_file, devices)
+        print(f"{devices} simultaneous hellos")
+        for label, write_behind in (("commit per hello", False), ("write-behind", True)):
+            elapsed, stats = await _storm(db_file, devices, write_behind)
+            transactions = stats["flushes"] if write_behind else stats["db_writes"]
+            print(f"  {label:17s} {elapsed:7.2f} s  {devices / elapsed:9.0f} hellos/s  {transactions:6d} write transactions")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=10000)
+    args = parser.parse_args()
+    asyncio.run(bench(args.devices))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Load test: WebSocket connection capacity with 0, 1, 2, ... worker processes.
+
+Usage:
+  python -m bench.ws_workers [--workers 0 1 2 4] [--connections 2000] [--clients 4] [--messages 20]
+
+For each worker count, starts server_ws (RUN_DISCORD_BOT=0) in a temporary
+directory: 0 is the default single-process server, N > 0 is WS_WORKERS=N
+with SO_REUSEPORT and the shared-sqlite backend. ``--clients`` load
+generator processes then open ``--connections`` sockets in total, each
+doing a `hello` handshake, and once all are up every socket sends
+``--messages`` more hellos, waiting for each ack. Reported: handshakes/s,
+acked messages/s and the server's total RSS. Scaling needs free cores for
+both the workers and the load generators; on a single core the numbers
+stay flat.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start listening on port {port}")
+
+
+def _rss_kb(pid):
+    """RSS of a process and its children, from /proc (Linux only)."""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+        except OSError:
+            pass
+    return total
+
+
+async def _client(port, first, count, messages, barrier, results):
+    uri = f"ws://127.0.0.1:{port}"
+    sockets = []
+    start = time.time()
+
+    async def _connect(i):
+        ws = await websockets.connect(uri, open_timeout=30, ping_interval=None)
+        await ws.send(json.dumps({"type": "hello", "device_id": f"load-{i}", "device_name": f"Load {i}"}))
+        await ws.recv()
+        sockets.append(ws)
+
+    sem = asyncio.Semaphore(200)
+
+    async def _limited(i):
+        async with sem:
+            await _connect(i)
+
+    await asyncio.gather(*(_limited(i) for i in range(first, first + count)))
+    connected = time.time()
+    await asyncio.to_thread(barrier.wait)
+    msg_start = time.time()
+
+    async def _chatter(i, ws):
+        hello = json.dumps({"type": "hello", "device_id": f"load-{i}"})
+        for _ in range(messages):
+            await ws.send(hello)
+            await ws.recv()
+
+    await asyncio.gather(*(_chatter(first + n, ws) for n, ws in enumerate(sockets)))
+    done = time.time()
+    await asyncio.to_thread(barrier.wait)
+    results.put((start, connected, msg_start, done, len(sockets)))
+    await asyncio.gather(*(ws.close() for ws in sockets))
+
+
+def _client_main(port, first, count, messages, barrier, results):
+    asyncio.run(_client(port, first, count, messages, barrier, results))
+
+
+def run(workers, connections, clients, messages):
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            PYTHONPATH=REPO,
+            RUN_DISCORD_BOT="0",
+            PC_LOCAL_IP="127.0.0.1",
+            WEBSOCKET_PORT=str(port),
+            WS_WORKERS=str(workers),
+            WS_BUS_SOCKET=os.path.join(tmp, "bus.sock"),
+            # every load socket comes from 127.0.0.1
+            WS_MAX_PER_IP=str(connections),
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-c", "import asyncio, server_ws; asyncio.run(server_ws.main())"],
+            cwd=tmp, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait_for_port(port)
+            # give every worker time to bind before load starts
+            time.sleep(1.0 + 0.5 * workers)
+            ctx = multiprocessing.get_context("spawn")
+            barrier = ctx.Barrier(clients + 1)
+            results = ctx.Queue()
+            per_client = connections // clients
+            procs = [
+                ctx.Process(target=_client_main, args=(port, i * per_client, per_client, messages, barrier, results))
+                for i in range(clients)
+            ]
+            for p in procs:
+                p.start()
+            barrier.wait()
+            rss = _rss_kb(server.pid)
+            barrier.wait()
+            rows = [results.get() for _ in procs]
+            for p in procs:
+                p.join()
+        finally:
+            server.terminate()
+            server.wait()
+    start = min(r[0] for r in rows)
+    connected = max(r[1] for r in rows)
+    msg_start = min(r[2] for r in rows)
+    done = max(r[3] for r in rows)
+    total = sum(r[4] for r in rows)
+    label = "single process" if workers == 0 else f"{workers} worker(s)"
+    print(
+        f"{label:>16}: {total} connections  {total / (connected - start):8.0f} handshakes/s  "
+        f"{total * messages / (done - msg_start):8.0f} msgs/s  server RSS {rss / 1024:6.1f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+    print(f"{os.cpu_count()} CPU(s); {args.clients} load generator processes")
+    for workers in args.workers:
+        run(workers, args.connections, args.clients, args.messages)
+
+
+if __name__ == "__main__":
+    main()
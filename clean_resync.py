@@ -3,109 +3,69 @@ Delete all existing application commands (global and optionally guild) and then
 so the local `server_ws.py` registrations are synced freshly.
 
 Usage:
-  python clean_resync.py            # deletes global commands, asks to restart bot
-  python clean_resync.py --guild GUILD_ID
-  python clean_resync.py --restart  # after deleting, spawn server_ws.py
-
-This script reads `BOT_TOKEN` from `server_ws.py` (no env required).
+  python clean_resync.py                       # deletes global commands, asks to restart bot
+  python clean_resync.py --guild GUILD_ID      # also this guild (repeatable)
+  python clean_resync.py --all-guilds          # also every guild the bot is in
+  python clean_resync.py --restart             # after deleting, spawn server_ws.py
+
+The token comes from config.py (BOT_TOKEN, bot_linker.json or --token), so
+the script starts without loading discord.py or the bot. Guilds are
+cleared concurrently (see discord_admin.py), each with one bulk overwrite.
 """
 import asyncio
-import aiohttp
+import os
 import sys
 import argparse
 import subprocess
-from server_ws import BOT_TOKEN
-
-API_BASE = "https://discord.com/api/v10"
-
-
-async def fetch_app_id(session, token):
-    url = f"{API_BASE}/oauth2/applications/@me"
-    headers = {"Authorization": f"Bot {token}"}
-    async with session.get(url, headers=headers) as r:
-        if r.status != 200:
-            text = await r.text()
-            raise RuntimeError(f"Failed to fetch application info: {r.status} {text}")
-        data = await r.json()
-        return data.get("id")
-
-
-async def list_global_commands(session, app_id, token):
-    url = f"{API_BASE}/applications/{app_id}/commands"
-    headers = {"Authorization": f"Bot {token}"}
-    async with session.get(url, headers=headers) as r:
-        if r.status != 200:
-            text = await r.text()
-            raise RuntimeError(f"Failed to list global commands: {r.status} {text}")
-        return await r.json()
-
-
-async def delete_global_command(session, app_id, cmd_id, token):
-    url = f"{API_BASE}/applications/{app_id}/commands/{cmd_id}"
-    headers = {"Authorization": f"Bot {token}"}
-    async with session.delete(url, headers=headers) as r:
-        return r.status
-
-
-async def list_guild_commands(session, app_id, guild_id, token):
-    url = f"{API_BASE}/applications/{app_id}/guilds/{guild_id}/commands"
-    headers = {"Authorization": f"Bot {token}"}
-    async with session.get(url, headers=headers) as r:
-        if r.status != 200:
-            text = await r.text()
-            raise RuntimeError(f"Failed to list guild commands: {r.status} {text}")
-        return await r.json()
-
-
-async def delete_guild_command(session, app_id, guild_id, cmd_id, token):
-    url = f"{API_BASE}/applications/{app_id}/guilds/{guild_id}/commands/{cmd_id}"
-    headers = {"Authorization": f"Bot {token}"}
-    async with session.delete(url, headers=headers) as r:
-        return r.status
+import config
+from discord_admin import AdminClient
+from command_sync import COMMAND_SYNC_FILE
 
 
 async def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--guild', '-g', help='Guild ID to also clear guild commands for')
+    parser.add_argument('--guild', '-g', action='append', default=[], help='Guild ID to also clear guild commands for')
+    parser.add_argument('--all-guilds', action='store_true', help='Also clear commands in every guild the bot is in')
+    parser.add_argument('--concurrency', type=int, default=10, help='Requests in flight at once')
     parser.add_argument('--restart', '-r', action='store_true', help='After cleaning, start server_ws.py')
+    config.add_arguments(parser, ('token',))
     args = parser.parse_args()
 
-    if not BOT_TOKEN or BOT_TOKEN == 'YOUR_BOT_TOKEN_HERE':
-        print('BOT_TOKEN is not set in server_ws.py. Please set it to your bot token.')
+    try:
+        settings = config.load(args)
+    except config.ConfigError as e:
+        print(e)
+        return
+    if settings.token_missing():
+        print('BOT_TOKEN is not set. Set it in the environment, bot_linker.json or with --token.')
         return
 
-    async with aiohttp.ClientSession() as session:
-        app_id = await fetch_app_id(session, BOT_TOKEN)
+    async with AdminClient(settings.token, concurrency=args.concurrency) as client:
+        app_id = await client.app_id()
         print(f'Application ID: {app_id}')
 
-        # delete global commands
-        print('Fetching global commands...')
-        globals_cmds = await list_global_commands(session, app_id, BOT_TOKEN)
-        if not globals_cmds:
-            print('No global commands found.')
-        else:
-            print(f'Found {len(globals_cmds)} global commands — deleting...')
-            for c in globals_cmds:
-                cid = c.get('id')
-                name = c.get('name')
-                status = await delete_global_command(session, app_id, cid, BOT_TOKEN)
-                print(f'  Deleted global {name} (id={cid}) -> status {status}')
-
-        # optionally delete guild commands
-        if args.guild:
-            guild_id = args.guild
-            print(f'Fetching guild commands for {guild_id}...')
-            guild_cmds = await list_guild_commands(session, app_id, guild_id, BOT_TOKEN)
-            if not guild_cmds:
-                print('No guild commands found.')
+        guild_ids = list(args.guild)
+        if args.all_guilds:
+            guild_ids += [g['id'] for g in await client.guilds() if g['id'] not in guild_ids]
+        print('Clearing global commands' + (f' and {len(guild_ids)} guild(s)...' if guild_ids else '...'))
+
+        results = await client.wipe_commands(guild_ids)
+        for guild_id, removed in results.items():
+            scope = 'global' if guild_id is None else f'guild {guild_id}'
+            if isinstance(removed, Exception):
+                print(f'  Failed to clear {scope}: {removed}')
+            elif not removed:
+                print(f'  No {scope} commands found.')
             else:
-                print(f'Found {len(guild_cmds)} guild commands — deleting...')
-                for c in guild_cmds:
-                    cid = c.get('id')
-                    name = c.get('name')
-                    status = await delete_guild_command(session, app_id, guild_id, cid, BOT_TOKEN)
-                    print(f'  Deleted guild {name} (id={cid}) -> status {status}')
-
+                names = ', '.join(c.get('name') for c in removed)
+                print(f'  Deleted {len(removed)} {scope} commands: {names}')
+        print(f'{client.requests} requests, {client.rate_limited} rate limited')
+
+    # the bot skips syncing commands it thinks are already registered
+    try:
+        os.remove(COMMAND_SYNC_FILE)
+    except FileNotFoundError:
+        pass
     print('\nFinished deleting commands.')
     if args.restart:
         print('Starting server_ws.py...')
@@ -0,0 +1,47 @@
+"""
+Remember which slash-command definitions were last synced to Discord.
+
+`on_ready` runs on every gateway reconnect. Fetching the global commands,
+deleting duplicates and `tree.sync()` only matter when the commands
+defined in server_ws.py changed, so the bot hashes the payload `sync()`
+would upload and stores it in COMMAND_SYNC_FILE after a successful sync.
+When the hash (and application id) match, the REST round trips are
+skipped; FORCE_COMMAND_SYNC=1 syncs anyway (e.g. after clean_resync.py).
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+COMMAND_SYNC_FILE = "command_sync.json"
+
+
+def fingerprint(tree):
+    """Hash of the global command payload ``tree.sync()`` would send."""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda c: c["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def needs_sync(application_id, digest, path=COMMAND_SYNC_FILE):
+    state = _load(path)
+    return state.get("fingerprint") != digest or state.get("application_id") != str(application_id)
+
+
+def record_sync(application_id, digest, path=COMMAND_SYNC_FILE):
+    state = {"application_id": str(application_id), "fingerprint": digest, "synced_at": time.time()}
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.warning("Could not record command sync: %s", e)
@@ -0,0 +1,104 @@
+"""
+Settings shared by server_ws.py and the admin scripts.
+
+Importing this module is cheap (standard library only): clean_resync.py and
+print_commands.py need the bot token, not discord.py, websockets or a bot
+object, so they read it from here instead of importing server_ws.py.
+
+Each setting is taken from, lowest priority first:
+
+  1. the default in SETTINGS
+  2. a JSON config file: ``--config PATH``, else $BOT_LINKER_CONFIG, else
+     bot_linker.json in the working directory if it exists
+  3. its environment variable
+  4. its command-line option, for scripts that call add_arguments()
+
+The config file holds an object with any of the setting names, e.g.
+``{"token": "...", "websocket_port": 8765, "db_file": "/srv/links.db"}``.
+"""
+import json
+import os
+
+CONFIG_FILE = "bot_linker.json"
+
+# REQUIRED: the bot token, from BOT_TOKEN, the config file or --token.
+# Never put a real token in this file: it is committed to version control.
+DEFAULT_BOT_TOKEN = "YOUR_BOT_TOKEN_HERE"
+
+# (name, environment variable, command-line option, type, default, help)
+SETTINGS = (
+    ("token", "BOT_TOKEN", "--token", str, DEFAULT_BOT_TOKEN, "Discord bot token"),
+    ("websocket_port", "WEBSOCKET_PORT", "--port", int, 8765, "WebSocket server port"),
+    # None: autodetect the LAN address when the server starts
+    ("bind_ip", "PC_LOCAL_IP", "--bind-ip", str, None, "address the WebSocket server binds to"),
+    ("db_file", "LINKS_DB", "--db", str, "links.db", "SQLite database path"),
+)
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class Config:
+    """Resolved settings; attributes are the names in SETTINGS."""
+
+    def __init__(self, **values):
+        for name, _, _, _, default, _ in SETTINGS:
+            setattr(self, name, values.get(name, default))
+
+    def token_missing(self):
+        return not self.token or self.token == DEFAULT_BOT_TOKEN
+
+    def __repr__(self):
+        shown = {name: getattr(self, name) for name, *_ in SETTINGS if name != "token"}
+        return f"Config({', '.join(f'{k}={v!r}' for k, v in shown.items())}, token=...)"
+
+
+def add_arguments(parser, names=None):
+    """Add ``--config`` and the options for ``names`` (default: all settings) to an argparse parser."""
+    parser.add_argument("--config", default=None, help=f"JSON settings file (default: {CONFIG_FILE})")
+    for name, env, option, kind, _, text in SETTINGS:
+        if names is None or name in names:
+            parser.add_argument(option, dest=name, type=kind, default=None, help=f"{text} (env {env})")
+
+
+def _read_file(path, explicit):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        if explicit:
+            raise ConfigError(f"config file not found: {path}")
+        return {}
+    except (OSError, ValueError) as e:
+        raise ConfigError(f"could not read config file {path}: {e}")
+    if not isinstance(data, dict):
+        raise ConfigError(f"config file {path} must hold a JSON object")
+    return data
+
+
+def load(args=None, environ=None):
+    """Resolve every setting from defaults, the config file, ``environ`` and ``args``.
+
+    ``args`` is an argparse namespace from a parser set up with add_arguments()
+    (or None); ``environ`` defaults to os.environ.
+    """
+    environ = os.environ if environ is None else environ
+    path = getattr(args, "config", None) or environ.get("BOT_LINKER_CONFIG")
+    from_file = _read_file(path or CONFIG_FILE, explicit=bool(path))
+    values = {}
+    for name, env, option, kind, default, _ in SETTINGS:
+        value = getattr(args, name, None)
+        source = option
+        if value is None and environ.get(env):
+            value, source = environ[env], env
+        if value is None and from_file.get(name) is not None:
+            value, source = from_file[name], f"{path or CONFIG_FILE}: {name}"
+        if value is None:
+            values[name] = default
+            continue
+        try:
+            values[name] = kind(value)
+        except (TypeError, ValueError):
+            raise ConfigError(f"{source}: expected {kind.__name__}, got {value!r}")
+    return Config(**values)
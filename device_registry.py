@@ -0,0 +1,132 @@
+"""
+Registry of connected devices.
+
+`DeviceRegistry` owns the device -> websocket map and the table of
+pending device requests. Every operation is O(1) and none of them await,
+so on a single event loop no lock is needed: nothing can interleave with a
+dict update.
+
+For deployments that touch the registry from several event loops (threads),
+pass ``shards > 1``: devices are spread over shards by device_id and each
+shard is guarded by its own short-held threading.Lock, so unrelated devices
+never contend.
+"""
+import asyncio
+import contextlib
+import threading
+
+
+def settle_future(fut, result=None, exc=None):
+    """Resolve a pending-request future, even if it belongs to another loop."""
+    def _set():
+        if fut.done():
+            return
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+
+    loop = fut.get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        _set()
+    else:
+        loop.call_soon_threadsafe(_set)
+
+
+class _Shard:
+    __slots__ = ("sockets", "pending", "pending_total", "lock")
+
+    def __init__(self, threadsafe):
+        self.sockets = {}
+        # device_id -> {request_id -> asyncio.Future}; indexing by device
+        # keeps disconnect cleanup proportional to that device's requests
+        self.pending = {}
+        self.pending_total = 0
+        self.lock = threading.Lock() if threadsafe else contextlib.nullcontext()
+
+
+class DeviceRegistry:
+    def __init__(self, shards=1):
+        self._shards = [_Shard(shards > 1) for _ in range(max(1, shards))]
+        self._single = self._shards[0] if len(self._shards) == 1 else None
+
+    def _shard(self, device_id):
+        return self._single or self._shards[hash(device_id) % len(self._shards)]
+
+    # ----- connections -----
+
+    def register(self, device_id, websocket):
+        """Map device_id to websocket; returns the socket it replaced, if any."""
+        shard = self._shard(device_id)
+        with shard.lock:
+            previous = shard.sockets.get(device_id)
+            shard.sockets[device_id] = websocket
+        return previous if previous is not websocket else None
+
+    def unregister(self, device_id, websocket):
+        """Remove the mapping only if it still points at this websocket."""
+        shard = self._shard(device_id)
+        with shard.lock:
+            if shard.sockets.get(device_id) is not websocket:
+                return False
+            del shard.sockets[device_id]
+        return True
+
+    def get(self, device_id):
+        return self._shard(device_id).sockets.get(device_id)
+
+    def __contains__(self, device_id):
+        return device_id in self._shard(device_id).sockets
+
+    def __len__(self):
+        return sum(len(s.sockets) for s in self._shards)
+
+    def device_ids(self):
+        for shard in self._shards:
+            with shard.lock:
+                ids = list(shard.sockets)
+            yield from ids
+
+    # ----- pending requests -----
+
+    def add_pending(self, device_id, request_id, fut):
+        shard = self._shard(device_id)
+        with shard.lock:
+            requests = shard.pending.get(device_id)
+            if requests is None:
+                requests = shard.pending[device_id] = {}
+            if request_id not in requests:
+                shard.pending_total += 1
+            requests[request_id] = fut
+
+    def pop_pending(self, device_id, request_id):
+        shard = self._shard(device_id)
+        with shard.lock:
+            requests = shard.pending.get(device_id)
+            if not requests:
+                return None
+            fut = requests.pop(request_id, None)
+            if fut is not None:
+                shard.pending_total -= 1
+                if not requests:
+                    del shard.pending[device_id]
+            return fut
+
+    def fail_pending(self, device_id, exc):
+        """Fail every outstanding request for a device; returns how many were failed."""
+        shard = self._shard(device_id)
+        with shard.lock:
+            requests = shard.pending.pop(device_id, None)
+            if not requests:
+                return 0
+            shard.pending_total -= len(requests)
+        for fut in requests.values():
+            settle_future(fut, exc=exc)
+        return len(requests)
+
+    def pending_count(self):
+        return sum(s.pending_total for s in self._shards)
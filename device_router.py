@@ -0,0 +1,409 @@
+"""
+Reach a device no matter which server process holds its WebSocket.
+
+With the default single-process setup every connected device is in the
+local `DeviceRegistry` and `DeviceRouter` just forwards to it. With a
+shared store (see storage.py) several processes ("nodes") serve devices,
+and the router keeps three tables in the shared DB:
+
+- `nodes`: each node's id and a heartbeat; routes of a node that stops
+  heartbeating are ignored and eventually deleted.
+- `device_routes`: device_id -> node that currently holds its socket.
+  Connects and disconnects are queued and written once per poll, so a
+  reconnect storm costs one transaction per ``poll_interval``.
+- `outbox`: requests and replies addressed to a node. Each node polls its
+  own rows every ``poll_interval``, runs the request locally (send to
+  devices, broadcast, or an RPC call) and posts the reply back to the
+  sender's node the same way.
+
+So `/send` or `/vrlibrary` handled by one node reaches a device connected to
+another one within about two poll intervals.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import secrets
+import socket
+import time
+
+from device_registry import settle_future
+from device_rpc import DeviceOffline, DeviceRPCError
+from fanout import send_to_many
+
+SQL_HEARTBEAT = (
+    "INSERT INTO nodes (node_id, last_seen) VALUES (?, ?) "
+    "ON CONFLICT(node_id) DO UPDATE SET last_seen=excluded.last_seen"
+)
+SQL_LIVE_NODES = "SELECT node_id FROM nodes WHERE last_seen > ?"
+SQL_ROUTE_DEVICE = (
+    "INSERT INTO device_routes (device_id, node_id, connected_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(device_id) DO UPDATE SET node_id=excluded.node_id, connected_at=excluded.connected_at"
+)
+# only drop the route if the device has not reconnected elsewhere meanwhile
+SQL_UNROUTE_DEVICE = "DELETE FROM device_routes WHERE device_id=? AND node_id=?"
+SQL_LOCATE_DEVICES = (
+    "SELECT r.device_id, r.node_id FROM device_routes r JOIN nodes n ON n.node_id = r.node_id "
+    "WHERE n.last_seen > ? AND r.device_id IN ({})"
+)
+SQL_POST = "INSERT INTO outbox (node_id, payload, created_at) VALUES (?, ?, ?)"
+SQL_INBOX = "SELECT seq, payload FROM outbox WHERE node_id=? ORDER BY seq"
+SQL_ACK_INBOX = "DELETE FROM outbox WHERE node_id=? AND seq <= ?"
+SQL_DROP_NODE_ROUTES = "DELETE FROM device_routes WHERE node_id=?"
+SQL_DROP_NODE = "DELETE FROM nodes WHERE node_id=?"
+SQL_DEAD_NODES = "SELECT node_id FROM nodes WHERE last_seen <= ?"
+SQL_EXPIRE_OUTBOX = "DELETE FROM outbox WHERE created_at <= ?"
+
+# keeps IN (...) lists under SQLite's default host parameter limit
+LOCATE_BATCH = 500
+
+
+def _join_sync(conn, node_id, now):
+    with conn:
+        # a restarted node with a fixed id must not keep its old routes
+        conn.execute(SQL_DROP_NODE_ROUTES, (node_id,))
+        conn.execute(SQL_HEARTBEAT, (node_id, now))
+
+
+def _leave_sync(conn, node_id):
+    with conn:
+        conn.execute(SQL_DROP_NODE_ROUTES, (node_id,))
+        conn.execute(SQL_DROP_NODE, (node_id,))
+
+
+def _poll_sync(conn, node_id, routes, now):
+    """Write queued route changes, then take this node's outbox rows."""
+    with conn:
+        if routes:
+            connected = [(d, node_id, now) for d, up in routes if up]
+            gone = [(d, node_id) for d, up in routes if not up]
+            if connected:
+                conn.executemany(SQL_ROUTE_DEVICE, connected)
+            if gone:
+                conn.executemany(SQL_UNROUTE_DEVICE, gone)
+        rows = conn.execute(SQL_INBOX, (node_id,)).fetchall()
+        if rows:
+            conn.execute(SQL_ACK_INBOX, (node_id, rows[-1][0]))
+    return rows
+
+
+def _housekeeping_sync(conn, node_id, now, node_timeout, message_ttl):
+    with conn:
+        conn.execute(SQL_HEARTBEAT, (node_id, now))
+        dead = [r[0] for r in conn.execute(SQL_DEAD_NODES, (now - node_timeout,))]
+        for dead_id in dead:
+            conn.execute(SQL_DROP_NODE_ROUTES, (dead_id,))
+            conn.execute(SQL_DROP_NODE, (dead_id,))
+        conn.execute(SQL_EXPIRE_OUTBOX, (now - message_ttl,))
+    return dead
+
+
+def _post_sync(conn, node_id, payload, now):
+    with conn:
+        conn.execute(SQL_POST, (node_id, payload, now))
+
+
+def _locate_sync(conn, device_ids, min_seen):
+    found = {}
+    for i in range(0, len(device_ids), LOCATE_BATCH):
+        batch = device_ids[i:i + LOCATE_BATCH]
+        sql = SQL_LOCATE_DEVICES.format(",".join("?" * len(batch)))
+        found.update(conn.execute(sql, (min_seen, *batch)).fetchall())
+    return found
+
+
+def _live_nodes_sync(conn, min_seen):
+    return [r[0] for r in conn.execute(SQL_LIVE_NODES, (min_seen,))]
+
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(2)}"
+
+
+class DeviceRouter:
+    def __init__(self, store, registry, rpc, node_id=None, poll_interval=0.05,
+                 heartbeat_interval=5.0, node_timeout=15.0, message_ttl=30.0):
+        self.store = store
+        self.registry = registry
+        self.rpc = rpc
+        self.shared = store.shared
+        self.node_id = node_id or default_node_id()
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.node_timeout = node_timeout
+        self.message_ttl = message_ttl
+        # on_send(mtype, message, frames) after sending to local devices
+        self.on_send = None
+        # device_id -> True (connected here) / False (disconnected), oldest first
+        self._routes = {}
+        # call_id -> future waiting for a reply from another node
+        self._waiting = {}
+        self._ids = itertools.count(1)
+        self._tasks = set()
+        self._poller = None
+        self._heartbeat_at = 0.0
+        self.remote_requests = 0
+        self.remote_timeouts = 0
+        self.served_requests = 0
+
+    async def open(self):
+        if not self.shared or self._poller is not None:
+            return
+        now = time.time()
+        await self.store.run(_join_sync, self.node_id, now)
+        self._heartbeat_at = time.monotonic()
+        self._poller = asyncio.create_task(self._poll_loop())
+        logging.info("Device router joined as node %s", self.node_id)
+
+    def close(self):
+        if self._poller is None:
+            return
+        self._poller.cancel()
+        self._poller = None
+        for task in list(self._tasks):
+            task.cancel()
+        try:
+            self.store.run_sync(_leave_sync, self.node_id)
+        except Exception:
+            logging.exception("Failed to remove this node's device routes")
+
+    # ----- local connections -----
+
+    def device_connected(self, device_id):
+        if self.shared:
+            self._routes.pop(device_id, None)
+            self._routes[device_id] = True
+
+    def device_disconnected(self, device_id):
+        if self.shared:
+            self._routes.pop(device_id, None)
+            self._routes[device_id] = False
+
+    # ----- lookups -----
+
+    async def locate(self, device_ids):
+        """Return ``{device_id: node_id}`` for the devices that are connected anywhere."""
+        found = {}
+        remote = []
+        for device_id in device_ids:
+            if device_id in self.registry:
+                found[device_id] = self.node_id
+            else:
+                remote.append(device_id)
+        if remote and self.shared:
+            found.update(await self._locate_remote(remote))
+        return found
+
+    # ----- operations -----
+
+    async def send_many(self, device_ids, message, timeout=2.0, concurrency=1000, mtype=None):
+        """Send an encoded message (of type ``mtype``, for on_send) to devices on any node.
+
+        Returns ``(results, offline)`` where results is as for
+        `fanout.send_to_many()` and offline lists devices connected nowhere.
+        """
+        where = await self.locate(device_ids)
+        offline = [d for d in device_ids if d not in where]
+        local = []
+        by_node = {}
+        for device_id, node_id in where.items():
+            if node_id == self.node_id:
+                local.append(device_id)
+            else:
+                by_node.setdefault(node_id, []).append(device_id)
+        results = {}
+        jobs = [self._send_local(local, message, timeout, concurrency, mtype)] if local else []
+        for node_id, ids in by_node.items():
+            jobs.append(self._send_remote(node_id, ids, message, timeout, concurrency, mtype))
+        for part in await asyncio.gather(*jobs):
+            results.update(part)
+        return results, offline
+
+    async def broadcast(self, message, timeout=2.0, concurrency=1000, mtype=None):
+        """Send to every connected device on every node; returns send_to_many()-style results."""
+        results = await self._send_local(None, message, timeout, concurrency, mtype)
+        if not self.shared:
+            return results
+        others = await self._other_nodes()
+        args = {"message": message, "timeout": timeout, "concurrency": concurrency, "mtype": mtype}
+        replies = await asyncio.gather(
+            *(self._request(n, "broadcast", args, timeout + self._reply_slack()) for n in others),
+            return_exceptions=True,
+        )
+        for node_id, reply in zip(others, replies):
+            if isinstance(reply, BaseException):
+                logging.warning("Broadcast to node %s failed: %r", node_id, reply)
+                continue
+            results.update(reply)
+        return results
+
+    async def call(self, device_id, method, params=None, timeout=None):
+        """`DeviceRPC.call()` for a device on any node."""
+        if device_id in self.registry or not self.shared:
+            return await self.rpc.call(device_id, method, params, timeout)
+        node_id = (await self.locate([device_id])).get(device_id)
+        if node_id is None:
+            raise DeviceOffline(f"Device {device_id} is not connected")
+        timeout = self.rpc.default_timeout if timeout is None else timeout
+        reply = await self._request(
+            node_id, "call",
+            {"device_id": device_id, "method": method, "params": params, "timeout": timeout},
+            timeout + self._reply_slack(),
+        )
+        if "offline" in reply:
+            raise DeviceOffline(reply["offline"])
+        if "timeout" in reply:
+            raise asyncio.TimeoutError()
+        if "error" in reply:
+            raise DeviceRPCError.from_reply(reply["error"])
+        return reply.get("result")
+
+    async def _send_local(self, device_ids, message, timeout, concurrency, mtype=None):
+        if device_ids is None:
+            device_ids = list(self.registry.device_ids())
+        targets = [(d, ws) for d in device_ids if (ws := self.registry.get(d)) is not None]
+        results = await send_to_many(targets, message, timeout=timeout, concurrency=concurrency)
+        if self.on_send is not None and mtype is not None:
+            self.on_send(mtype, message, sum(1 for error in results.values() if error is None))
+        for device_id in device_ids:
+            results.setdefault(device_id, "not connected")
+        return results
+
+    async def _send_remote(self, node_id, device_ids, message, timeout, concurrency, mtype=None):
+        try:
+            return await self._request(
+                node_id, "send",
+                {"device_ids": device_ids, "message": message, "timeout": timeout, "concurrency": concurrency,
+                 "mtype": mtype},
+                timeout + self._reply_slack(),
+            )
+        except asyncio.TimeoutError:
+            return {d: f"node {node_id} did not answer" for d in device_ids}
+        except ConnectionError as e:
+            return {d: str(e) for d in device_ids}
+
+    async def serve_request(self, op, args):
+        """Run a request from another node against local devices and return the reply."""
+        self.served_requests += 1
+        if op == "send":
+            return await self._send_local(
+                args["device_ids"], args["message"], args["timeout"], args["concurrency"], args.get("mtype"),
+            )
+        if op == "broadcast":
+            return await self._send_local(None, args["message"], args["timeout"], args["concurrency"], args.get("mtype"))
+        if op == "call":
+            try:
+                value = await self.rpc.call(args["device_id"], args["method"], args.get("params"), args["timeout"])
+                return {"result": value}
+            except DeviceOffline as e:
+                return {"offline": str(e)}
+            except asyncio.TimeoutError:
+                return {"timeout": True}
+            except DeviceRPCError as e:
+                return {"error": {"code": e.code, "message": e.message, "data": e.data}}
+            except Exception as e:
+                return {"error": {"code": None, "message": str(e) or type(e).__name__}}
+        raise ValueError(f"unknown router op {op!r}")
+
+    # ----- node-to-node requests -----
+    # _locate_remote, _other_nodes, _post and _reply_slack are the transport;
+    # subclasses (worker_bus.py) replace them to route over something other
+    # than the shared DB
+
+    async def _locate_remote(self, device_ids):
+        min_seen = time.time() - self.node_timeout
+        found = await self.store.run(_locate_sync, device_ids, min_seen)
+        # a route to this node for a socket that is gone is stale
+        return {d: n for d, n in found.items() if n != self.node_id}
+
+    async def _other_nodes(self):
+        nodes = await self.store.run(_live_nodes_sync, time.time() - self.node_timeout)
+        return [n for n in nodes if n != self.node_id]
+
+    async def _post(self, node_id, message):
+        await self.store.run(_post_sync, node_id, json.dumps(message), time.time())
+
+    def _reply_slack(self):
+        # request and reply each wait up to one poll on the other side
+        return 4 * self.poll_interval + 1.0
+
+    async def _request(self, node_id, op, args, timeout):
+        call_id = f"{self.node_id}:{next(self._ids)}"
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting[call_id] = fut
+        self.remote_requests += 1
+        try:
+            await self._post(node_id, {"op": op, "call_id": call_id, "reply_to": self.node_id, "args": args})
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self.remote_timeouts += 1
+            raise
+        finally:
+            self._waiting.pop(call_id, None)
+
+    def _handle_message(self, message):
+        """Settle a reply or start serving a request that arrived from another node."""
+        if message.get("op") == "reply":
+            fut = self._waiting.get(message.get("call_id"))
+            if fut is not None:
+                settle_future(fut, message.get("result"))
+            return
+        task = asyncio.create_task(self._serve(message))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _serve(self, message):
+        try:
+            result = await self.serve_request(message.get("op"), message.get("args") or {})
+        except ValueError as e:
+            logging.warning("Ignoring router request: %s", e)
+            return
+        try:
+            await self._post(message.get("reply_to"), {"op": "reply", "call_id": message.get("call_id"), "result": result})
+        except Exception:
+            logging.exception("Failed to reply to node %s", message.get("reply_to"))
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.poll()
+            except Exception:
+                logging.exception("Device router poll failed")
+
+    async def poll(self):
+        """Write queued route changes and handle this node's requests and replies."""
+        routes = list(self._routes.items())
+        self._routes.clear()
+        try:
+            rows = await self.store.run(_poll_sync, self.node_id, routes, time.time())
+        except Exception:
+            # put the route changes back unless newer ones replaced them
+            for device_id, up in routes:
+                self._routes.setdefault(device_id, up)
+            raise
+        for _, payload in rows:
+            try:
+                message = json.loads(payload)
+            except ValueError:
+                continue
+            self._handle_message(message)
+        if time.monotonic() - self._heartbeat_at >= self.heartbeat_interval:
+            self._heartbeat_at = time.monotonic()
+            dead = await self.store.run(
+                _housekeeping_sync, self.node_id, time.time(), self.node_timeout, self.message_ttl
+            )
+            for node_id in dead:
+                logging.warning("Dropped routes of unresponsive node %s", node_id)
+        return len(rows)
+
+    def stats(self):
+        return {
+            "node_id": self.node_id,
+            "queued_routes": len(self._routes),
+            "waiting": len(self._waiting),
+            "remote_requests": self.remote_requests,
+            "remote_timeouts": self.remote_timeouts,
+            "served_requests": self.served_requests,
+        }
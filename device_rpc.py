@@ -0,0 +1,169 @@
+"""
+Request/response calls to connected devices over their WebSocket.
+
+`DeviceRPC.call(device_id, method, params, timeout)` sends
+``{"type": method, "request_id": ..., **params}`` and waits for the device to
+answer with the same request_id, either
+
+  {"type": "response", "request_id": ..., "result": ...}
+  {"type": "response", "request_id": ..., "error": {"code": ..., "message": ...}}
+
+or one of the older method-specific replies (e.g. `library_response`), which
+ws_handler maps onto `resolve()`.
+
+Request ids come from a per-process counter behind a random boot prefix, so
+they never repeat and a late reply from before a restart cannot match a new
+request. Each device gets at most ``max_in_flight`` outstanding calls;
+further calls queue until a slot frees up. A call that is cancelled or times
+out after its request went out sends ``{"type": "cancel", "request_id": ...}``
+so the device can stop work on it.
+"""
+import asyncio
+import itertools
+import logging
+import secrets
+
+from device_registry import settle_future
+from protocol import encode
+
+
+class DeviceOffline(ConnectionError):
+    """The target device has no open connection."""
+
+
+class DeviceRPCError(Exception):
+    """The device answered a call with a structured error."""
+
+    def __init__(self, code, message, data=None):
+        super().__init__(f"{code}: {message}" if code else message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+    @classmethod
+    def from_reply(cls, error):
+        if isinstance(error, dict):
+            return cls(error.get("code"), error.get("message") or "device error", error.get("data"))
+        return cls(None, str(error))
+
+
+class _Slots:
+    __slots__ = ("semaphore", "users")
+
+    def __init__(self, limit):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.users = 0
+
+
+class DeviceRPC:
+    def __init__(self, registry, max_in_flight=4, default_timeout=8.0):
+        self.registry = registry
+        self.max_in_flight = max_in_flight
+        self.default_timeout = default_timeout
+        self._prefix = secrets.token_hex(3)
+        self._ids = itertools.count(1)
+        # device_id -> _Slots, dropped again once no call uses it
+        self._slots = {}
+        # on_send(mtype, message) after each request or cancel sent
+        self.on_send = None
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def next_request_id(self):
+        return f"{self._prefix}-{next(self._ids)}"
+
+    async def call(self, device_id, method, params=None, timeout=None):
+        """Call ``method`` on a device and return its result.
+
+        Raises DeviceOffline if the device is not connected (or drops while
+        the call is outstanding), DeviceRPCError for error replies and
+        asyncio.TimeoutError if no reply arrives within ``timeout`` seconds,
+        which includes time spent queued behind other calls to the device.
+        """
+        if self.registry.get(device_id) is None:
+            raise DeviceOffline(f"Device {device_id} is not connected")
+        timeout = self.default_timeout if timeout is None else timeout
+        self.calls += 1
+        try:
+            return await asyncio.wait_for(self._call(device_id, method, params), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except DeviceRPCError:
+            self.errors += 1
+            raise
+
+    async def _call(self, device_id, method, params):
+        slots = self._slots.get(device_id)
+        if slots is None:
+            slots = self._slots[device_id] = _Slots(self.max_in_flight)
+        slots.users += 1
+        try:
+            async with slots.semaphore:
+                return await self._send_and_wait(device_id, method, params)
+        finally:
+            slots.users -= 1
+            if not slots.users and self._slots.get(device_id) is slots:
+                del self._slots[device_id]
+
+    async def _send_and_wait(self, device_id, method, params):
+        # re-check after queueing: the device may have gone away meanwhile
+        ws = self.registry.get(device_id)
+        if ws is None:
+            raise DeviceOffline(f"Device {device_id} is not connected")
+        request_id = self.next_request_id()
+        fut = asyncio.get_running_loop().create_future()
+        self.registry.add_pending(device_id, request_id, fut)
+        sent = False
+        try:
+            message = {"type": method, "request_id": request_id}
+            if params:
+                message.update(params)
+            payload = encode(message)
+            try:
+                await ws.send(payload)
+            except Exception as e:
+                raise DeviceOffline(f"Failed to send request to device: {e}") from e
+            sent = True
+            if self.on_send is not None:
+                self.on_send(method, payload)
+            return await fut
+        except asyncio.CancelledError:
+            if sent:
+                self._send_cancel(ws, device_id, request_id)
+            raise
+        except DeviceOffline:
+            raise
+        except ConnectionError as e:
+            # fail_pending() when the device disconnects mid-call
+            raise DeviceOffline(str(e)) from e
+        finally:
+            self.registry.pop_pending(device_id, request_id)
+
+    def _send_cancel(self, ws, device_id, request_id):
+        payload = encode({"type": "cancel", "request_id": request_id})
+
+        def _done(task):
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                logging.debug("Failed to send cancel for %s to %s: %s", request_id, device_id, task.exception())
+            elif self.on_send is not None:
+                self.on_send("cancel", payload)
+
+        task = asyncio.ensure_future(ws.send(payload))
+        task.add_done_callback(_done)
+
+    def resolve(self, device_id, request_id, result=None, error=None):
+        """Complete a pending call from a device reply; returns False if nothing was waiting."""
+        if not device_id or not request_id:
+            return False
+        fut = self.registry.pop_pending(device_id, str(request_id))
+        if fut is None:
+            return False
+        if error is not None:
+            settle_future(fut, exc=DeviceRPCError.from_reply(error))
+        else:
+            settle_future(fut, result)
+        return True
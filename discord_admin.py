@@ -0,0 +1,261 @@
+"""
+Async Discord REST client for the admin scripts (clean_resync.py,
+print_commands.py).
+
+`AdminClient` wraps one pooled `aiohttp.ClientSession` with the bot's
+headers and knows the few application-command routes the scripts need.
+
+- The application id is read from ``/oauth2/applications/@me`` once and
+  cached in APP_ID_CACHE, keyed by a hash of the token, so later runs skip
+  that request (and never need a gateway login).
+- Requests follow Discord's rate-limit headers: each route (method, path
+  template, major id such as the guild) maps to the bucket Discord reports
+  in ``X-RateLimit-Bucket``; once a bucket has no requests left, callers
+  wait for its reset instead of collecting 429s. All requests also share
+  a token bucket kept under Discord's global limit of 50 per second. A 429
+  (bucket or global) is retried after ``retry_after``.
+- `map_concurrent()` runs an operation over many items with at most
+  ``concurrency`` in flight, e.g. listing and clearing commands in every
+  guild at once.
+
+DISCORD_API_BASE overrides the API URL (the stub server in
+bench/discord_admin.py uses this). aiohttp is imported when a client is
+opened, so a script that exits early (--help, no token) never loads it.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from rate_limit import RateLimiter
+
+API_BASE = os.getenv("DISCORD_API_BASE", "https://discord.com/api/v10")
+APP_ID_CACHE = ".discord_app_id.json"
+USER_AGENT = "DiscordBot (bot-linker admin, 1.0)"
+
+
+class DiscordAPIError(RuntimeError):
+    def __init__(self, status, text, method, path):
+        super().__init__(f"{method} {path} failed: {status} {text}")
+        self.status = status
+        self.text = text
+
+
+class _Bucket:
+    __slots__ = ("limit", "remaining", "reset_at", "in_flight", "known")
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self.in_flight = 0
+        # set once a response has told us the limits (or that there are none)
+        self.known = asyncio.Event()
+
+
+async def map_concurrent(fn, items, concurrency=10):
+    """``[await fn(item) ...]`` with at most ``concurrency`` calls running; exceptions are returned."""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(item):
+        async with sem:
+            return await fn(item)
+
+    return await asyncio.gather(*(_one(item) for item in items), return_exceptions=True)
+
+
+class AdminClient:
+    def __init__(self, token, api_base=API_BASE, concurrency=10, app_id_cache=APP_ID_CACHE, max_retries=5,
+                 global_rate=45.0):
+        self.token = token
+        self.api_base = api_base.rstrip("/")
+        self.concurrency = concurrency
+        self.app_id_cache = app_id_cache
+        self.max_retries = max_retries
+        self._session = None
+        self._app_id = None
+        # route key -> bucket hash from X-RateLimit-Bucket
+        self._bucket_ids = {}
+        # (bucket hash or route key, major id) -> _Bucket
+        self._buckets = {}
+        self._global_reset = 0.0
+        # a small burst keeps any one-second window under the global limit
+        self._global = RateLimiter(global_rate, 5)
+        self.requests = 0
+        self.rate_limited = 0
+
+    async def __aenter__(self):
+        import aiohttp
+        self._session = aiohttp.ClientSession(
+            headers={"Authorization": f"Bot {self.token}", "User-Agent": USER_AGENT},
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+        self._session = None
+
+    # ----- rate limits -----
+    def _bucket(self, route, major):
+        key = (self._bucket_ids.get(route, route), major)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        return bucket
+
+    async def _acquire(self, route, major):
+        """Wait for a slot on ``route``'s bucket and return that bucket."""
+        while not self._global.allow("global"):
+            await asyncio.sleep(self._global.retry_after("global"))
+        while True:
+            # looked up on every pass: the first response may move the
+            # route to the bucket Discord names
+            bucket = self._bucket(route, major)
+            now = time.monotonic()
+            if now < self._global_reset:
+                await asyncio.sleep(self._global_reset - now)
+                continue
+            if not bucket.known.is_set() and bucket.in_flight:
+                # one request finds out the limits before the rest follow
+                await bucket.known.wait()
+                continue
+            if bucket.remaining is not None and now >= bucket.reset_at:
+                bucket.remaining = bucket.limit
+            if bucket.remaining is None or bucket.remaining > 0:
+                if bucket.remaining is not None:
+                    bucket.remaining -= 1
+                bucket.in_flight += 1
+                return bucket
+            await asyncio.sleep(bucket.reset_at - now)
+
+    def _update(self, route, major, bucket, headers):
+        bucket_id = headers.get("X-RateLimit-Bucket")
+        if bucket_id is not None:
+            # routes sharing a Discord bucket share its counters from now on
+            self._bucket_ids[route] = bucket_id
+            shared = self._buckets.setdefault((bucket_id, major), bucket)
+            if shared is not bucket:
+                # callers waiting on the route's own bucket look up the shared one
+                bucket.known.set()
+                bucket = shared
+        if "X-RateLimit-Remaining" in headers:
+            bucket.limit = int(headers.get("X-RateLimit-Limit", 1))
+            # requests still in flight will use up some of what Discord reports
+            bucket.remaining = max(0, int(headers["X-RateLimit-Remaining"]) - bucket.in_flight)
+            bucket.reset_at = time.monotonic() + float(headers.get("X-RateLimit-Reset-After", 0))
+        bucket.known.set()
+        return bucket
+
+    async def request(self, method, template, major=None, json_body=None, **params):
+        """Send ``method template.format(**params)``; returns the decoded JSON (or None)."""
+        path = template.format(**params)
+        route = (method, template)
+        for _ in range(self.max_retries + 1):
+            bucket = await self._acquire(route, major)
+            self.requests += 1
+            answered = False
+            try:
+                async with self._session.request(method, self.api_base + path, json=json_body) as r:
+                    bucket.in_flight -= 1
+                    answered = True
+                    bucket = self._update(route, major, bucket, r.headers)
+                    if r.status == 429:
+                        self.rate_limited += 1
+                        body = await r.json(content_type=None)
+                        retry_after = float(body.get("retry_after", r.headers.get("Retry-After", 1)))
+                        if body.get("global") or r.headers.get("X-RateLimit-Global"):
+                            self._global_reset = time.monotonic() + retry_after
+                        else:
+                            bucket.remaining = 0
+                            bucket.reset_at = time.monotonic() + retry_after
+                        logging.debug("Rate limited on %s %s, retrying in %.2fs", method, path, retry_after)
+                        continue
+                    if r.status >= 400:
+                        raise DiscordAPIError(r.status, await r.text(), method, path)
+                    if r.status == 204:
+                        return None
+                    return await r.json(content_type=None)
+            finally:
+                if not answered:
+                    bucket.in_flight -= 1
+                    bucket.known.set()
+        raise DiscordAPIError(429, "rate limited too many times", method, path)
+
+    # ----- application -----
+    def _token_key(self):
+        # per API base too, so a run against the stub never leaks its id
+        return hashlib.sha256(f"{self.api_base} {self.token}".encode()).hexdigest()[:16]
+
+    async def app_id(self):
+        """The bot's application id, from the on-disk cache when possible."""
+        if self._app_id is not None:
+            return self._app_id
+        key = self._token_key()
+        try:
+            with open(self.app_id_cache) as f:
+                self._app_id = json.load(f).get(key)
+        except (OSError, ValueError):
+            self._app_id = None
+        if self._app_id is None:
+            data = await self.request("GET", "/oauth2/applications/@me")
+            self._app_id = data["id"]
+            try:
+                with open(self.app_id_cache, "w") as f:
+                    json.dump({key: self._app_id}, f)
+            except OSError as e:
+                logging.warning("Could not cache application id: %s", e)
+        return self._app_id
+
+    async def guilds(self):
+        """Every guild the bot is in, following the 200-per-page pagination."""
+        guilds = []
+        after = "0"
+        while True:
+            page = await self.request("GET", "/users/@me/guilds?limit=200&after={after}", after=after)
+            guilds.extend(page)
+            if len(page) < 200:
+                return guilds
+            after = page[-1]["id"]
+
+    # ----- application commands -----
+    def _commands_path(self, guild_id):
+        if guild_id is None:
+            return "/applications/{app_id}/commands"
+        return "/applications/{app_id}/guilds/{guild_id}/commands"
+
+    async def list_commands(self, guild_id=None):
+        app_id = await self.app_id()
+        return await self.request("GET", self._commands_path(guild_id), major=guild_id, app_id=app_id, guild_id=guild_id)
+
+    async def delete_command(self, command_id, guild_id=None):
+        app_id = await self.app_id()
+        await self.request(
+            "DELETE", self._commands_path(guild_id) + "/{command_id}", major=guild_id,
+            app_id=app_id, guild_id=guild_id, command_id=command_id,
+        )
+
+    async def clear_commands(self, guild_id=None):
+        """Remove every command in one bulk overwrite with an empty list."""
+        app_id = await self.app_id()
+        await self.request("PUT", self._commands_path(guild_id), major=guild_id, json_body=[],
+                           app_id=app_id, guild_id=guild_id)
+
+    async def wipe_commands(self, guild_ids, include_global=True):
+        """List and clear commands globally and in ``guild_ids`` concurrently.
+
+        Returns ``{guild_id or None: [removed command dicts] or exception}``.
+        """
+        scopes = ([None] if include_global else []) + list(guild_ids)
+        await self.app_id()
+
+        async def _wipe(guild_id):
+            commands = await self.list_commands(guild_id)
+            if commands:
+                await self.clear_commands(guild_id)
+            return commands
+
+        results = await map_concurrent(_wipe, scopes, self.concurrency)
+        return dict(zip(scopes, results))
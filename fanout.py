@@ -0,0 +1,49 @@
+"""
+Send one message to many device websockets at once.
+
+Used by `/send` (all of a user's headsets) and `/broadcast` (every connected
+device). The payload is encoded once, sends run concurrently up to
+``concurrency`` at a time, and each recipient gets its own timeout so one
+slow headset cannot hold up the rest. websockets.broadcast() would be
+cheaper still but reports nothing back, and callers here want a per-device
+result.
+"""
+import asyncio
+
+
+async def send_to_many(targets, message, timeout=2.0, concurrency=1000):
+    """Send ``message`` (already encoded) to each ``(device_id, websocket)``.
+
+    Returns ``{device_id: None}`` for delivered messages and
+    ``{device_id: "<reason>"}`` for failures.
+    """
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(device_id, ws):
+        async with sem:
+            try:
+                await asyncio.wait_for(ws.send(message), timeout)
+            except asyncio.TimeoutError:
+                return device_id, "timed out"
+            except Exception as e:
+                return device_id, str(e) or type(e).__name__
+            return device_id, None
+
+    return dict(await asyncio.gather(*(_one(device_id, ws) for device_id, ws in targets)))
+
+
+def summarize(results, offline=(), max_listed=10):
+    """One-line-per-problem summary of send_to_many() results for a Discord reply."""
+    delivered = sum(1 for error in results.values() if error is None)
+    total = len(results) + len(offline)
+    lines = [f"Delivered to {delivered}/{total} device(s)."]
+    failed = [(d, e) for d, e in results.items() if e is not None]
+    for device_id, error in failed[:max_listed]:
+        lines.append(f"- `{device_id}`: {error}")
+    if len(failed) > max_listed:
+        lines.append(f"- ...and {len(failed) - max_listed} more failed")
+    if offline:
+        shown = ", ".join(f"`{d}`" for d in list(offline)[:max_listed])
+        more = f" and {len(offline) - max_listed} more" if len(offline) > max_listed else ""
+        lines.append(f"Not connected: {shown}{more}")
+    return "\n".join(lines)
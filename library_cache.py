@@ -0,0 +1,192 @@
+"""
+Per-device VR library snapshots for `/vrlibrary`.
+
+Each snapshot holds the app list, a version and a content digest. Within
+``ttl`` seconds a snapshot is served as-is without contacting the headset;
+after that `fetch()` asks the device for changes since the snapshot's
+version:
+
+  server -> device  {"type": "get_library", "request_id": ..., "since_version": "<v>"}
+  device -> server  {"type": "library_delta", "request_id": ..., "base_version": "<v>",
+                     "version": "<v2>", "added": [app, ...], "removed": [app_key, ...]}
+
+Devices that don't support deltas ignore ``since_version`` and answer with
+the full `library_response` as before. A delta whose base does not match
+the stored snapshot triggers one full refetch. Snapshots outlive the
+connection, so an offline device can still show its last known library.
+
+Large libraries can be streamed instead of sent as one frame; `get_library`
+carries ``max_chunk`` to say so:
+
+  device -> server  {"type": "library_chunk", "request_id": ..., "apps": [...]}  (repeated)
+  device -> server  {"type": "library_chunk", "request_id": ..., "apps": [...], "done": true, "version": ...}
+
+Apps are reduced to name + package as they arrive, so neither a chunked
+nor a single-frame library is kept around with icons or other bulk fields.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+
+
+def app_key(app):
+    """Stable identity of an app entry, used to match delta removals."""
+    if isinstance(app, dict):
+        return str(app.get("package") or app.get("id") or app.get("name") or app.get("title") or app)
+    return str(app)
+
+
+def compact_app(app):
+    """Keep only what the library view needs from a device app entry."""
+    if isinstance(app, dict):
+        out = {}
+        name = app.get("name") or app.get("title")
+        key = app.get("package") or app.get("id")
+        if name:
+            out["name"] = str(name)
+        if key:
+            out["package"] = str(key)
+        return out or str(app)
+    return str(app)
+
+
+def _digest(apps):
+    # apps are compacted (name/package dicts or strings) by the time they get here
+    h = hashlib.sha1()
+    for app in apps:
+        if isinstance(app, dict):
+            h.update(f"{app.get('name', '')}\0{app.get('package', '')}\n".encode())
+        else:
+            h.update(f"{app}\n".encode())
+    return h.hexdigest()[:16]
+
+
+class LibrarySnapshot:
+    __slots__ = ("version", "digest", "apps", "updated_at")
+
+    def __init__(self, apps, version=None):
+        self.apps = apps
+        self.digest = _digest(apps)
+        # devices that don't version their library get the content digest
+        self.version = str(version) if version is not None else self.digest
+        self.updated_at = time.time()
+
+    def age(self):
+        return time.time() - self.updated_at
+
+
+class _PartialLibrary:
+    __slots__ = ("apps", "started_at")
+
+    def __init__(self):
+        self.apps = []
+        self.started_at = time.monotonic()
+
+
+class StaleDelta(Exception):
+    """A library_delta did not apply to the stored snapshot."""
+
+
+class LibraryCache:
+    def __init__(self, ttl=60.0, max_devices=1000, max_chunk=500, partial_timeout=60.0):
+        self.ttl = ttl
+        self.max_devices = max_devices
+        self.max_chunk = max_chunk
+        self.partial_timeout = partial_timeout
+        self._snapshots = OrderedDict()
+        # (device_id, request_id) -> _PartialLibrary for streams in progress
+        self._partial = {}
+        self.hits = 0
+        self.full_fetches = 0
+        self.delta_fetches = 0
+
+    def get(self, device_id):
+        snap = self._snapshots.get(device_id)
+        if snap is not None:
+            self._snapshots.move_to_end(device_id)
+        return snap
+
+    def is_fresh(self, snap):
+        return snap is not None and snap.age() < self.ttl
+
+    def fresh(self, device_id):
+        """Return the snapshot if it is still within the TTL, else None."""
+        snap = self.get(device_id)
+        if not self.is_fresh(snap):
+            return None
+        self.hits += 1
+        return snap
+
+    def _store(self, device_id, snap):
+        self._snapshots[device_id] = snap
+        self._snapshots.move_to_end(device_id)
+        if len(self._snapshots) > self.max_devices:
+            self._snapshots.popitem(last=False)
+        return snap
+
+    def apply_reply(self, device_id, reply):
+        """Update the snapshot from a get_library reply (full list or delta)."""
+        if isinstance(reply, dict) and (
+            reply.get("type") == "library_delta" or "added" in reply or "removed" in reply
+        ):
+            return self._apply_delta(device_id, reply)
+        version = None
+        apps = reply
+        if isinstance(reply, dict):
+            version = reply.get("version")
+            apps = reply.get("apps") or reply.get("library") or reply.get("items") or []
+        if not isinstance(apps, list):
+            apps = [apps]
+        # chunked replies arrive already compacted; compacting is idempotent
+        apps = [compact_app(a) for a in apps]
+        self.full_fetches += 1
+        return self._store(device_id, LibrarySnapshot(apps, version))
+
+    def _apply_delta(self, device_id, delta):
+        base = self._snapshots.get(device_id)
+        if base is None or str(delta.get("base_version")) != base.version:
+            raise StaleDelta(f"delta base {delta.get('base_version')} does not match stored snapshot")
+        removed = {str(k) for k in delta.get("removed") or ()}
+        added = [compact_app(a) for a in delta.get("added") or ()]
+        replaced = {app_key(a) for a in added}
+        apps = [a for a in base.apps if app_key(a) not in removed and app_key(a) not in replaced]
+        apps.extend(added)
+        self.delta_fetches += 1
+        return self._store(device_id, LibrarySnapshot(apps, delta.get("version")))
+
+    def add_chunk(self, device_id, chunk):
+        """Accumulate one library_chunk; returns the assembled reply after the last one."""
+        key = (device_id, str(chunk.get("request_id")))
+        partial = self._partial.get(key)
+        if partial is None:
+            self._prune_partials()
+            partial = self._partial[key] = _PartialLibrary()
+        partial.apps.extend(compact_app(a) for a in chunk.get("apps") or ())
+        if not chunk.get("done"):
+            return None
+        del self._partial[key]
+        return {"apps": partial.apps, "version": chunk.get("version")}
+
+    def drop_partials(self, device_id):
+        """Forget unfinished streams from a device (e.g. on disconnect)."""
+        for key in [k for k in self._partial if k[0] == device_id]:
+            del self._partial[key]
+
+    def _prune_partials(self):
+        # streams whose caller timed out never send done; don't keep them
+        cutoff = time.monotonic() - self.partial_timeout
+        for key in [k for k, p in self._partial.items() if p.started_at < cutoff]:
+            del self._partial[key]
+
+    async def fetch(self, rpc, device_id, timeout=None):
+        """Refresh a device's snapshot over RPC, using a delta when one is stored."""
+        base = self._snapshots.get(device_id)
+        params = {"max_chunk": self.max_chunk}
+        if base is not None:
+            params["since_version"] = base.version
+        reply = await rpc.call(device_id, "get_library", params, timeout)
+        try:
+            return self.apply_reply(device_id, reply)
+        except StaleDelta:
+            reply = await rpc.call(device_id, "get_library", {"max_chunk": self.max_chunk}, timeout)
+            return self.apply_reply(device_id, reply)
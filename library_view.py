@@ -0,0 +1,135 @@
+"""
+Paginated Discord view of a device's app library.
+
+`LibraryPager` pages through a `LibrarySnapshot` with Previous/Next buttons
+and a Search button that filters by app name. Pages are rendered one at a
+time from the server-side snapshot, so paging never goes back to the device
+and no message ever holds the whole library (or exceeds Discord's
+2000-character limit).
+"""
+import discord
+
+PAGE_SIZE = 20
+MAX_MESSAGE_LENGTH = 2000
+# keeps a full page well under Discord's 2000 character message limit
+MAX_NAME_LENGTH = 80
+# device_id comes from the device and the query from the user: neither has
+# a length limit of its own
+MAX_FIELD_LENGTH = 100
+MAX_PREFIX_LENGTH = 300
+
+
+def app_name(app):
+    if isinstance(app, dict):
+        return app.get("name") or app.get("title") or app.get("package") or str(app)
+    return str(app)
+
+
+def _clip(text, limit):
+    text = str(text)
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class _SearchModal(discord.ui.Modal, title="Search library"):
+    query = discord.ui.TextInput(
+        label="App name contains (leave empty to clear)",
+        required=False,
+        max_length=100,
+    )
+
+    def __init__(self, pager):
+        super().__init__()
+        self.pager = pager
+        self.query.default = pager.query
+
+    async def on_submit(self, interaction: discord.Interaction):
+        self.pager.set_query(self.query.value)
+        await self.pager.show(interaction)
+
+
+class LibraryPager(discord.ui.View):
+    def __init__(self, owner_id, device_id, snapshot, note=None, prefix=None, query=None,
+                 page_size=PAGE_SIZE, timeout=300):
+        super().__init__(timeout=timeout)
+        self.owner_id = owner_id
+        self.device_id = device_id
+        self.snapshot = snapshot
+        self.note = note
+        self.prefix = prefix
+        self.page_size = page_size
+        self.set_query(query)
+
+    def set_query(self, query):
+        self.query = (query or "").strip()
+        needle = self.query.casefold()
+        # indexes into snapshot.apps; None means "no filter"
+        if needle:
+            self._matches = [i for i, app in enumerate(self.snapshot.apps) if needle in app_name(app).casefold()]
+        else:
+            self._matches = None
+        self.page = 0
+        self._sync_buttons()
+
+    @property
+    def match_count(self):
+        return len(self.snapshot.apps) if self._matches is None else len(self._matches)
+
+    @property
+    def page_count(self):
+        return max(1, -(-self.match_count // self.page_size))
+
+    def _page_apps(self):
+        start = self.page * self.page_size
+        if self._matches is None:
+            return self.snapshot.apps[start:start + self.page_size]
+        return [self.snapshot.apps[i] for i in self._matches[start:start + self.page_size]]
+
+    def render(self):
+        header = f"📚 Device library for `{_clip(self.device_id, MAX_FIELD_LENGTH)}`"
+        if self.note:
+            header += f" ({_clip(self.note, MAX_FIELD_LENGTH)})"
+        head = [_clip(self.prefix, MAX_PREFIX_LENGTH), header + ":"] if self.prefix else [header + ":"]
+        query = _clip(self.query, MAX_FIELD_LENGTH)
+        tail = []
+        if self.query and not self.match_count:
+            tail.append(f"No apps match `{query}`.")
+        footer = f"Page {self.page + 1}/{self.page_count} · {self.match_count} apps"
+        if self.query:
+            footer += f" matching `{query}`"
+        tail.append(footer)
+        apps = self._page_apps()
+        # with long fields above, app names get shorter so the message fits
+        name_length = MAX_NAME_LENGTH
+        if apps:
+            room = MAX_MESSAGE_LENGTH - sum(len(line) + 1 for line in head + tail)
+            name_length = max(1, min(MAX_NAME_LENGTH, room // len(apps) - len("- \n")))
+        lines = head + [f"- {_clip(app_name(app), name_length)}" for app in apps] + tail
+        return "\n".join(lines)
+
+    def _sync_buttons(self):
+        self.prev_page.disabled = self.page <= 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+
+    async def show(self, interaction: discord.Interaction):
+        self._sync_buttons()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user.id == self.owner_id:
+            return True
+        await interaction.response.send_message("Only the person who ran /vrlibrary can use these buttons.", ephemeral=True)
+        return False
+
+    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await self.show(interaction)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page = min(self.page_count - 1, self.page + 1)
+        await self.show(interaction)
+
+    @discord.ui.button(label="🔍 Search", style=discord.ButtonStyle.primary)
+    async def search(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(_SearchModal(self))
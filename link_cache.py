@@ -0,0 +1,85 @@
+"""
+Bounded in-process cache for the links table.
+
+`LinkCache` mirrors the two lookups that run on every device message and
+slash command: user -> ((device_id, device_name), ...) and device_id ->
+user. SQLite stays the source of truth; `LinksStore` writes through to
+the DB first and then updates the cache with the new values.
+
+Negative results are cached too (an unlinked device saying `hello` on every
+reconnect is the common case), so `None` is a real value and `MISSING`
+means "not cached".
+
+The cache is only touched from the event loop thread, so it needs no locking.
+"""
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class _LRU:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+
+    def get(self, key):
+        value = self.data.get(key, MISSING)
+        if value is not MISSING:
+            self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+
+    def discard(self, key):
+        self.data.pop(key, None)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class LinkCache:
+    def __init__(self, max_entries=10000):
+        self.users = _LRU(max_entries)
+        self.devices = _LRU(max_entries)
+        # bumped on every write; a read that started under an older
+        # generation must not store its (possibly stale) DB result
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped_writes = 0
+
+    def lookup(self, table, key):
+        value = table.get(key)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def fill(self, generation, table, key, value):
+        """Store a DB read result unless a write happened while it was in flight."""
+        if generation == self.generation:
+            table.put(key, value)
+
+    def bump(self):
+        self.generation += 1
+
+    def clear(self):
+        for table in (self.users, self.devices):
+            table.data.clear()
+        self.generation += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "skipped_writes": self.skipped_writes,
+            "users": len(self.users),
+            "devices": len(self.devices),
+        }
@@ -0,0 +1,552 @@
+"""
+Persistent SQLite access layer for user links.
+
+Schema (v6): `devices` holds one row per paired headset (so a user can have
+several devices linked at once) and `pair_codes` holds outstanding link
+codes, which `pairing_codes.PairingCodes` manages. `nodes`,
+`device_routes`, `outbox` and `link_changes` let several server processes
+share one DB file (see storage.py and device_router.py).
+
+`LinksStore` keeps a small pool of long-lived connections (WAL mode, cached
+prepared statements) and runs every query on its own thread pool, so DB work
+no longer opens a connection per call or competes with other
+`asyncio.to_thread` users.
+"""
+import asyncio
+import logging
+import queue
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from link_cache import LinkCache, MISSING
+
+# statements are kept as module constants so sqlite3's per-connection
+# statement cache always sees the exact same SQL text
+SQL_USER_BY_DEVICE = "SELECT user_id FROM devices WHERE device_id=?"
+SQL_DEVICES_BY_USER = "SELECT device_id, device_name FROM devices WHERE user_id=? ORDER BY rowid"
+# device_id is the primary key: pairing a device to a new user moves it
+SQL_LINK_DEVICE = (
+    "INSERT INTO devices (device_id, user_id, device_name) VALUES (?, ?, ?) "
+    "ON CONFLICT(device_id) DO UPDATE SET user_id=excluded.user_id, device_name=excluded.device_name"
+)
+SQL_UNLINK_DEVICE = "DELETE FROM devices WHERE device_id=?"
+SQL_UNLINK_USER = "DELETE FROM devices WHERE user_id=?"
+# batched name updates only apply while the device is still linked to the
+# same user, so a late flush can never resurrect a stale mapping
+SQL_SET_DEVICE_NAME = "UPDATE devices SET device_name=? WHERE user_id=? AND device_id=?"
+SQL_TRIM_CHANGES = "DELETE FROM link_changes WHERE changed_at < ?"
+
+# --------------------------------
+# Schema migrations
+# --------------------------------
+# Each migration runs in its own transaction and bumps PRAGMA user_version,
+# so a DB is only ever upgraded forward and every step runs exactly once.
+# Append new steps to MIGRATIONS; never edit or reorder existing ones.
+
+def _migration_create_links(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS links (
+            user_id TEXT PRIMARY KEY,
+            device_id TEXT,
+            code TEXT,
+            device_name TEXT
+        )
+        """
+    )
+
+
+def _migration_add_device_name(conn):
+    # DBs created before device_name existed already have a links table,
+    # so the CREATE above was a no-op for them
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(links)")]
+    if 'device_name' not in cols:
+        conn.execute("ALTER TABLE links ADD COLUMN device_name TEXT")
+
+
+def _migration_unique_lookup_indexes(conn):
+    # older DBs may hold the same code/device on several rows; keep the most
+    # recently written one (REPLACE INTO always allocated a new rowid)
+    conn.execute(
+        """
+        UPDATE links SET device_id=NULL, device_name=NULL
+        WHERE device_id IS NOT NULL AND rowid NOT IN (
+            SELECT MAX(rowid) FROM links WHERE device_id IS NOT NULL GROUP BY device_id
+        )
+        """
+    )
+    conn.execute(
+        """
+        UPDATE links SET code=NULL
+        WHERE code IS NOT NULL AND rowid NOT IN (
+            SELECT MAX(rowid) FROM links WHERE code IS NOT NULL GROUP BY code
+        )
+        """
+    )
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS links_code_idx ON links(code)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS links_device_id_idx ON links(device_id)")
+
+
+def _migration_devices_table(conn):
+    # move devices out of links so one user can link several headsets;
+    # links is rebuilt rather than using DROP COLUMN, which older SQLite
+    # builds do not support
+    conn.execute(
+        """
+        CREATE TABLE devices (
+            device_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            device_name TEXT
+        )
+        """
+    )
+    conn.execute(
+        "INSERT INTO devices (device_id, user_id, device_name) "
+        "SELECT device_id, user_id, device_name FROM links WHERE device_id IS NOT NULL"
+    )
+    conn.execute("CREATE INDEX devices_user_id_idx ON devices(user_id)")
+    conn.execute("CREATE TABLE links_v4 (user_id TEXT PRIMARY KEY, code TEXT)")
+    conn.execute("INSERT INTO links_v4 (user_id, code) SELECT user_id, code FROM links")
+    conn.execute("DROP TABLE links")
+    conn.execute("ALTER TABLE links_v4 RENAME TO links")
+    conn.execute("CREATE UNIQUE INDEX links_code_idx ON links(code)")
+
+
+def _migration_pair_codes_table(conn):
+    # codes get their own table with an expiry, so issuing one no longer
+    # touches link state; with codes gone, links has nothing left to hold
+    conn.execute(
+        """
+        CREATE TABLE pair_codes (
+            code TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL UNIQUE,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX pair_codes_expires_at_idx ON pair_codes(expires_at)")
+    # codes from before expiry existed get the ten minutes codes had when
+    # this migration was written; a literal, so the migration stays frozen
+    # even if pairing_codes.PAIR_CODE_TTL changes
+    conn.execute(
+        "INSERT INTO pair_codes (code, user_id, expires_at) "
+        "SELECT code, user_id, strftime('%s', 'now') + 600 FROM links WHERE code IS NOT NULL"
+    )
+    conn.execute("DROP TABLE links")
+
+
+def _migration_cluster_tables(conn):
+    # used by the shared-sqlite backend and DeviceRouter; a single-process
+    # server leaves them empty apart from link_changes, which it trims on open
+    conn.execute("CREATE TABLE nodes (node_id TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+    conn.execute(
+        """
+        CREATE TABLE device_routes (
+            device_id TEXT PRIMARY KEY,
+            node_id TEXT NOT NULL,
+            connected_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX device_routes_node_id_idx ON device_routes(node_id)")
+    conn.execute(
+        """
+        CREATE TABLE outbox (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            node_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX outbox_node_id_idx ON outbox(node_id, seq)")
+    # every change to devices is logged so other processes can drop the
+    # affected entries from their LinkCache
+    conn.execute(
+        """
+        CREATE TABLE link_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            device_id TEXT,
+            changed_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER devices_log_insert AFTER INSERT ON devices BEGIN
+            INSERT INTO link_changes (user_id, device_id, changed_at)
+            VALUES (new.user_id, new.device_id, strftime('%s', 'now'));
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER devices_log_update AFTER UPDATE ON devices
+        WHEN old.user_id IS NOT new.user_id OR old.device_name IS NOT new.device_name BEGIN
+            INSERT INTO link_changes (user_id, device_id, changed_at)
+            VALUES (old.user_id, old.device_id, strftime('%s', 'now')),
+                   (new.user_id, new.device_id, strftime('%s', 'now'));
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER devices_log_delete AFTER DELETE ON devices BEGIN
+            INSERT INTO link_changes (user_id, device_id, changed_at)
+            VALUES (old.user_id, old.device_id, strftime('%s', 'now'));
+        END
+        """
+    )
+
+
+MIGRATIONS = [
+    _migration_create_links,
+    _migration_add_device_name,
+    _migration_unique_lookup_indexes,
+    _migration_devices_table,
+    _migration_pair_codes_table,
+    _migration_cluster_tables,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _migrate_sync(conn):
+    """Apply pending migrations and return the resulting schema version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"links DB schema version {version} is newer than this server ({SCHEMA_VERSION})")
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        # IMMEDIATE takes the write lock up front so two processes starting
+        # against the same file cannot both run the same step
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have migrated while we waited for the lock
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= target:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logging.info("Applied links DB migration %d: %s", target, migration.__name__)
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _trim_changes_sync(conn, before):
+    with conn:
+        return conn.execute(SQL_TRIM_CHANGES, (before,)).rowcount
+
+
+def _get_user_by_device_sync(conn, device_id):
+    row = conn.execute(SQL_USER_BY_DEVICE, (device_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _get_devices_for_user_sync(conn, user_id):
+    return tuple(tuple(r) for r in conn.execute(SQL_DEVICES_BY_USER, (user_id,)))
+
+
+def _link_device_sync(conn, user_id, device_id, device_name=None):
+    """Link a device to a user; returns ``(previous_owner, user_devices, previous_owner_devices)``."""
+    with conn:
+        row = conn.execute(SQL_USER_BY_DEVICE, (device_id,)).fetchone()
+        previous_owner = row[0] if row else None
+        conn.execute(SQL_LINK_DEVICE, (device_id, user_id, device_name))
+        devices = _get_devices_for_user_sync(conn, user_id)
+        previous_devices = None
+        if previous_owner and previous_owner != user_id:
+            previous_devices = _get_devices_for_user_sync(conn, previous_owner)
+    return previous_owner, devices, previous_devices
+
+
+def _unlink_device_sync(conn, device_id):
+    """Unlink one device; returns ``(user_id, remaining_devices)`` or ``(None, None)``."""
+    with conn:
+        row = conn.execute(SQL_USER_BY_DEVICE, (device_id,)).fetchone()
+        if not row:
+            return None, None
+        conn.execute(SQL_UNLINK_DEVICE, (device_id,))
+        return row[0], _get_devices_for_user_sync(conn, row[0])
+
+
+def _unlink_user_sync(conn, user_id):
+    """Unlink all of a user's devices; returns the removed ``(device_id, device_name)`` rows."""
+    with conn:
+        devices = _get_devices_for_user_sync(conn, user_id)
+        conn.execute(SQL_UNLINK_USER, (user_id,))
+    return devices
+
+
+def _set_device_names_sync(conn, updates):
+    """Apply ``(device_name, user_id, device_id)`` updates in one transaction."""
+    with conn:
+        conn.executemany(SQL_SET_DEVICE_NAME, updates)
+
+
+class LinksStore:
+    """Pooled access to the links database.
+
+    All public coroutines run on the store's dedicated executor; the pool has
+    exactly one connection per worker thread, so borrowing never blocks.
+    Lookups are answered from a write-through `LinkCache` when possible.
+
+    With ``write_behind`` enabled, device_name updates from `hello` are queued
+    (coalesced per device) and written in one transaction per
+    ``flush_interval`` or every ``batch_size`` updates. Link state changes
+    (pair, unlink) are durable: they flush the queue first and
+    commit before returning. `close()` flushes whatever is still queued.
+
+    This is the default "sqlite" backend: it assumes it is the only process
+    writing the DB file, so its cache is never invalidated from outside.
+    """
+
+    # whether other server processes read and write the same state
+    shared = False
+    # link_changes rows older than this are dropped on open; nobody else
+    # reads them in single-process mode
+    change_retention = 0.0
+
+    def __init__(self, db_file, pool_size=4, busy_timeout=5.0, cache_size=10000,
+                 write_behind=True, flush_interval=0.05, batch_size=500):
+        self.db_file = db_file
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.cache = LinkCache(cache_size)
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.db_reads = 0
+        self.db_writes = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self._pool = queue.SimpleQueue()
+        self._conns = []
+        self._executor = None
+        # device_id -> (device_name, user_id, device_id), oldest first
+        self._pending_names = {}
+        self._dirty = None
+        self._flush_lock = None
+        self._flusher = None
+        # optional ``fn(helper name, queue wait, run time)`` called on the
+        # event loop after every `run()`, e.g. to feed metrics histograms
+        self.observer = None
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=64,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode and
+        # avoids an fsync on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def open_sync(self):
+        if self._executor is not None:
+            return
+        for _ in range(self.pool_size):
+            conn = self._connect()
+            self._conns.append(conn)
+            self._pool.put(conn)
+        version = self._with_conn(_migrate_sync)
+        self._with_conn(_trim_changes_sync, time.time() - self.change_retention)
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="links-db")
+        logging.info("Links store opened (%s, schema v%s, pool=%d)", self.db_file, version, self.pool_size)
+
+    async def open(self):
+        await asyncio.to_thread(self.open_sync)
+        self._dirty = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        if self.write_behind and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._pending_names and self._conns:
+            # graceful shutdown: the loop may already be gone, so write the
+            # remainder directly on this thread
+            updates = list(self._pending_names.values())
+            self._pending_names.clear()
+            try:
+                self._with_conn(_set_device_names_sync, updates)
+                logging.info("Flushed %d queued device_name updates on shutdown", len(updates))
+            except Exception:
+                logging.exception("Failed to flush queued device_name updates on shutdown")
+        for conn in self._conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._conns = []
+        self._pool = queue.SimpleQueue()
+
+    def _with_conn(self, fn, *args):
+        conn = self._pool.get()
+        try:
+            return fn(conn, *args)
+        finally:
+            self._pool.put(conn)
+
+    def run_sync(self, fn, *args):
+        """Run ``fn(conn, *args)`` on the calling thread, for shutdown paths."""
+        return self._with_conn(fn, *args)
+
+    async def run(self, fn, *args):
+        """Run ``fn(conn, *args)`` on a pooled connection in the store executor."""
+        if self._executor is None:
+            raise RuntimeError("LinksStore is not open")
+        loop = asyncio.get_running_loop()
+        if self.observer is None:
+            return await loop.run_in_executor(self._executor, self._with_conn, fn, *args)
+        # [submitted, started, finished], filled in by _timed on the DB thread
+        times = [time.perf_counter(), None, None]
+        try:
+            return await loop.run_in_executor(self._executor, self._timed, times, fn, *args)
+        finally:
+            if times[2] is not None:
+                self.observer(fn.__name__, times[1] - times[0], times[2] - times[1])
+
+    def _timed(self, times, fn, *args):
+        times[1] = time.perf_counter()
+        try:
+            return self._with_conn(fn, *args)
+        finally:
+            times[2] = time.perf_counter()
+
+    async def _cached_read(self, table, key, fn):
+        value = self.cache.lookup(table, key)
+        if value is not MISSING:
+            return value
+        generation = self.cache.generation
+        self.db_reads += 1
+        value = await self.run(fn, key)
+        self.cache.fill(generation, table, key, value)
+        return value
+
+    async def _write(self, fn, *args):
+        if self._pending_names:
+            await self.flush()
+        # bump before and after: reads that overlap the write in either
+        # direction must not repopulate the cache with the old row
+        self.cache.bump()
+        self.db_writes += 1
+        try:
+            return await self.run(fn, *args)
+        finally:
+            self.cache.bump()
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty.wait()
+            if len(self._pending_names) < self.batch_size:
+                await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Failed to flush queued device_name updates")
+
+    async def flush(self):
+        """Write all queued device_name updates, one transaction per batch."""
+        if self._flush_lock is None:
+            return
+        # the lock makes a durable write wait for a batch already in flight
+        async with self._flush_lock:
+            while self._pending_names:
+                batch = []
+                for device_id in list(self._pending_names)[:self.batch_size]:
+                    batch.append(self._pending_names.pop(device_id))
+                self.db_writes += 1
+                try:
+                    await self.run(_set_device_names_sync, batch)
+                except Exception:
+                    logging.exception("Dropped %d queued device_name updates", len(batch))
+                    continue
+                self.flushes += 1
+                self.flushed_rows += len(batch)
+            self._dirty.clear()
+
+    async def get_user_by_device(self, device_id):
+        return await self._cached_read(self.cache.devices, device_id, _get_user_by_device_sync)
+
+    def cached_user(self, device_id):
+        """The cached user of ``device_id`` (None: known unlinked), or MISSING; never queries."""
+        return self.cache.devices.get(device_id)
+
+    async def get_devices(self, user_id):
+        """Return the user's linked devices as ``((device_id, device_name), ...)``."""
+        return await self._cached_read(self.cache.users, user_id, _get_devices_for_user_sync)
+
+    async def link_device(self, user_id, device_id, device_name=None):
+        """Link a device to a user, moving it away from any previous owner."""
+        cache = self.cache
+        devices = cache.users.get(user_id)
+        if devices is not MISSING and (device_id, device_name) in devices:
+            cache.skipped_writes += 1
+            return
+        previous_owner, devices, previous_devices = await self._write(
+            _link_device_sync, user_id, device_id, device_name
+        )
+        if previous_devices is not None:
+            cache.users.put(previous_owner, previous_devices)
+        cache.users.put(user_id, devices)
+        cache.devices.put(device_id, user_id)
+
+    async def update_device_name(self, user_id, device_id, device_name):
+        """Record a new name for a linked device; queued when write-behind is on."""
+        if not self.write_behind:
+            await self.link_device(user_id, device_id, device_name)
+            return
+        cache = self.cache
+        devices = cache.users.get(user_id)
+        if devices is not MISSING:
+            if (device_id, device_name) in devices:
+                cache.skipped_writes += 1
+                return
+            # the cache already reflects the queued name, so nothing reads
+            # the old value while it waits for the next flush
+            cache.users.put(user_id, tuple(
+                (d, device_name if d == device_id else n) for d, n in devices
+            ))
+        cache.bump()
+        self._pending_names.pop(device_id, None)
+        self._pending_names[device_id] = (device_name, user_id, device_id)
+        self._dirty.set()
+
+    async def unlink_device(self, device_id):
+        """Unlink one device; returns the user it was linked to, or None."""
+        user_id, devices = await self._write(_unlink_device_sync, device_id)
+        self.cache.devices.put(device_id, None)
+        if user_id:
+            self.cache.users.put(user_id, devices)
+        return user_id
+
+    async def unlink_user(self, user_id):
+        """Unlink all of the user's devices and return their ids."""
+        removed = await self._write(_unlink_user_sync, user_id)
+        for device_id, _ in removed:
+            self.cache.devices.put(device_id, None)
+        self.cache.users.put(user_id, ())
+        return [device_id for device_id, _ in removed]
+
+    def stats(self):
+        """Cache counters plus the number of queries that actually reached SQLite."""
+        return dict(
+            self.cache.stats(),
+            db_reads=self.db_reads,
+            db_writes=self.db_writes,
+            pending_writes=len(self._pending_names),
+            flushes=self.flushes,
+            flushed_rows=self.flushed_rows,
+        )
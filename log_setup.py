@@ -0,0 +1,149 @@
+"""
+Logging setup: background writer, optional JSON lines, rate caps.
+
+`setup_logging()` replaces ``logging.basicConfig``:
+
+- the root logger gets a `QueueHandler`; a `QueueListener` thread formats
+  records and writes them to stderr, so a handler never blocks the event
+  loop on terminal or pipe I/O. Records are queued unformatted: with
+  ``logging.info("Device connected: %s", device_id)`` the message is only
+  built on the writer thread, and not at all for dropped records.
+- ``fmt="json"`` writes one JSON object per line (time, level, logger,
+  message, its %-arguments, any ``extra=`` fields and the formatted
+  exception).
+- `RateCap` lets each message template through at most ``rate`` times per
+  second; the next record that passes reports how many were suppressed.
+  Warnings and errors are never capped, so per-connection INFO lines cannot
+  flood the log during a reconnect storm while failures stay visible.
+
+Neither format prints the caller's file and line, so records skip the
+stack walk that finds them (the logging cookbook's ``_srcfile = None``
+optimization) and the multiprocessing process-name lookup.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+from protocol import encode
+
+# LogRecord attributes; anything else on a record came from ``extra=``
+_RECORD_FIELDS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.args and isinstance(record.args, tuple):
+            # the %-arguments are the interesting values, e.g. a device id
+            entry["args"] = [a if isinstance(a, (str, int, float, bool, type(None))) else str(a) for a in record.args]
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        try:
+            return encode(entry)
+        except TypeError:
+            # an extra= value the codec cannot serialize
+            return encode({k: v if isinstance(v, (str, int, float, bool, type(None))) else repr(v)
+                           for k, v in entry.items()})
+
+
+class RateCap(logging.Filter):
+    """Pass each (logger, template) at most ``rate`` times per second below ``max_level``."""
+
+    def __init__(self, rate=20.0, max_level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.max_level = max_level
+        # (logger, template) -> [window start, passed in window, suppressed]
+        self._windows = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno > self.max_level or self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= 1.0:
+            dropped = window[2] if window is not None else 0
+            self._windows[key] = [now, 1, 0]
+            if dropped:
+                record.suppressed = dropped
+            if len(self._windows) > 10000:
+                # templates are a bounded set, but keys built from f-strings
+                # are not; forget windows that have closed
+                self._windows = {k: w for k, w in self._windows.items() if now - w[0] < 1.0}
+            return True
+        if window[1] < self.rate:
+            window[1] += 1
+            return True
+        window[2] += 1
+        self.suppressed += 1
+        return False
+
+
+class _SuppressedNote(logging.Filter):
+    # text format: mention what RateCap dropped before this record
+    def filter(self, record):
+        dropped = getattr(record, "suppressed", 0)
+        if dropped:
+            record.msg = f"{record.msg} (+{dropped} similar suppressed)"
+            record.suppressed = 0
+        return True
+
+
+_listener = None
+
+
+def stop_logging():
+    """Flush and stop the background writer (registered with atexit)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    # the stock prepare() formats on the caller's thread; the listener runs
+    # in this process, so the record can travel as is
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=logging.INFO, fmt="text", rate=20.0, stream=None):
+    """Route the root logger through a background writer; returns the listener."""
+    global _listener
+    stop_logging()
+    logging._srcfile = None
+    logging.logMultiprocessing = False
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        handler.addFilter(_SuppressedNote())
+    records = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(records)
+    if rate > 0:
+        queue_handler.addFilter(RateCap(rate))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,120 @@
+"""
+Event loops for server_ws: optional uvloop and a loop in its own thread.
+
+`LoopThread` runs an event loop in a daemon thread. With WS_THREAD=1,
+server_ws gives it the WebSocket server and everything devices touch
+(store, pairing codes, registry, router, library cache), while the main
+loop keeps the Discord gateway and slash commands. A flood of device
+frames then queues up on the device loop instead of in front of
+`interaction.response.defer()`; the two threads still share the GIL, but
+the interpreter switches between them every few milliseconds.
+
+Objects owned by the device loop are only used from its thread: the bot
+side awaits ``LoopThread.run(coro)``, which starts ``coro`` there via
+``call_soon_threadsafe`` and hands the result (or exception) back to the
+calling loop. Cancelling the caller cancels the remote task and waits for
+it to finish its cleanup, however often the caller is cancelled again.
+
+uvloop is used for new loops when it is installed, unless USE_UVLOOP=0.
+"""
+import asyncio
+import logging
+import os
+import threading
+
+try:
+    import uvloop
+except ImportError:  # optional speedup
+    uvloop = None
+
+if os.getenv("USE_UVLOOP", "1") == "0":
+    uvloop = None
+
+LOOP_IMPL = "uvloop" if uvloop is not None else "asyncio"
+
+
+def new_event_loop():
+    return uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+
+
+def run(coro):
+    """``asyncio.run(coro)``, on uvloop when available."""
+    if uvloop is not None:
+        return uvloop.run(coro)
+    return asyncio.run(coro)
+
+
+class LoopThread:
+    def __init__(self, name="loop-thread"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self.calls = 0
+
+    def start(self):
+        """Start the thread and return once its loop is running."""
+        self._thread = threading.Thread(target=self._main, name=self.name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _main(self):
+        self.loop = new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            try:
+                self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            finally:
+                self.loop.close()
+
+    def stop(self, timeout=5.0):
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning("%s did not stop within %.0fs", self.name, timeout)
+
+    async def run(self, coro):
+        """Await ``coro`` on this thread's loop from another loop."""
+        caller = asyncio.get_running_loop()
+        result = caller.create_future()
+        started = []
+
+        def _deliver(task):
+            if result.done():
+                return
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result())
+
+        def _start():
+            task = self.loop.create_task(coro)
+            started.append(task)
+            task.add_done_callback(lambda t: caller.call_soon_threadsafe(_deliver, t))
+
+        self.calls += 1
+        self.loop.call_soon_threadsafe(_start)
+        try:
+            # shielded so a cancelled caller can still wait for the result below
+            return await asyncio.shield(result)
+        except asyncio.CancelledError:
+            # _start was queued first, so the task exists by the time this runs
+            self.loop.call_soon_threadsafe(lambda: started[0].cancel())
+            while not result.done():
+                try:
+                    # asyncio.wait() leaves ``result`` alone if we are cancelled again
+                    await asyncio.wait([result])
+                except asyncio.CancelledError:
+                    pass
+            raise
+
+    def stats(self):
+        return {"loop": LOOP_IMPL, "running": bool(self._thread and self._thread.is_alive()), "calls": self.calls}
@@ -0,0 +1,205 @@
+"""
+Counters, histograms and a local Prometheus endpoint.
+
+`MetricsRegistry` holds two kinds of metrics:
+
+- `Counter` and `Histogram` objects that code updates as things happen.
+  Both are a dict lookup plus an add (histograms bisect a short bucket
+  list), cheap enough for the per-frame and per-query paths.
+- collectors: functions called only when the metrics are scraped, which
+  read numbers the components already keep (`registry.pending_count()`,
+  `Dispatcher.stats()`, ...), so those cost nothing on the hot path.
+
+`serve(registry, host, port)` answers ``GET /metrics`` with the Prometheus
+text format; `log_summary_loop()` logs a one-line summary periodically.
+"""
+import asyncio
+import bisect
+import logging
+import time
+
+# seconds; covers a cached DB read up to a slow device round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_text(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # label values -> count
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for values, count in sorted(self.values.items()):
+            yield f"{self.name}{_labels_text(self.labels, values)} {_number(count)}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self.series = {}
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, q, *labels):
+        """Upper bound of the bucket holding quantile ``q`` (None without samples)."""
+        series = self.series.get(labels)
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), series[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for values, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = _labels_text(self.labels, values, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            labels = _labels_text(self.labels, values)
+            yield f"{self.name}_sum{labels} {_number(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class MetricsRegistry:
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(self.prefix + name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self.prefix + name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register ``fn() -> [(name, type, help, {label tuple: value} or value, label names)]``."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for fn in self._collectors:
+            try:
+                samples = fn()
+            except Exception:
+                logging.exception("Metrics collector %s failed", fn.__name__)
+                continue
+            for name, mtype, help, values, labels in samples:
+                name = self.prefix + name
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {mtype}")
+                if not isinstance(values, dict):
+                    values = {(): values}
+                for key, value in sorted(values.items()):
+                    lines.append(f"{name}{_labels_text(labels, key)} {_number(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+async def serve(registry, host="127.0.0.1", port=9108):
+    """Start an HTTP server answering ``GET /metrics``; returns the asyncio server."""
+    async def _handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # skip the headers; nothing in them matters here
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, ctype, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", registry.render().encode()
+            else:
+                status, ctype, body = "404 Not Found", "text/plain", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(_handle, host, port)
+    logging.info("Metrics on http://%s:%s/metrics", host, port)
+    return server
+
+
+async def log_summary_loop(interval, summary):
+    """Log ``summary()`` every ``interval`` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            logging.info("Metrics: %s", summary())
+        except Exception:
+            logging.exception("Failed to build metrics summary")
+
+
+class Timer:
+    """``with Timer(histogram, *labels):`` observes the block's duration."""
+
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
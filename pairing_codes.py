@@ -0,0 +1,194 @@
+"""
+Issue, look up and consume link codes for `/link` and `pair`.
+
+Codes live in the `pair_codes` table (one outstanding code per user, each
+with an expiry) and in an in-memory index loaded at startup, so checking a
+code the device sent never needs a DB round trip unless it is valid:
+
+- `issue()` picks a random 6-digit code that is not in use, replaces the
+  user's previous code and returns it.
+- `consume()` returns the user for a live code and deletes it, so each
+  code pairs exactly one device.
+- a background task purges expired codes from memory and, in one DELETE,
+  from the DB.
+
+With a shared store (several server processes, see storage.py) a code may
+have been issued by another process, so `consume()` checks the DB for codes
+it does not know instead of rejecting them outright.
+"""
+import asyncio
+import heapq
+import logging
+import secrets
+import sqlite3
+import time
+
+SQL_LIVE_CODES = "SELECT code, user_id, expires_at FROM pair_codes WHERE expires_at > ?"
+SQL_DELETE_USER_CODE = "DELETE FROM pair_codes WHERE user_id=?"
+SQL_INSERT_CODE = "INSERT INTO pair_codes (code, user_id, expires_at) VALUES (?, ?, ?)"
+SQL_CONSUME_CODE = "DELETE FROM pair_codes WHERE code=? AND expires_at > ?"
+SQL_CODE_OWNER = "SELECT user_id FROM pair_codes WHERE code=? AND expires_at > ?"
+SQL_PURGE_CODES = "DELETE FROM pair_codes WHERE expires_at <= ?"
+
+
+def _load_codes_sync(conn, now):
+    return conn.execute(SQL_LIVE_CODES, (now,)).fetchall()
+
+
+def _issue_code_sync(conn, user_id, code, expires_at):
+    with conn:
+        conn.execute(SQL_DELETE_USER_CODE, (user_id,))
+        conn.execute(SQL_INSERT_CODE, (code, user_id, expires_at))
+
+
+def _consume_code_sync(conn, code, now):
+    with conn:
+        return conn.execute(SQL_CONSUME_CODE, (code, now)).rowcount > 0
+
+
+def _claim_code_sync(conn, code, now):
+    """Consume a code issued elsewhere; returns its user or None."""
+    row = conn.execute(SQL_CODE_OWNER, (code, now)).fetchone()
+    if row is None:
+        return None
+    # only one process's DELETE can remove the row
+    return row[0] if _consume_code_sync(conn, code, now) else None
+
+
+def _purge_codes_sync(conn, now):
+    with conn:
+        return conn.execute(SQL_PURGE_CODES, (now,)).rowcount
+
+
+# seconds a /link code stays valid
+PAIR_CODE_TTL = 600.0
+
+
+class PairingCodes:
+    def __init__(self, store, ttl=PAIR_CODE_TTL, purge_interval=60.0, digits=6):
+        self.store = store
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.digits = digits
+        # code -> (user_id, expires_at) and user_id -> code
+        self._by_code = {}
+        self._by_user = {}
+        # (expires_at, code) min-heap; entries for replaced codes are skipped lazily
+        self._expiry = []
+        self._purger = None
+        self.issued = 0
+        self.consumed = 0
+        self.rejected = 0
+        self.purged = 0
+
+    async def open(self):
+        rows = await self.store.run(_load_codes_sync, time.time())
+        for code, user_id, expires_at in rows:
+            self._remember(code, user_id, expires_at)
+        if self._purger is None:
+            self._purger = asyncio.create_task(self._purge_loop())
+        logging.info("Loaded %d live pairing codes", len(rows))
+
+    def close(self):
+        if self._purger is not None:
+            self._purger.cancel()
+            self._purger = None
+
+    def _remember(self, code, user_id, expires_at):
+        self._by_code[code] = (user_id, expires_at)
+        self._by_user[user_id] = code
+        heapq.heappush(self._expiry, (expires_at, code))
+
+    def _forget(self, code):
+        entry = self._by_code.pop(code, None)
+        if entry and self._by_user.get(entry[0]) == code:
+            del self._by_user[entry[0]]
+
+    def _new_code(self):
+        low = 10 ** (self.digits - 1)
+        for _ in range(100):
+            code = str(low + secrets.randbelow(9 * low))
+            if code not in self._by_code:
+                return code
+        raise RuntimeError("pairing code space exhausted")
+
+    async def issue(self, user_id):
+        """Create a fresh code for the user (replacing any previous one); returns ``(code, expires_at)``."""
+        previous = self._by_user.get(user_id)
+        if previous:
+            self._forget(previous)
+        for attempt in range(3):
+            code = self._new_code()
+            expires_at = time.time() + self.ttl
+            # reserve in memory first so a concurrent issue() cannot pick it too
+            self._remember(code, user_id, expires_at)
+            try:
+                await self.store.run(_issue_code_sync, user_id, code, expires_at)
+            except sqlite3.IntegrityError:
+                # with a shared store another process may hold the same code
+                self._forget(code)
+                if attempt == 2:
+                    raise
+                continue
+            except Exception:
+                self._forget(code)
+                raise
+            self.issued += 1
+            return code, expires_at
+
+    def peek(self, code):
+        """Return the user a live code belongs to without consuming it."""
+        entry = self._by_code.get(code)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    async def consume(self, code):
+        """Return the user for a live code and invalidate it; None if unknown or expired."""
+        user_id = self.peek(code)
+        if user_id is None:
+            if self.store.shared:
+                user_id = await self.store.run(_claim_code_sync, code, time.time())
+                if user_id is not None:
+                    self.consumed += 1
+                    return user_id
+            self.rejected += 1
+            return None
+        # claim it before awaiting so two pair attempts can't both win
+        self._forget(code)
+        if not await self.store.run(_consume_code_sync, code, time.time()):
+            self.rejected += 1
+            return None
+        self.consumed += 1
+        return user_id
+
+    def purge_expired(self, now=None):
+        """Drop expired codes from the in-memory index; returns how many were dropped."""
+        now = time.time() if now is None else now
+        dropped = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, code = heapq.heappop(self._expiry)
+            entry = self._by_code.get(code)
+            if entry is not None and entry[1] == expires_at:
+                self._forget(code)
+                dropped += 1
+        return dropped
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                now = time.time()
+                self.purge_expired(now)
+                self.purged += await self.store.run(_purge_codes_sync, now)
+            except Exception:
+                logging.exception("Failed to purge expired pairing codes")
+
+    def stats(self):
+        return {
+            "live": len(self._by_code),
+            "issued": self.issued,
+            "consumed": self.consumed,
+            "rejected": self.rejected,
+            "purged": self.purged,
+        }
@@ -1,73 +1,61 @@
 """
 Print registered global and (optionally) guild commands for the bot defined in `server_ws.py`.
 Usage:
-  python print_commands.py            # prints global commands
-  python print_commands.py <GUILD_ID> # prints global and guild commands for the guild
+  python print_commands.py               # prints global commands
+  python print_commands.py <GUILD_ID>... # prints global and guild commands for the guilds
 
-This script imports `BOT_TOKEN` from `server_ws.py` (no env needed) and uses the Discord REST API.
+This script reads the token from config.py (BOT_TOKEN, bot_linker.json or --token) and uses the
+Discord REST API through discord_admin.AdminClient (the application id is cached on disk after
+the first run).
 """
-import sys
+import argparse
 import asyncio
-import aiohttp
-import discord
-from server_ws import BOT_TOKEN
+import config
+from discord_admin import AdminClient, map_concurrent
 
-API_BASE = "https://discord.com/api/v10"
 
-
-async def main():
-    if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
-        print("BOT_TOKEN is not set in server_ws.py. Please set it to your bot token.")
+def _print_commands(title, data):
+    print(title)
+    if isinstance(data, Exception):
+        print(f"  Failed to fetch commands: {data}")
         return
+    if not data:
+        print("  (none)")
+    for c in data:
+        print(f"  - {c.get('name')} (id={c.get('id')}) - {c.get('description')}")
 
-    guild_id = None
-    if len(sys.argv) > 1:
-        guild_id = sys.argv[1]
 
-    # login with a lightweight client to retrieve application id
-    client = discord.Client(intents=discord.Intents.none())
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("guild_ids", nargs="*", metavar="GUILD_ID", help="Also print these guilds' commands")
+    config.add_arguments(parser, ("token",))
+    args = parser.parse_args()
+
     try:
-        await client.login(BOT_TOKEN)
-        app_info = await client.application_info()
-        app_id = app_info.id
-    except Exception as e:
-        print(f"Failed to login or fetch application info: {e}")
+        settings = config.load(args)
+    except config.ConfigError as e:
+        print(e)
+        return
+    if settings.token_missing():
+        print("BOT_TOKEN is not set. Set it in the environment, bot_linker.json or with --token.")
         return
-    finally:
-        await client.close()
-
-    headers = {
-        "Authorization": f"Bot {BOT_TOKEN}",
-        "User-Agent": "DiscordBot (print_commands, 1.0)",
-    }
-
-    async with aiohttp.ClientSession() as sess:
-        # global commands
-        url = f"{API_BASE}/applications/{app_id}/commands"
-        async with sess.get(url, headers=headers) as r:
-            if r.status != 200:
-                print(f"Failed to fetch global commands: {r.status} {await r.text()}")
-            else:
-                data = await r.json()
-                print("Global commands:")
-                if not data:
-                    print("  (none)")
-                for c in data:
-                    print(f"  - {c.get('name')} (id={c.get('id')}) - {c.get('description')}")
 
-        # guild commands (optional)
-        if guild_id:
-            url = f"{API_BASE}/applications/{app_id}/guilds/{guild_id}/commands"
-            async with sess.get(url, headers=headers) as r:
-                if r.status != 200:
-                    print(f"Failed to fetch guild commands: {r.status} {await r.text()}")
-                else:
-                    data = await r.json()
-                    print(f"\nGuild commands for {guild_id}:")
-                    if not data:
-                        print("  (none)")
-                    for c in data:
-                        print(f"  - {c.get('name')} (id={c.get('id')}) - {c.get('description')}")
+    guild_ids = args.guild_ids
+
+    async with AdminClient(settings.token) as client:
+        try:
+            await client.app_id()
+        except Exception as e:
+            print(f"Failed to fetch application info: {e}")
+            return
+        scopes = [None] + guild_ids
+        results = await map_concurrent(client.list_commands, scopes, client.concurrency)
+
+    for guild_id, data in zip(scopes, results):
+        if guild_id is None:
+            _print_commands("Global commands:", data)
+        else:
+            _print_commands(f"\nGuild commands for {guild_id}:", data)
 
 if __name__ == '__main__':
     asyncio.run(main())
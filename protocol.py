@@ -0,0 +1,294 @@
+"""
+Device WebSocket protocol: codec, per-type schemas and dispatch.
+
+Device frames are JSON objects with a ``type``. `Dispatcher` maps each type
+to a handler registered with ``@dispatcher.handler(type, required=...,
+optional=...)``; `dispatch()` decodes a frame once, checks its fields
+against that handler's schema and awaits the handler.
+
+- Frames that are not JSON objects get ``{"type": "error", "reason":
+  "invalid_json"}`` instead of being dropped silently.
+- Frames failing a schema get the handler's ``invalid`` reply (by default
+  ``{"type": "error", "reason": "invalid_message", "for": <type>}``; `pair`
+  and `unlink` keep their pair_result reasons, which existing clients show).
+- Unknown types are counted and otherwise ignored, as before.
+
+The codec uses orjson, else msgspec, when installed and falls back to the
+json module. Constant replies (hello ack, pair failures, force_unlink) are
+encoded once at import.
+
+Wire format negotiation: a `hello` may list the encodings the device can
+send, e.g. ``"encodings": ["msgpack", "cbor", "json"]``. The server picks
+the first one it supports (msgpack and cbor need the msgpack / cbor2
+packages) and answers with ``"encoding"`` plus the compression the
+WebSocket handshake negotiated (``"permessage-deflate"`` or null). From
+then on the device may send bulk payloads such as `library_response` or
+`library_chunk` as binary frames in that encoding; text frames are always
+JSON, so clients that send no ``encodings`` (index.html) see no change.
+Frames and payload bytes are counted per message type: inbound by
+encoding, to measure what the binary formats save, and outbound by the
+type each sender passes to `Dispatcher.count_sent` (never by decoding
+the frame again).
+
+Session resume: `pair` and `hello` replies to a linked device carry a
+``"session"`` token (see session_tokens.py); sending it back in the next
+`hello` lets the server skip looking the device up.
+"""
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+try:
+    import msgspec
+except ImportError:  # optional speedup
+    msgspec = None
+try:
+    import msgpack
+except ImportError:  # optional binary encoding
+    msgpack = None
+try:
+    import cbor2
+except ImportError:  # optional binary encoding
+    cbor2 = None
+
+if orjson is not None:
+    CODEC = "orjson"
+    decode = orjson.loads
+
+    def encode(obj):
+        return orjson.dumps(obj).decode()
+elif msgspec is not None:
+    CODEC = "msgspec"
+    _msgspec_decoder = msgspec.json.Decoder()
+    _msgspec_encoder = msgspec.json.Encoder()
+    decode = _msgspec_decoder.decode
+
+    def encode(obj):
+        return _msgspec_encoder.encode(obj).decode()
+else:
+    CODEC = "json"
+    decode = json.loads
+    encode = json.dumps
+
+# name -> (decode, encode) for binary frames
+BINARY_CODECS = {}
+if msgpack is not None:
+    BINARY_CODECS["msgpack"] = (lambda data: msgpack.unpackb(data, raw=False), msgpack.packb)
+if cbor2 is not None:
+    BINARY_CODECS["cbor"] = (cbor2.loads, cbor2.dumps)
+
+# decoders raise one of these for malformed input, depending on the codec
+DECODE_ERRORS = (ValueError, TypeError) + tuple(
+    e for e in (
+        getattr(msgspec, "DecodeError", None),
+        getattr(msgpack, "UnpackException", None),
+        getattr(cbor2, "CBORDecodeError", None),
+    ) if e is not None
+)
+
+# ----- pre-encoded replies -----
+HELLO_OK = encode({"type": "hello", "ok": True})
+PAIR_MISSING_FIELDS = encode({"type": "pair_result", "ok": False, "reason": "missing_fields"})
+PAIR_INVALID_CODE = encode({"type": "pair_result", "ok": False, "reason": "invalid_code"})
+PAIR_RATE_LIMITED = encode({"type": "pair_result", "ok": False, "reason": "rate_limited"})
+UNLINK_OK = encode({"type": "pair_result", "ok": True})
+UNLINK_MISSING_DEVICE_ID = encode({"type": "pair_result", "ok": False, "reason": "missing_device_id"})
+UNLINK_NOT_LINKED = encode({"type": "pair_result", "ok": False, "reason": "not_linked"})
+FORCE_UNLINK = encode({"type": "force_unlink"})
+INVALID_JSON = encode({"type": "error", "reason": "invalid_json"})
+
+
+def negotiate_encoding(offered):
+    """Pick the device's preferred binary encoding that we support, else "json"."""
+    if isinstance(offered, list):
+        for name in offered:
+            if name in BINARY_CODECS:
+                return name
+    return "json"
+
+
+def hello_ok(encoding=None, compression=None, session=None):
+    """Hello ack; ``encoding``/``compression`` after negotiation, ``session`` for linked devices."""
+    reply = {"type": "hello", "ok": True}
+    if encoding is not None:
+        reply["encoding"] = encoding
+        reply["compression"] = compression
+    if session is not None:
+        reply["session"] = session
+    return encode(reply)
+
+
+def pair_ok(user_id, session=None):
+    reply = {"type": "pair_result", "ok": True, "discord_id": user_id}
+    if session is not None:
+        reply["session"] = session
+    return encode(reply)
+
+
+def discord_message(text):
+    return encode({"type": "discord_message", "text": text})
+
+
+class Connection:
+    """Per-socket state handed to every handler."""
+
+    __slots__ = ("ws", "device_id", "encoding", "binary_decode", "count_sent")
+
+    def __init__(self, ws, count_sent=None):
+        self.ws = ws
+        # count_sent(mtype, message) after each send, e.g. Dispatcher.count_sent
+        self.count_sent = count_sent
+        self.device_id = None
+        self.encoding = "json"
+        # binary frames are JSON too until hello negotiates something else
+        self.binary_decode = decode
+
+    def set_encoding(self, encoding):
+        self.encoding = encoding
+        self.binary_decode = BINARY_CODECS[encoding][0] if encoding in BINARY_CODECS else decode
+
+    def compression(self):
+        """Name of the negotiated WebSocket compression extension, or None."""
+        for extension in getattr(self.ws, "extensions", None) or ():
+            return extension.name
+        return None
+
+    async def send(self, message, mtype):
+        """Send an encoded message whose type is ``mtype``."""
+        await self.ws.send(message)
+        if self.count_sent is not None:
+            self.count_sent(mtype, message)
+
+
+class _Route:
+    __slots__ = ("handler", "checks", "invalid", "invalid_type")
+
+    def __init__(self, handler, checks, invalid, invalid_type):
+        self.handler = handler
+        self.checks = checks
+        self.invalid = invalid
+        self.invalid_type = invalid_type
+
+
+def _compile_schema(required, optional):
+    """Turn ``{field: type(s) or None}`` maps into ``(field, types, required)`` checks."""
+    checks = []
+    for fields, is_required in ((required or {}, True), (optional or {}, False)):
+        for field, types in fields.items():
+            checks.append((field, types, is_required))
+    return tuple(checks)
+
+
+def _check(checks, data):
+    """Return the first schema problem in ``data`` or None."""
+    for field, types, required in checks:
+        value = data.get(field)
+        if value is None:
+            if required:
+                return f"missing {field}"
+            continue
+        # bool is an int subclass, but never a valid id or code
+        if types is not None and (not isinstance(value, types) or value is True or value is False):
+            return f"bad {field}"
+    return None
+
+
+def _byte_length(frame):
+    """Payload bytes of a frame: UTF-8 length for text frames."""
+    if isinstance(frame, str):
+        # isascii() is O(1) for the compact strings the decoder produces
+        return len(frame) if frame.isascii() else len(frame.encode())
+    return len(frame)
+
+
+class Dispatcher:
+    def __init__(self):
+        self._routes = {}
+        self.handled = {}
+        self.invalid_json = 0
+        self.invalid = 0
+        self.unknown = 0
+        self.failed = 0
+        # mtype -> [text frames, text bytes, binary frames, binary bytes]
+        self.traffic = {}
+        # mtype -> [frames, bytes] sent to devices
+        self.sent = {}
+
+    def handler(self, mtype, required=None, optional=None, invalid=None):
+        """Register ``async fn(conn, data)`` for frames of type ``mtype``.
+
+        ``required`` / ``optional`` map field names to an accepted type (or
+        tuple of types, or None for any); ``invalid`` is the pre-encoded
+        reply for frames that fail the check.
+        """
+        if invalid is None:
+            invalid = encode({"type": "error", "reason": "invalid_message", "for": mtype})
+        # once per handler, so rejecting a frame never decodes the reply
+        invalid_type = decode(invalid)["type"]
+
+        def register(fn):
+            self._routes[mtype] = _Route(fn, _compile_schema(required, optional), invalid, invalid_type)
+            self.handled[mtype] = 0
+            self.traffic[mtype] = [0, 0, 0, 0]
+            return fn
+        return register
+
+    async def dispatch(self, conn, frame):
+        """Decode, validate and handle one frame."""
+        binary = not isinstance(frame, str)
+        try:
+            data = conn.binary_decode(frame) if binary else decode(frame)
+        except DECODE_ERRORS:
+            data = None
+        if not isinstance(data, dict):
+            self.invalid_json += 1
+            await conn.send(INVALID_JSON, "error")
+            return
+        mtype = data.get("type")
+        route = self._routes.get(mtype) if isinstance(mtype, str) else None
+        if route is None:
+            self.unknown += 1
+            return
+        # payload size before permessage-deflate
+        traffic = self.traffic[mtype]
+        traffic[2 * binary] += 1
+        traffic[2 * binary + 1] += _byte_length(frame)
+        problem = _check(route.checks, data)
+        if problem is not None:
+            self.invalid += 1
+            logging.debug("Rejected %s frame from %s: %s", mtype, conn.device_id, problem)
+            await conn.send(route.invalid, route.invalid_type)
+            return
+        self.handled[mtype] += 1
+        try:
+            await route.handler(conn, data)
+        except Exception:
+            # one bad frame must not take the connection down with it
+            self.failed += 1
+            logging.exception("Failed to handle %s from %s", mtype, conn.device_id)
+
+    def count_sent(self, mtype, message, frames=1):
+        """Count ``message`` (encoded, of type ``mtype``) sent to ``frames`` devices."""
+        sent = self.sent.get(mtype)
+        if sent is None:
+            sent = self.sent[mtype] = [0, 0]
+        sent[0] += frames
+        sent[1] += frames * _byte_length(message)
+
+    def stats(self):
+        return {
+            "codec": CODEC,
+            "handled": dict(self.handled),
+            "invalid_json": self.invalid_json,
+            "invalid": self.invalid,
+            "unknown": self.unknown,
+            "failed": self.failed,
+            "traffic": {
+                mtype: {"text_frames": t[0], "text_bytes": t[1], "binary_frames": t[2], "binary_bytes": t[3]}
+                for mtype, t in self.traffic.items() if t[0] or t[2]
+            },
+            "sent": {mtype: {"frames": t[0], "bytes": t[1]} for mtype, t in self.sent.items()},
+        }
@@ -0,0 +1,85 @@
+"""
+In-memory token buckets for throttling pairing attempts and slash commands.
+
+``RateLimiter(rate, burst)`` keeps one bucket per key (a device_id, an IP
+address, a Discord user id): each holds up to ``burst`` tokens and refills
+at ``rate`` tokens per second. `allow(key)` takes a token or returns False,
+without I/O, so callers can reject a request before touching the DB.
+
+A bucket that has refilled completely is the same as no bucket, so every
+``compact_interval`` seconds `allow()` drops those; memory stays
+proportional to the keys that were active recently, not to every IP ever
+seen. A ``rate`` of 0 disables the limiter.
+"""
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate, burst, compact_interval=60.0):
+        self.rate = rate
+        self.burst = burst
+        self.compact_interval = compact_interval
+        # key -> [tokens, last refill (monotonic)]
+        self._buckets = {}
+        self._next_compact = time.monotonic() + compact_interval
+        self.allowed = 0
+        self.rejected = 0
+        self.compacted = 0
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def allow(self, key, cost=1.0):
+        """Take ``cost`` tokens from ``key``'s bucket; False if it has too few."""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        if now >= self._next_compact:
+            self.compact(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.burst
+            bucket = self._buckets[key] = [tokens, now]
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if tokens < cost:
+            bucket[0] = tokens
+            self.rejected += 1
+            return False
+        bucket[0] = tokens - cost
+        self.allowed += 1
+        return True
+
+    def retry_after(self, key, cost=1.0):
+        """Seconds until ``key`` has ``cost`` tokens again (0 if it has them now)."""
+        bucket = self._buckets.get(key)
+        if bucket is None or self.rate <= 0:
+            return 0.0
+        tokens = min(self.burst, bucket[0] + (time.monotonic() - bucket[1]) * self.rate)
+        return max(0.0, (cost - tokens) / self.rate)
+
+    def compact(self, now=None):
+        """Drop buckets that have refilled to ``burst``; returns how many."""
+        now = time.monotonic() if now is None else now
+        self._next_compact = now + self.compact_interval
+        stale = [key for key, (tokens, last) in self._buckets.items()
+                 if tokens + (now - last) * self.rate >= self.burst]
+        for key in stale:
+            del self._buckets[key]
+        self.compacted += len(stale)
+        return len(stale)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "compacted": self.compacted,
+        }
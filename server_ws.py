@@ -1,18 +1,154 @@
 import os
-import json
-import random
+import argparse
 import asyncio
+import functools
 import logging
-import sqlite3
+import math
+import multiprocessing
+import signal
 import socket
+import sys
+import tempfile
+import time
 from discord.ext import commands
 import discord
+from discord import app_commands
 from websockets.server import serve
+from websockets.exceptions import ConnectionClosed
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from storage import create_store
+from pairing_codes import PairingCodes, PAIR_CODE_TTL
+from device_registry import DeviceRegistry
+from device_rpc import DeviceRPC, DeviceOffline, DeviceRPCError
+from device_router import DeviceRouter
+from worker_bus import BusRouter, BusWorker
+from library_cache import LibraryCache
+from library_view import LibraryPager
+from fanout import summarize
+import protocol
+from protocol import Dispatcher
+from ws_limits import ConnectionLimiter, guarded_protocol
+from rate_limit import RateLimiter
+from log_setup import setup_logging
+import command_sync
+from metrics import MetricsRegistry, Timer, log_summary_loop, serve as serve_metrics
+from session_tokens import SessionTokens, load_secret
+import loop_thread
+from loop_thread import LoopThread
+from link_cache import MISSING
+import warm_start
+import config
+
+# token, port, bind address and DB path: defaults, bot_linker.json, env and
+# (when run as a script) command-line options, see config.py. The
+# environment-only knobs below stay here.
+CONFIG = config.load()
+BOT_TOKEN = CONFIG.token
+DB_FILE = CONFIG.db_file
+# >0 runs the WebSocket server in this many worker processes sharing the
+# port (SO_REUSEPORT, Linux); the bot reaches their devices over worker_bus
+WS_WORKERS = int(os.getenv("WS_WORKERS", "0"))
+# 1 runs the WebSocket server and all device state (store, registry, router)
+# on a second event loop in its own thread, so device traffic cannot hold
+# up the Discord gateway and slash commands (ignored with WS_WORKERS)
+WS_THREAD = os.getenv("WS_THREAD", "0") == "1"
+# "sqlite" for a single server process; "shared-sqlite" lets several server
+# processes (e.g. one per port, or WS_WORKERS) share DB_FILE
+STORAGE_BACKEND = os.getenv("LINKS_BACKEND") or ("shared-sqlite" if WS_WORKERS else "sqlite")
+# identifies this process in the shared device-routing table (default: host-pid-random)
+NODE_ID = os.getenv("NODE_ID")
+# extra shared-sqlite processes only serve WebSockets: set RUN_DISCORD_BOT=0
+RUN_DISCORD_BOT = os.getenv("RUN_DISCORD_BOT", "1") != "0"
+# hello device_name updates are batched: one transaction per interval/batch
+DB_FLUSH_INTERVAL = 0.05
+DB_FLUSH_BATCH_SIZE = 500
+# pair/hello replies give linked devices a session token valid this long
+# (0 disables); a hello that returns it skips the link lookup. Signed with
+# SESSION_SECRET, else a key kept in <DB_FILE>.session-key
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 86400)))
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+# single-process servers save connected devices' links to
+# <DB_FILE>.snapshot.json on shutdown and preload them on start if no link
+# changed in between and the file is at most this old
+SNAPSHOT_MAX_AGE = 3600.0
+# link codes have 6 digits: cap pair attempts per device_id (per minute,
+# with a burst); 0 disables the limit
+PAIR_ATTEMPTS_PER_MINUTE = float(os.getenv("PAIR_ATTEMPTS_PER_MINUTE", "10"))
+PAIR_ATTEMPTS_BURST = int(os.getenv("PAIR_ATTEMPTS_BURST", "5"))
+# the same per remote IP stops guessing with made-up device ids, but behind
+# a reverse proxy or NAT every headset shares one address, so it is off (0)
+# unless set; only use it where devices connect from their own addresses
+PAIR_IP_ATTEMPTS_PER_MINUTE = float(os.getenv("PAIR_IP_ATTEMPTS_PER_MINUTE", "0"))
+PAIR_IP_ATTEMPTS_BURST = int(os.getenv("PAIR_IP_ATTEMPTS_BURST", "20"))
+# slash commands per Discord user
+COMMANDS_PER_MINUTE = float(os.getenv("COMMANDS_PER_MINUTE", "20"))
+COMMANDS_BURST = int(os.getenv("COMMANDS_BURST", "15"))
+# /broadcast reaches every connected device of every user, so only the
+# bot's owner (or team) and these Discord user IDs (comma-separated) may use it
+BROADCAST_ADMINS = {u.strip() for u in os.getenv("BROADCAST_ADMINS", "").split(",") if u.strip()}
+# sync slash commands on startup even if they match the last synced set
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "0") == "1"
+# Prometheus text format on http://127.0.0.1:METRICS_PORT/metrics (0
+# disables); WS_WORKERS processes use METRICS_PORT + 1 + their index
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# log a one-line metrics summary this often, in seconds (0 disables)
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "0"))
+WEBSOCKET_PORT = CONFIG.websocket_port
+# empty: autodetect the LAN address when the server starts
+PC_LOCAL_IP = CONFIG.bind_ip
+# permessage-deflate for clients that offer it: LZ77 window (2**bits bytes)
+# and zlib memLevel, traded against per-connection memory
+WS_DEFLATE_WINDOW_BITS = 12
+WS_DEFLATE_MEM_LEVEL = 5
+# keepalive: ping every interval, drop the connection if no pong within timeout
+WS_PING_INTERVAL = 20.0
+WS_PING_TIMEOUT = 20.0
+# largest accepted frame (a full library_response fits easily) and how many
+# received frames may wait for ws_handler before reading pauses
+WS_MAX_FRAME_SIZE = 4 * 1024 * 1024
+WS_MAX_QUEUE = 32
+# connection caps; per worker process with WS_WORKERS. WS_MAX_PER_IP is
+# off (0) unless set: behind a reverse proxy or NAT all headsets share one
+# address
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "20000"))
+WS_MAX_PER_IP = int(os.getenv("WS_MAX_PER_IP", "0"))
+# connections that send nothing (not even pongs) this long are reaped;
+# ones that never say hello are closed after WS_HELLO_TIMEOUT
+WS_IDLE_TIMEOUT = 90.0
+WS_HELLO_TIMEOUT = 30.0
+# sends wait above WS_WRITE_LIMIT buffered bytes; past WS_WRITE_HIGH_WATER
+# the client is not reading and gets disconnected
+WS_WRITE_LIMIT = 64 * 1024
+WS_WRITE_HIGH_WATER = 1024 * 1024
+# /vrlibrary serves the stored snapshot without asking the device for this long
+LIBRARY_CACHE_TTL = 60.0
+# /send and /broadcast: per-device send timeout and max sends in flight
+SEND_TIMEOUT = 2.0
+FANOUT_CONCURRENCY = 1000
+
+
+def apply_config(cfg):
+    """Use settings resolved by config.load() (e.g. with command-line options)."""
+    global CONFIG, BOT_TOKEN, DB_FILE, WEBSOCKET_PORT, PC_LOCAL_IP
+    CONFIG = cfg
+    BOT_TOKEN = cfg.token
+    DB_FILE = cfg.db_file
+    WEBSOCKET_PORT = cfg.websocket_port
+    PC_LOCAL_IP = cfg.bind_ip
+
+
+def configure_logging():
+    # stderr is written by a background thread; LOG_FORMAT=json gives one JSON
+    # object per line, and each INFO message kind is capped at LOG_RATE_LIMIT
+    # lines per second (0 disables the cap), see log_setup.py
+    setup_logging(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        fmt=os.getenv("LOG_FORMAT", "text"),
+        rate=float(os.getenv("LOG_RATE_LIMIT", "20")),
+    )
 
-logging.basicConfig(level=logging.INFO)
 
-DB_FILE = "links.db"
-WEBSOCKET_PORT = 8765
 def _get_local_ip():
     """Return a reasonable LAN IP for this machine (best-effort)."""
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -29,226 +165,359 @@ def _get_local_ip():
             pass
     return ip
 
-# Allow explicit override via environment variable PC_LOCAL_IP, otherwise autodetect
-PC_LOCAL_IP = os.getenv("PC_LOCAL_IP") or _get_local_ip()
-# REQUIRED: set your bot token here (development/testing only).
-# This file is currently configured to use the hard-coded token instead
-# of reading from the environment. Replace the placeholder below with
-# your bot token string. Do NOT commit real tokens to version control.
-# 
-# For Replit deployment: comment out the line below and use:
-#   BOT_TOKEN = os.getenv("BOT_TOKEN")
-#
-BOT_TOKEN = "MTQ0MzgwOTU4MjA2ODc5MzUzNw.GZBNNM.EKme6Q2x7zmlvNV_qL41qlHtp6__xYF94DDd2M"  # set your bot token string here for local testing
+
+def _bind_ip():
+    # detected on first use rather than at import (it opens a socket)
+    global PC_LOCAL_IP
+    if not PC_LOCAL_IP:
+        PC_LOCAL_IP = _get_local_ip()
+    return PC_LOCAL_IP
+
 # --------------------------------
 # Database Setup
 # --------------------------------
-def _init_db_sync():
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS links (
-            user_id TEXT PRIMARY KEY,
-            device_id TEXT,
-            code TEXT,
-            device_name TEXT
-        )
-        """
-    )
-    conn.commit()
-    # ensure device_name column exists (for older DBs)
-    cur.execute("PRAGMA table_info(links)")
-    cols = [r[1] for r in cur.fetchall()]
-    if 'device_name' not in cols:
-        try:
-            cur.execute("ALTER TABLE links ADD COLUMN device_name TEXT")
-            conn.commit()
-        except Exception:
-            # ignore if alter fails for some reason
-            pass
-    conn.close()
-    logging.info("Database initialized (links.db)")
+# built by build_services() (from main(), run_worker() or init_db()), so
+# importing this module opens nothing
+store = None
+codes = None
+# session tokens for device reconnects (see session_tokens.py)
+sessions = None
+# devices connected when the WebSocket server began shutting down
+connected_at_shutdown = []
+# the loop thread owning device state with WS_THREAD, else None (one loop)
+device_loop = None
+
+
+def build_services():
+    """Create the store, pairing codes, session tokens and device router for DB_FILE."""
+    global store, codes, sessions, router
+    store = create_store(STORAGE_BACKEND, DB_FILE, flush_interval=DB_FLUSH_INTERVAL, batch_size=DB_FLUSH_BATCH_SIZE)
+    store.observer = _observe_query
+    codes = PairingCodes(store, ttl=PAIR_CODE_TTL)
+    secret = SESSION_SECRET or (load_secret(f"{DB_FILE}.session-key") if SESSION_TTL > 0 else b"")
+    sessions = SessionTokens(secret, ttl=SESSION_TTL)
+    router = DeviceRouter(store, registry, rpc, node_id=NODE_ID)
+    router.on_send = messages.count_sent
+
+
+def _snapshot_file():
+    return f"{DB_FILE}.snapshot.json"
 
 
 async def init_db():
-    await asyncio.to_thread(_init_db_sync)
+    if store is None:
+        build_services()
+    await store.open()
+    await codes.open()
+    await router.open()
+
+
+async def _on_device_loop(coro):
+    """Await ``coro`` on the loop that owns device state (see WS_THREAD)."""
+    if device_loop is None:
+        return await coro
+    return await device_loop.run(coro)
 
 # --------------------------------
 # WebSocket Handler
 # --------------------------------
-# track connected device websockets: device_id -> websocket
-connected_devices: dict = {}
-connected_devices_lock = asyncio.Lock()
-# pending request futures: (device_id, request_id) -> asyncio.Future
-pending_requests: dict = {}
+# connected device websockets and pending device requests
+registry = DeviceRegistry()
+# request/response calls to devices (e.g. get_library)
+rpc = DeviceRPC(registry, max_in_flight=4, default_timeout=8.0)
+# last known app library per device
+libraries = LibraryCache(ttl=LIBRARY_CACHE_TTL)
+# sends and calls to devices connected to this or (shared backend) another
+# process; see build_services()
+router = None
+# connection caps, idle reaping and slow-reader protection (see ws_limits.py)
+limiter = ConnectionLimiter(
+    max_connections=WS_MAX_CONNECTIONS,
+    max_per_ip=WS_MAX_PER_IP,
+    idle_timeout=WS_IDLE_TIMEOUT,
+    write_high_water=WS_WRITE_HIGH_WATER,
+)
+# throttles checked before any DB work (see rate_limit.py)
+pair_ip_limits = RateLimiter(PAIR_IP_ATTEMPTS_PER_MINUTE / 60, PAIR_IP_ATTEMPTS_BURST)
+pair_device_limits = RateLimiter(PAIR_ATTEMPTS_PER_MINUTE / 60, PAIR_ATTEMPTS_BURST)
+command_limits = RateLimiter(COMMANDS_PER_MINUTE / 60, COMMANDS_BURST)
 
+# --------------------------------
+# Metrics
+# --------------------------------
+# counters and histograms updated as things happen; everything else is read
+# from the components' own counters when /metrics is scraped
+metrics = MetricsRegistry(prefix="botlinker_")
+db_query_seconds = metrics.histogram("db_query_seconds", "Run time of LinksStore helpers.", ("helper",))
+db_queue_seconds = metrics.histogram("db_queue_seconds", "Wait for a free DB thread.", ("helper",))
+command_seconds = metrics.histogram("command_seconds", "Slash command latency.", ("command",))
+library_fetch_seconds = metrics.histogram("library_fetch_seconds", "/vrlibrary device round trip.")
+library_fetches = metrics.counter("library_fetches_total", "/vrlibrary device fetches by outcome.", ("result",))
+
+
+def _observe_query(helper, wait, elapsed):
+    db_queue_seconds.observe(wait, helper)
+    db_query_seconds.observe(elapsed, helper)
+
+
+@metrics.collector
+def _collect_metrics():
+    link_stats = store.stats()
+    conn_stats = limiter.stats()
+    traffic = messages.traffic
+    # a copy: with WS_THREAD the device loop adds types while this runs
+    sent = dict(messages.sent)
+    return [
+        ("ws_frames_total", "counter", "Device frames by message type and frame kind.",
+         {**{(t, "text"): c[0] for t, c in traffic.items()}, **{(t, "binary"): c[2] for t, c in traffic.items()}},
+         ("type", "frame")),
+        ("ws_frame_bytes_total", "counter", "Device frame payload bytes by message type and frame kind.",
+         {**{(t, "text"): c[1] for t, c in traffic.items()}, **{(t, "binary"): c[3] for t, c in traffic.items()}},
+         ("type", "frame")),
+        ("ws_frames_sent_total", "counter", "Frames sent to devices by message type.",
+         {(t,): c[0] for t, c in sent.items()}, ("type",)),
+        ("ws_frame_bytes_sent_total", "counter", "Payload bytes sent to devices by message type.",
+         {(t,): c[1] for t, c in sent.items()}, ("type",)),
+        ("ws_frames_rejected_total", "counter", "Device frames not handled, by reason.",
+         {("invalid_json",): messages.invalid_json, ("invalid",): messages.invalid,
+          ("unknown",): messages.unknown, ("failed",): messages.failed},
+         ("reason",)),
+        ("ws_connections", "gauge", "Open WebSocket connections.", conn_stats["active"], ()),
+        ("ws_connection_events_total", "counter", "Connection admissions, rejections and reaping.",
+         {(k,): conn_stats[k] for k in
+          ("accepted", "rejected_total", "rejected_ip", "reaped_idle", "reaped_stale", "slow_disconnects")},
+         ("event",)),
+        ("connected_devices", "gauge", "Devices registered on this process.", len(registry), ()),
+        ("pending_requests", "gauge", "Device requests waiting for a reply.", registry.pending_count(), ()),
+        ("rate_limited_total", "counter", "Requests rejected by a rate limiter.",
+         {("pair_ip",): pair_ip_limits.rejected, ("pair_device",): pair_device_limits.rejected,
+          ("command",): command_limits.rejected},
+         ("limiter",)),
+        ("session_tokens_total", "counter", "Session tokens issued and checked on hello, by result.",
+         {("issued",): sessions.issued, ("verified",): sessions.verified,
+          **{(reason,): n for reason, n in sessions.rejected.items()}},
+         ("result",)),
+        ("link_cache_total", "counter", "Link cache lookups.",
+         {("hit",): link_stats["hits"], ("miss",): link_stats["misses"]}, ("result",)),
+        ("db_queries_total", "counter", "Queries that reached SQLite.",
+         {("read",): link_stats["db_reads"], ("write",): link_stats["db_writes"]}, ("kind",)),
+    ]
+
+
+def _metrics_summary():
+    frames = sum(c[0] + c[2] for c in messages.traffic.values())
+    queries = sum(series[2] for series in db_query_seconds.series.values())
+    db_time = sum(series[1] for series in db_query_seconds.series.values())
+    fetch_p99 = library_fetch_seconds.quantile(0.99)
+    return (
+        f"{len(registry)} devices, {limiter.stats()['active']} connections, "
+        f"{registry.pending_count()} pending requests, {frames} frames, "
+        f"{queries} DB queries (avg {db_time / queries * 1000 if queries else 0:.2f} ms), "
+        f"library fetch p99 <= {'-' if fetch_p99 is None else f'{fetch_p99 * 1000:g} ms'}"
+    )
 
-def _get_user_by_code_sync(code):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT user_id FROM links WHERE code=?", (code,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else None
 
+def _instrumented(fn):
+    """Record a slash command's run time in command_seconds."""
+    name = fn.__name__.removesuffix("_cmd")
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        with Timer(command_seconds, name):
+            return await fn(*args, **kwargs)
+    return wrapper
+
+
+# device frame handlers, keyed by message type (see protocol.py)
+messages = Dispatcher()
+rpc.on_send = messages.count_sent
+
+
+def _resume(device_id, token):
+    """``(user_id, device_name, expires)`` from a valid session token, else None."""
+    claim = sessions.verify(token, device_id)
+    if claim is None:
+        return None
+    cached = store.cached_user(device_id)
+    if cached is not MISSING and cached != claim[0]:
+        # relinked or unlinked since the token was issued
+        sessions.stale()
+        return None
+    return claim
+
+
+@messages.handler(
+    "hello",
+    required={"device_id": str},
+    optional={"device_name": str, "encodings": list, "session": str},
+)
+async def on_hello(conn, data):
+    # hello handshake: register connection
+    device_id = conn.device_id = data["device_id"]
+    device_name = data.get("device_name")
+    registry.register(device_id, conn.ws)
+    router.device_connected(device_id)
+
+    # a session token from an earlier pair/hello answers "linked to whom"
+    # without touching the DB; otherwise look the device up
+    claim = _resume(device_id, data["session"]) if "session" in data else None
+    if claim is not None:
+        user_id, known_name, expires = claim
+        # the device keeps its token until it is half used up or its name changed
+        renew = (device_name and device_name != known_name) or sessions.needs_refresh(expires)
+    else:
+        user_id = known_name = None
+        renew = True
+        if device_name or sessions.enabled:
+            try:
+                user_id = await store.get_user_by_device(device_id)
+            except Exception:
+                logging.exception("Failed to look up device on hello")
+    session = sessions.issue(device_id, user_id, device_name or known_name) if user_id and renew else None
+
+    if "encodings" in data:
+        # capability negotiation; older clients get the plain ack
+        conn.set_encoding(protocol.negotiate_encoding(data["encodings"]))
+        await conn.send(protocol.hello_ok(conn.encoding, conn.compression(), session), "hello")
+    elif session is not None:
+        await conn.send(protocol.hello_ok(session=session), "hello")
+    else:
+        await conn.send(protocol.HELLO_OK, "hello")
+    logging.info("Device connected: %s (name=%s)", device_id, device_name)
+    # if this device is already linked to a user, update stored device_name
+    # (queued, see LinksStore.update_device_name); a resumed session already
+    # carries the stored name, so an unchanged name costs nothing
+    if user_id and device_name and device_name != known_name:
+        try:
+            await store.update_device_name(user_id, device_id, device_name)
+        except Exception:
+            logging.exception("Failed to update device_name on hello")
+
+
+@messages.handler(
+    "pair",
+    required={"code": str, "device_id": str},
+    optional={"device_name": str},
+    invalid=protocol.PAIR_MISSING_FIELDS,
+)
+async def on_pair(conn, data):
+    # pairing request from client
+    code = data["code"]
+    device_id = conn.device_id = data["device_id"]
+    device_name = data.get("device_name")
+
+    # guessing codes must not get cheaper by opening more sockets (or, with
+    # PAIR_IP_ATTEMPTS_PER_MINUTE, by making up device ids)
+    remote_ip = conn.ws.remote_address[0] if conn.ws.remote_address else None
+    if not (pair_ip_limits.allow(remote_ip) and pair_device_limits.allow(device_id)):
+        await conn.send(protocol.PAIR_RATE_LIMITED, "pair_result")
+        return
+
+    user_id = await codes.consume(code)
+    if not user_id:
+        await conn.send(protocol.PAIR_INVALID_CODE, "pair_result")
+        return
+
+    # link device to user (store device_name if provided)
+    await store.link_device(user_id, device_id, device_name)
 
-def _get_user_by_device_sync(device_id):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("SELECT user_id FROM links WHERE device_id=?", (device_id,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else None
+    # register websocket for this device
+    registry.register(device_id, conn.ws)
+    router.device_connected(device_id)
 
+    await conn.send(protocol.pair_ok(user_id, sessions.issue(device_id, user_id, device_name)), "pair_result")
+    logging.info("Paired device %s (name=%s) -> user %s", device_id, device_name, user_id)
+
+
+@messages.handler("unlink", required={"device_id": str}, invalid=protocol.UNLINK_MISSING_DEVICE_ID)
+async def on_unlink(conn, data):
+    # unlink request from client
+    device_id = conn.device_id = data["device_id"]
+
+    user_id = await store.unlink_device(device_id)
+    if not user_id:
+        await conn.send(protocol.UNLINK_NOT_LINKED, "pair_result")
+        return
 
-def _set_device_for_user_sync(user_id, device_id):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("UPDATE links SET device_id=? WHERE user_id=?", (device_id, user_id))
-    conn.commit()
-    conn.close()
+    await conn.send(protocol.UNLINK_OK, "pair_result")
+    logging.info("Device unlinked by device request: %s (user %s)", device_id, user_id)
 
 
-def _set_device_for_user_sync_with_name(user_id, device_id, device_name=None):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    # set device_id and device_name
-    cur.execute("UPDATE links SET device_id=?, device_name=? WHERE user_id=?", (device_id, device_name, user_id))
-    conn.commit()
-    conn.close()
+@messages.handler("response", required={"request_id": (str, int)})
+async def on_response(conn, data):
+    # device -> server: reply to an rpc.call()
+    rpc.resolve(conn.device_id, data["request_id"], data.get("result"), data.get("error"))
 
 
-def _clear_device_for_user_sync(user_id):
-    conn = sqlite3.connect(DB_FILE)
-    cur = conn.cursor()
-    cur.execute("UPDATE links SET device_id=NULL, device_name=NULL WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
+@messages.handler("library_response", required={"request_id": (str, int)})
+@messages.handler("library", required={"request_id": (str, int)})
+@messages.handler("library_delta", required={"request_id": (str, int)})
+async def on_library(conn, data):
+    # device -> server: full library or changes since a version
+    # (libraries.apply_reply() understands both)
+    rpc.resolve(conn.device_id, data["request_id"], data, data.get("error"))
+
+
+@messages.handler("library_chunk", required={"request_id": (str, int)}, optional={"apps": list})
+async def on_library_chunk(conn, data):
+    # device -> server: one piece of a streamed library
+    if conn.device_id:
+        reply = libraries.add_chunk(conn.device_id, data)
+        if reply is not None:
+            rpc.resolve(conn.device_id, data["request_id"], reply)
+
+
+def _device_gone(device_id, websocket):
+    """Forget a closed connection's device, unless it already reconnected."""
+    if registry.unregister(device_id, websocket):
+        router.device_disconnected(device_id)
+    # fail any pending requests for this device
+    registry.fail_pending(device_id, ConnectionError("Device disconnected"))
+    libraries.drop_partials(device_id)
+
+
+def _drop_stale_device(device_id, websocket):
+    # registry entry whose socket closed without ws_handler cleaning up
+    logging.warning("Dropping stale connection for device %s", device_id)
+    _device_gone(device_id, websocket)
 
 
 async def ws_handler(websocket, path):
     logging.info("WebSocket connection open")
-    device_id = None
+    conn = protocol.Connection(websocket, messages.count_sent)
 
     try:
+        # a socket that never identifies itself only holds a slot
+        first = await asyncio.wait_for(websocket.recv(), WS_HELLO_TIMEOUT)
+        await messages.dispatch(conn, first)
         async for message in websocket:
-            try:
-                data = json.loads(message)
-            except Exception:
-                continue
-
-            mtype = data.get("type")
-
-            # hello handshake: register connection
-            if mtype == "hello":
-                device_id = data.get("device_id")
-                device_name = data.get("device_name")
-                if device_id:
-                    async with connected_devices_lock:
-                        connected_devices[device_id] = websocket
-                    await websocket.send(json.dumps({"type": "hello", "ok": True}))
-                    logging.info(f"Device connected: {device_id} (name={device_name})")
-                    # if this device is already linked to a user, update stored device_name
-                    if device_name:
-                        try:
-                            user_id = await asyncio.to_thread(_get_user_by_device_sync, device_id)
-                            if user_id:
-                                await asyncio.to_thread(_set_device_for_user_sync_with_name, user_id, device_id, device_name)
-                        except Exception:
-                            logging.exception("Failed to update device_name on hello")
-                continue
-
-            # pairing request from client
-            if mtype == "pair":
-                code = data.get("code")
-                device_id = data.get("device_id")
-                device_name = data.get("device_name")
-
-                if not code or not device_id:
-                    await websocket.send(json.dumps({"type": "pair_result", "ok": False, "reason": "missing_fields"}))
-                    continue
-
-                user_id = await asyncio.to_thread(_get_user_by_code_sync, code)
-                if not user_id:
-                    await websocket.send(json.dumps({"type": "pair_result", "ok": False, "reason": "invalid_code"}))
-                    continue
-
-                # set device for user (store device_name if provided)
-                await asyncio.to_thread(_set_device_for_user_sync_with_name, user_id, device_id, device_name)
-
-                # register websocket for this device
-                async with connected_devices_lock:
-                    connected_devices[device_id] = websocket
-
-                await websocket.send(json.dumps({"type": "pair_result", "ok": True, "discord_id": user_id}))
-                logging.info(f"Paired device {device_id} (name={device_name}) -> user {user_id}")
-                continue
-
-            # unlink request from client
-            if mtype == "unlink":
-                device_id = data.get("device_id")
-                if not device_id:
-                    await websocket.send(json.dumps({"type": "pair_result", "ok": False, "reason": "missing_device_id"}))
-                    continue
-
-                user_id = await asyncio.to_thread(_get_user_by_device_sync, device_id)
-                if not user_id:
-                    await websocket.send(json.dumps({"type": "pair_result", "ok": False, "reason": "not_linked"}))
-                    continue
-
-                await asyncio.to_thread(_clear_device_for_user_sync, user_id)
-
-                await websocket.send(json.dumps({"type": "pair_result", "ok": True}))
-                logging.info(f"Device unlinked by device request: {device_id} (user {user_id})")
-                continue
-
-            # device -> server: library response
-            if mtype in ("library_response", "library"):
-                req_id = data.get("request_id")
-                apps = data.get("apps") or data.get("library") or data.get("items")
-                if device_id and req_id:
-                    key = (device_id, str(req_id))
-                    future = None
-                    async with connected_devices_lock:
-                        future = pending_requests.pop(key, None)
-                    if future and not future.done():
-                        try:
-                            future.set_result(apps)
-                        except Exception:
-                            logging.exception("Failed to set pending request result")
-                continue
-
+            await messages.dispatch(conn, message)
+    except asyncio.TimeoutError:
+        logging.info("Closing %s: no message within %.0fs", websocket.remote_address, WS_HELLO_TIMEOUT)
+        await websocket.close(1008, "hello timeout")
+    except ConnectionClosed:
+        pass
     except Exception as e:
-        logging.error(f"WS error: {e}")
+        logging.error("WS error: %s", e)
     finally:
         # cleanup device mapping on disconnect
+        device_id = conn.device_id
         if device_id:
-            async with connected_devices_lock:
-                if connected_devices.get(device_id) is websocket:
-                    del connected_devices[device_id]
-                # cancel any pending requests for this device
-                keys = [k for k in list(pending_requests.keys()) if k[0] == device_id]
-                for k in keys:
-                    fut = pending_requests.pop(k, None)
-                    if fut and not fut.done():
-                        try:
-                            fut.set_exception(ConnectionError("Device disconnected"))
-                        except Exception:
-                            pass
-            logging.info(f"Device disconnected: {device_id}")
+            _device_gone(device_id, websocket)
+            logging.info("Device disconnected: %s", device_id)
 
 # --------------------------------
 # Discord Bot
 # --------------------------------
-intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
-tree = bot.tree
+# built by build_bot() from main(); the slash commands below are plain
+# app_commands.Command objects until then
+bot = None
+tree = None
 
 
-@bot.event
 async def on_ready():
+    global FORCE_COMMAND_SYNC
+
     async def _cleanup_duplicate_global_commands():
         try:
             logging.info("Checking for duplicate global commands...")
@@ -268,14 +537,14 @@ async def on_ready():
                         to_delete.append(ex)
 
             if to_delete:
-                logging.info(f"Found {len(to_delete)} duplicate command entries — removing extras")
+                logging.info("Found %d duplicate command entries — removing extras", len(to_delete))
                 for cmd_obj in to_delete:
                     try:
                         # delete global command by id
                         await bot.http.delete_global_command(bot.application_id, cmd_obj.id)
-                        logging.info(f"Deleted duplicate global command id={cmd_obj.id} name={cmd_obj.name}")
+                        logging.info("Deleted duplicate global command id=%s name=%s", cmd_obj.id, cmd_obj.name)
                     except Exception:
-                        logging.exception(f"Failed to delete command id={getattr(cmd_obj, 'id', None)}")
+                        logging.exception("Failed to delete command id=%s", getattr(cmd_obj, "id", None))
                 # small pause before syncing
                 await asyncio.sleep(1)
             else:
@@ -283,222 +552,360 @@ async def on_ready():
         except Exception:
             logging.exception("Failed while cleaning up duplicate commands")
 
+    # on_ready fires on every reconnect; the REST calls below only matter
+    # when the command definitions changed since the last successful sync
+    digest = command_sync.fingerprint(tree)
+    if not FORCE_COMMAND_SYNC and not command_sync.needs_sync(bot.application_id, digest):
+        logging.info("Bot ready: %s — commands unchanged, sync skipped", bot.user)
+        return
     try:
         # remove duplicate global commands (if any) then sync
         await _cleanup_duplicate_global_commands()
         await tree.sync()
-        logging.info(f"Bot ready: {bot.user} — commands synced")
+        command_sync.record_sync(bot.application_id, digest)
+        # forced once per process, not on every reconnect
+        FORCE_COMMAND_SYNC = False
+        logging.info("Bot ready: %s — commands synced", bot.user)
     except Exception:
         logging.exception("Failed to sync commands on ready")
 
-@tree.command(name="link", description="Generate a link code to pair your device.")
+async def _throttled(interaction):
+    """Tell the user to slow down and return True when over COMMANDS_PER_MINUTE."""
+    user_id = interaction.user.id
+    if command_limits.allow(user_id):
+        return False
+    wait = max(1, math.ceil(command_limits.retry_after(user_id)))
+    await interaction.response.send_message(f"⏳ Too many commands, try again in {wait}s.", ephemeral=True)
+    return True
+
+
+@app_commands.command(name="link", description="Generate a link code to pair your device.")
+@_instrumented
 async def link_cmd(interaction: discord.Interaction):
+    if await _throttled(interaction):
+        return
     await interaction.response.defer()
-    code = str(random.randint(100000, 999999))
     user_id = str(interaction.user.id)
-
-    def _replace_link():
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute("REPLACE INTO links (user_id, code, device_id) VALUES (?, ?, ?)", (user_id, code, None))
-        conn.commit()
-        conn.close()
-
-    await asyncio.to_thread(_replace_link)
+    try:
+        code, expires_at = await _on_device_loop(codes.issue(user_id))
+    except Exception:
+        logging.exception("Failed to issue link code")
+        await interaction.followup.send("⚠️ Could not generate a link code, please try again.")
+        return
 
     await interaction.followup.send(
-        f"🔗 **Your link code:** `{code}`\nGo to the website and enter this code."
+        f"🔗 **Your link code:** `{code}`\nGo to the website and enter this code. It expires <t:{int(expires_at)}:R>."
     )
 
-@tree.command(name="unlink", description="Disconnect your paired device.")
-async def unlink_cmd(interaction: discord.Interaction):
+def _select_devices(devices, selector):
+    """Filter ``(device_id, device_name)`` rows by an optional id or name."""
+    if not selector:
+        return list(devices)
+    wanted = selector.strip().casefold()
+    return [d for d in devices if d[0].casefold() == wanted or (d[1] or "").casefold() == wanted]
+
+
+def _device_label(device_id, device_name):
+    if device_name:
+        return f"`{device_name}` (ID: `{device_id}`)"
+    return f"`{device_id}`"
+
+
+@app_commands.command(name="unlink", description="Disconnect your paired device(s).")
+@app_commands.describe(device="Only unlink this device (ID or name); default is all of them")
+@_instrumented
+async def unlink_cmd(interaction: discord.Interaction, device: str = None):
+    if await _throttled(interaction):
+        return
     await interaction.response.defer()
     user_id = str(interaction.user.id)
-    def _unlink_and_get_device():
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute("SELECT device_id FROM links WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        device = row[0] if row else None
-        # clear device mapping
-        cur.execute("UPDATE links SET device_id=NULL WHERE user_id=?", (user_id,))
-        conn.commit()
-        conn.close()
-        return device
-
-    device = await asyncio.to_thread(_unlink_and_get_device)
 
     if device:
-        await interaction.followup.send("Your device has been unlinked.")
-        # notify device if connected
+        selected = _select_devices(await _on_device_loop(store.get_devices(user_id)), device)
+        removed = [d for d, _ in selected if await _on_device_loop(store.unlink_device(d))]
+    else:
+        removed = await _on_device_loop(store.unlink_user(user_id))
+
+    if removed:
+        if len(removed) == 1:
+            await interaction.followup.send("Your device has been unlinked.")
+        else:
+            await interaction.followup.send(f"{len(removed)} devices have been unlinked.")
+        # notify devices that are connected
         try:
-            async with connected_devices_lock:
-                ws = connected_devices.get(device)
-            if ws:
-                try:
-                    await ws.send(json.dumps({"type": "force_unlink"}))
-                except Exception:
-                    logging.exception(f"Failed to send force_unlink to {device}")
+            results, _ = await _on_device_loop(router.send_many(
+                removed, protocol.FORCE_UNLINK, timeout=SEND_TIMEOUT, mtype="force_unlink",
+            ))
+            for d, error in results.items():
+                if error:
+                    logging.error("Failed to send force_unlink to %s: %s", d, error)
         except Exception:
             logging.exception("Error notifying device about unlink")
+    elif device:
+        await interaction.followup.send(f"❌ No linked device matches `{device}`.")
     else:
         await interaction.followup.send("You have no linked device.")
 
-@tree.command(name="linkstatus", description="Check if your device is linked.")
+@app_commands.command(name="linkstatus", description="Check which devices are linked.")
+@_instrumented
 async def linkstatus_cmd(interaction: discord.Interaction):
+    if await _throttled(interaction):
+        return
     await interaction.response.defer()
     user_id = str(interaction.user.id)
 
-    def _get_device():
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute("SELECT device_id, device_name FROM links WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return row
+    devices = await _on_device_loop(store.get_devices(user_id))
 
-    row = await asyncio.to_thread(_get_device)
-
-    if row and row[0]:
-        device_id = row[0]
-        device_name = row[1] if len(row) > 1 else None
+    if not devices:
+        await interaction.followup.send("❌ No device linked.")
+    elif len(devices) == 1:
+        device_id, device_name = devices[0]
         if device_name:
             await interaction.followup.send(f"Your device: `{device_name}` (ID: `{device_id}`)")
         else:
             await interaction.followup.send(f"Your device ID: `{device_id}`")
     else:
-        await interaction.followup.send("❌ No device linked.")
-
-@tree.command(name="send", description="Send a message to your linked device.")
-async def send_cmd(interaction: discord.Interaction, message: str):
+        online = await _on_device_loop(router.locate([d for d, _ in devices]))
+        lines = [f"Your devices ({len(devices)}):"]
+        for device_id, device_name in devices:
+            state = "🟢" if device_id in online else "⚪"
+            lines.append(f"{state} {_device_label(device_id, device_name)}")
+        await interaction.followup.send("\n".join(lines))
+
+@app_commands.command(name="send", description="Send a message to your linked device(s).")
+@app_commands.describe(device="Only send to this device (ID or name); default is all of them")
+@_instrumented
+async def send_cmd(interaction: discord.Interaction, message: str, device: str = None):
+    if await _throttled(interaction):
+        return
     await interaction.response.defer()
     user_id = str(interaction.user.id)
 
-    def _get_device_sync():
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute("SELECT device_id FROM links WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return row[0] if row else None
-
-    device_id = await asyncio.to_thread(_get_device_sync)
+    devices = await _on_device_loop(store.get_devices(user_id))
 
-    if not device_id:
+    if not devices:
         await interaction.followup.send("❌ You have no linked device.")
         return
+    selected = _select_devices(devices, device)
+    if not selected:
+        await interaction.followup.send(f"❌ No linked device matches `{device}`.")
+        return
 
-    # try to send message to the connected device
+    # send to every selected device that is connected, all at once
     try:
-        async with connected_devices_lock:
-            ws = connected_devices.get(device_id)
-        
-        if ws:
-            try:
-                await ws.send(json.dumps({"type": "discord_message", "text": message}))
+        payload = protocol.discord_message(message)
+        results, offline = await _on_device_loop(
+            router.send_many([d for d, _ in selected], payload, timeout=SEND_TIMEOUT, mtype="discord_message")
+        )
+
+        if len(selected) == 1:
+            device_id = selected[0][0]
+            if offline:
+                await interaction.followup.send(f"⚠️ Device `{device_id}` is not currently connected.")
+                return
+            error = results[device_id]
+            if error is None:
                 await interaction.followup.send(f"✅ Message sent to device `{device_id}`: {message}")
-                logging.info(f"Message sent to device {device_id}: {message}")
-            except Exception as e:
-                await interaction.followup.send(f"⚠️ Failed to send message: {e}")
-                logging.error(f"Failed to send message to {device_id}: {e}")
-        else:
-            await interaction.followup.send(f"⚠️ Device `{device_id}` is not currently connected.")
+                logging.info("Message sent to device %s: %s", device_id, message)
+            else:
+                await interaction.followup.send(f"⚠️ Failed to send message: {error}")
+                logging.error("Failed to send message to %s: %s", device_id, error)
+            return
+
+        await interaction.followup.send(f"✉️ {message}\n" + summarize(results, offline))
+        logging.info("Message sent to %d devices of user %s: %s", len(results), user_id, message)
     except Exception as e:
         await interaction.followup.send(f"❌ Error: {e}")
-        logging.error(f"Error sending message: {e}")
+        logging.error("Error sending message: %s", e)
 
 
-@tree.command(name="vrlibrary", description="Show the app library on your paired VR device.")
-async def vrlibrary_cmd(interaction: discord.Interaction):
-    await interaction.response.defer()
-    user_id = str(interaction.user.id)
+async def _can_broadcast(user):
+    # a server administrator only administers their own guild; the devices
+    # belong to users of every guild the bot is in
+    if str(user.id) in BROADCAST_ADMINS:
+        return True
+    return bot is not None and await bot.is_owner(user)
 
-    def _get_device():
-        conn = sqlite3.connect(DB_FILE)
-        cur = conn.cursor()
-        cur.execute("SELECT device_id FROM links WHERE user_id=?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        return row[0] if row else None
 
-    device_id = await asyncio.to_thread(_get_device)
+@app_commands.command(name="broadcast", description="Send an announcement to every connected device.")
+@app_commands.default_permissions(administrator=True)
+@app_commands.guild_only()
+@_instrumented
+async def broadcast_cmd(interaction: discord.Interaction, message: str):
+    if await _throttled(interaction):
+        return
+    await interaction.response.defer()
+    if not await _can_broadcast(interaction.user):
+        await interaction.followup.send("❌ Only the bot's owner can broadcast.")
+        return
 
-    if not device_id:
-        await interaction.followup.send("❌ You have no linked device.")
+    results = await _on_device_loop(router.broadcast(
+        protocol.discord_message(message),
+        timeout=SEND_TIMEOUT,
+        concurrency=FANOUT_CONCURRENCY,
+        mtype="discord_message",
+    ))
+    if not results:
+        await interaction.followup.send("📭 No devices are connected.")
         return
 
-    async with connected_devices_lock:
-        ws = connected_devices.get(device_id)
+    await interaction.followup.send("📢 Broadcast sent.\n" + summarize(results))
+    logging.info("Broadcast to %d devices by %s", len(results), interaction.user.id)
 
-    if not ws:
-        await interaction.followup.send(f"⚠️ Device `{device_id}` is not currently connected.")
-        return
 
-    request_id = str(random.randint(1000000000, 9999999999))
-    fut = asyncio.get_event_loop().create_future()
-    key = (device_id, request_id)
+async def _cached_library(device_id, refresh):
+    # (fresh snapshot or None, last known snapshot or None)
+    return (None if refresh else libraries.fresh(device_id)), libraries.get(device_id)
 
-    async with connected_devices_lock:
-        pending_requests[key] = fut
 
-    try:
-        await ws.send(json.dumps({"type": "get_library", "request_id": request_id}))
-    except Exception as e:
-        async with connected_devices_lock:
-            pending_requests.pop(key, None)
-        await interaction.followup.send(f"⚠️ Failed to send request to device: {e}")
+def _age_text(seconds):
+    if seconds < 90:
+        return f"{int(seconds)}s ago"
+    if seconds < 5400:
+        return f"{int(seconds // 60)}m ago"
+    return f"{int(seconds // 3600)}h ago"
+
+
+@app_commands.command(name="vrlibrary", description="Show the app library on your paired VR device.")
+@app_commands.describe(device="Which device (ID or name) if you have several linked")
+@_instrumented
+async def vrlibrary_cmd(interaction: discord.Interaction, device: str = None, search: str = None, refresh: bool = False):
+    if await _throttled(interaction):
         return
+    await interaction.response.defer()
+    user_id = str(interaction.user.id)
 
-    try:
-        apps = await asyncio.wait_for(fut, timeout=8.0)
-    except asyncio.TimeoutError:
-        async with connected_devices_lock:
-            pending_requests.pop(key, None)
-        await interaction.followup.send("⏱️ Timed out waiting for device to respond.")
+    devices = await _on_device_loop(store.get_devices(user_id))
+
+    if not devices:
+        await interaction.followup.send("❌ You have no linked device.")
         return
-    except Exception as e:
-        await interaction.followup.send(f"❌ Error: {e}")
+    selected = _select_devices(devices, device)
+    if not selected:
+        await interaction.followup.send(f"❌ No linked device matches `{device}`.")
         return
+    # prefer a connected device when several match
+    online = await _on_device_loop(router.locate([d for d, _ in selected]))
+    device_id = next((d for d, _ in selected if d in online), selected[0][0])
+
+    snap, last_known = await _on_device_loop(_cached_library(device_id, refresh))
+    if snap is None:
+        error = None
+        if device_id not in online:
+            error = f"⚠️ Device `{device_id}` is not currently connected."
+        else:
+            start = time.perf_counter()
+            result = "ok"
+            try:
+                snap = await _on_device_loop(libraries.fetch(router, device_id))
+            except DeviceOffline as e:
+                result = "offline"
+                error = f"⚠️ {e}"
+            except asyncio.TimeoutError:
+                result = "timeout"
+                error = "⏱️ Timed out waiting for device to respond."
+            except DeviceRPCError as e:
+                result = "device_error"
+                error = f"⚠️ Device error: {e.message}"
+            except Exception as e:
+                result = "error"
+                error = f"❌ Error: {e}"
+            library_fetch_seconds.observe(time.perf_counter() - start)
+            library_fetches.inc(result)
+        if error:
+            if last_known is None or not last_known.apps:
+                await interaction.followup.send(error)
+                return
+            # fall back to the last library we saw from this device
+            view = LibraryPager(
+                interaction.user.id, device_id, last_known,
+                note=f"last known, {_age_text(last_known.age())}", prefix=error, query=search,
+            )
+            await interaction.followup.send(view.render(), view=view)
+            return
+        note = None
+    else:
+        note = f"cached {_age_text(snap.age())}"
 
-    if not apps:
+    if not snap.apps:
         await interaction.followup.send("📭 Device returned an empty library.")
         return
 
-    if isinstance(apps, list):
-        lines = []
-        for a in apps:
-            if isinstance(a, dict):
-                name = a.get("name") or a.get("title") or str(a)
-            else:
-                name = str(a)
-            lines.append(f"- {name}")
-        content = "\n".join(lines[:50])
-        if len(lines) > 50:
-            content += f"\n...and {len(lines)-50} more"
-        await interaction.followup.send(f"📚 Device library for `{device_id}`:\n{content}")
-    else:
-        await interaction.followup.send(f"📚 Device library: {apps}")
+    view = LibraryPager(interaction.user.id, device_id, snap, note=note, query=search)
+    await interaction.followup.send(view.render(), view=view)
+
+
+SLASH_COMMANDS = (link_cmd, unlink_cmd, linkstatus_cmd, send_cmd, broadcast_cmd, vrlibrary_cmd)
+
+
+def build_bot():
+    """Create the Discord client and register the slash commands on its tree."""
+    global bot, tree
+    intents = discord.Intents.default()
+    intents.message_content = True
+    bot = commands.Bot(command_prefix="!", intents=intents)
+    tree = bot.tree
+    for command in SLASH_COMMANDS:
+        tree.add_command(command)
+    bot.add_listener(on_ready)
+    return bot
 
 
 # --------------------------------
 # MAIN
 # --------------------------------
-async def run_websocket_server():
-    bind_ip = PC_LOCAL_IP or "0.0.0.0"
-    logging.info(f"Starting WebSocket server on ws://{bind_ip}:{WEBSOCKET_PORT}")
-    try:
-        async with serve(ws_handler, bind_ip, WEBSOCKET_PORT):
-            logging.info("WebSocket server started successfully")
+def _ws_extensions():
+    return [
+        ServerPerMessageDeflateFactory(
+            server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+            client_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+            compress_settings={"memLevel": WS_DEFLATE_MEM_LEVEL},
+        )
+    ]
+
+
+def _serve(reuse_port):
+    return serve(
+        ws_handler,
+        _bind_ip(),
+        WEBSOCKET_PORT,
+        create_protocol=guarded_protocol(limiter),
+        compression=None,
+        extensions=_ws_extensions(),
+        ping_interval=WS_PING_INTERVAL,
+        ping_timeout=WS_PING_TIMEOUT,
+        max_size=WS_MAX_FRAME_SIZE,
+        max_queue=WS_MAX_QUEUE,
+        write_limit=WS_WRITE_LIMIT,
+        reuse_port=reuse_port,
+    )
+
+
+async def _serve_forever(reuse_port, note=""):
+    global connected_at_shutdown
+    async with _serve(reuse_port):
+        logging.info("WebSocket server started successfully%s", note)
+        try:
             # Keep the server running indefinitely
             await asyncio.sleep(float('inf'))
+        finally:
+            # closing the server disconnects everyone and empties the registry
+            connected_at_shutdown = list(registry.device_ids())
+
+
+async def run_websocket_server(reuse_port=False):
+    logging.info("Starting WebSocket server on ws://%s:%s", _bind_ip(), WEBSOCKET_PORT)
+    reaper = asyncio.create_task(limiter.reap_loop(registry, _drop_stale_device))
+    try:
+        await _serve_forever(reuse_port)
     except OSError as e:
-        logging.error(f"Failed to bind WebSocket server: {e}")
+        logging.error("Failed to bind WebSocket server: %s", e)
         logging.info("Waiting 5 seconds for port to free up...")
         await asyncio.sleep(5)
         # Retry
-        async with serve(ws_handler, bind_ip, WEBSOCKET_PORT):
-            logging.info("WebSocket server started successfully (retry)")
-            await asyncio.sleep(float('inf'))
+        await _serve_forever(reuse_port, " (retry)")
+    finally:
+        reaper.cancel()
 
 
 async def run_discord_bot():
@@ -511,27 +918,173 @@ async def run_discord_bot():
             bot_token = bot_token.split(" ", 1)[1]
 
     if not bot_token or bot_token == "YOUR_BOT_TOKEN_HERE":
-        raise RuntimeError("BOT_TOKEN missing or invalid: please set the BOT_TOKEN value at the top of server_ws.py")
+        raise RuntimeError("BOT_TOKEN missing or invalid: set BOT_TOKEN, --token or \"token\" in bot_linker.json (see config.py)")
     logging.info("Starting Discord bot")
     try:
         await bot.start(bot_token)
     except Exception as e:
-        logging.error(f"Discord bot error: {e}")
+        logging.error("Discord bot error: %s", e)
         raise
 
 
-async def main():
+async def run_metrics(port):
+    """Serve /metrics on ``port`` and log summaries until cancelled."""
+    server = None
+    if port:
+        try:
+            server = await serve_metrics(metrics, METRICS_HOST, port)
+        except OSError as e:
+            logging.warning("Metrics endpoint on port %s disabled: %s", port, e)
+    try:
+        if METRICS_LOG_INTERVAL > 0:
+            await log_summary_loop(METRICS_LOG_INTERVAL, _metrics_summary)
+        else:
+            await asyncio.sleep(float('inf'))
+    finally:
+        if server is not None:
+            server.close()
+
+
+def run_worker(worker_id, bus_path, metrics_port=0, cfg=None):
+    """Entry point of a WebSocket worker process (WS_WORKERS > 0)."""
+    global router
+    if cfg is not None:
+        # the parent's settings, including its command-line options
+        apply_config(cfg)
+    configure_logging()
+    build_services()
+    router = BusWorker(store, registry, rpc, bus_path, node_id=worker_id)
+    router.on_send = messages.count_sent
+    loop_thread.run(_worker_main(metrics_port))
+
+
+async def _worker_main(metrics_port):
+    await init_db()
+    server = asyncio.create_task(run_websocket_server(reuse_port=True))
+    exporter = asyncio.create_task(run_metrics(metrics_port))
+    # exit together with the bot process
+    closed = asyncio.create_task(router.wait_closed())
+    try:
+        done, _ = await asyncio.wait({server, closed}, return_when=asyncio.FIRST_COMPLETED)
+        if server in done:
+            server.result()
+    finally:
+        server.cancel()
+        exporter.cancel()
+        closed.cancel()
+        router.close()
+        codes.close()
+        store.close()
+
+
+def _start_worker(ctx, index, bus_path):
+    metrics_port = METRICS_PORT + 1 + index if METRICS_PORT else 0
+    # spawn, not fork: the parent already has a running loop and DB threads
+    process = ctx.Process(target=run_worker, args=(f"worker-{index}", bus_path, metrics_port, CONFIG), name=f"ws-worker-{index}", daemon=True)
+    process.start()
+    return process
+
+
+async def run_websocket_workers(bus_path):
+    ctx = multiprocessing.get_context("spawn")
+    workers = [_start_worker(ctx, i, bus_path) for i in range(WS_WORKERS)]
+    logging.info("Started %d WebSocket worker processes on port %s", WS_WORKERS, WEBSOCKET_PORT)
+    try:
+        while True:
+            await asyncio.sleep(1)
+            for i, process in enumerate(workers):
+                if not process.is_alive():
+                    logging.error("WebSocket worker %d exited with code %s; restarting it", i, process.exitcode)
+                    workers[i] = _start_worker(ctx, i, bus_path)
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join(timeout=5)
+
+
+async def _open_services():
     await init_db()
+    if not WS_WORKERS and not store.shared:
+        await warm_start.load(_snapshot_file(), store, SNAPSHOT_MAX_AGE)
+
+
+async def _close_services():
+    router.close()
+    codes.close()
+    store.close()
+
+
+async def main():
+    global router, device_loop
+    build_services()
+    if WS_WORKERS:
+        if not store.shared:
+            raise RuntimeError("WS_WORKERS needs LINKS_BACKEND=shared-sqlite: the workers write links.db too")
+        bus_path = os.getenv("WS_BUS_SOCKET") or os.path.join(tempfile.gettempdir(), f"bot-linker-{os.getpid()}.sock")
+        router = BusRouter(store, registry, rpc, bus_path)
+        router.on_send = messages.count_sent
+    elif WS_THREAD:
+        # from here on, device state is only touched on device_loop
+        device_loop = LoopThread("ws-loop").start()
+        logging.info("WebSocket server runs on its own %s loop thread", loop_thread.LOOP_IMPL)
+    await _on_device_loop(_open_services())
+    # SIGTERM shuts down like Ctrl+C, so the cleanup below runs
+    _cancel_on_sigterm()
     # Run WebSocket server and Discord bot concurrently
+    if WS_WORKERS:
+        websockets_service = run_websocket_workers(bus_path)
+    else:
+        websockets_service = _on_device_loop(run_websocket_server())
+    services = [websockets_service, run_metrics(METRICS_PORT)]
+    if RUN_DISCORD_BOT:
+        build_bot()
+        services.append(run_discord_bot())
+    tasks = [asyncio.ensure_future(service) for service in services]
     try:
         await asyncio.gather(
-            run_websocket_server(),
-            run_discord_bot(),
+            *tasks,
             return_exceptions=False
         )
     except KeyboardInterrupt:
         logging.info("Shutting down...")
+    finally:
+        # let the WebSocket server close its connections (possibly on the
+        # device loop) before the store goes away
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await _on_device_loop(_close_services())
+        if device_loop is not None:
+            device_loop.stop()
+            device_loop = None
+        if not WS_WORKERS and not store.shared:
+            warm_start.save(_snapshot_file(), DB_FILE, connected_at_shutdown)
+
+
+def _cancel_on_sigterm():
+    task = asyncio.current_task()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    except (NotImplementedError, RuntimeError):
+        # Windows, or not the main thread
+        pass
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Discord bot and WebSocket server for paired VR devices.")
+    config.add_arguments(parser)
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    try:
+        apply_config(config.load(_parse_args(sys.argv[1:])))
+    except config.ConfigError as e:
+        sys.exit(f"server_ws.py: {e}")
+    configure_logging()
+    try:
+        loop_thread.run(main())
+    except asyncio.CancelledError:
+        # SIGTERM
+        pass
@@ -0,0 +1,140 @@
+"""
+Signed session tokens that let a reconnecting device skip the link lookup.
+
+After a restart every headset reconnects and says `hello`, and each hello
+used to cost a `devices` lookup (the cache starts cold) plus a queued
+device_name write. `SessionTokens.issue()` hands a linked device a token in
+its `pair` and `hello` replies; the device sends it back as ``"session"``
+in its next hello and `verify()` checks it with one HMAC-SHA256, no DB.
+
+A token carries (device_id, user_id, device_name, expiry) and is only a
+hint: it is bound to its device_id and expires after ``ttl`` seconds, but
+it grants nothing. The bot reads links from the store for every command,
+so an unlinked device holding an old token at most sees its stale user
+reported back. server_ws rejects a token whose user disagrees with an
+entry already in the LinkCache (e.g. after an unlink in this process), and
+name writes that do happen stay guarded by user_id in SQL.
+
+The key comes from SESSION_SECRET or a key file created on first start
+next to the DB, so tokens survive restarts and every process using the
+same DB (WS_WORKERS) accepts them.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+
+import protocol
+
+TOKEN_VERSION = 1
+# bytes of the HMAC kept in the token
+MAC_BYTES = 16
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def load_secret(path):
+    """Return the key stored in ``path``, creating it (atomically) if missing."""
+    try:
+        with open(path, "rb") as f:
+            key = bytes.fromhex(f.read().decode().strip())
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    key = secrets.token_bytes(32)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(key.hex())
+    try:
+        # link() fails if another process created the file first; use theirs
+        os.link(tmp, path)
+        logging.info("Created session key %s", path)
+    except FileExistsError:
+        with open(path, "rb") as f:
+            key = bytes.fromhex(f.read().decode().strip())
+    finally:
+        os.unlink(tmp)
+    return key
+
+
+class SessionTokens:
+    def __init__(self, secret, ttl=7 * 86400.0):
+        if isinstance(secret, str):
+            secret = secret.encode()
+        self._key = hashlib.sha256(b"bot-linker session " + secret).digest()
+        self.ttl = ttl
+        self.issued = 0
+        self.verified = 0
+        # reason -> count: invalid, expired, wrong_device, stale
+        self.rejected = {"invalid": 0, "expired": 0, "wrong_device": 0, "stale": 0}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _mac(self, payload):
+        return hmac.new(self._key, payload, hashlib.sha256).digest()[:MAC_BYTES]
+
+    def issue(self, device_id, user_id, device_name=None, now=None):
+        """Return a token for ``device_id`` linked to ``user_id``, or None when disabled."""
+        if not self.enabled:
+            return None
+        expires = int((time.time() if now is None else now) + self.ttl)
+        payload = protocol.encode([TOKEN_VERSION, device_id, str(user_id), device_name, expires]).encode()
+        self.issued += 1
+        return f"{_b64encode(payload)}.{_b64encode(self._mac(payload))}"
+
+    def verify(self, token, device_id, now=None):
+        """Return ``(user_id, device_name, expires)`` if ``token`` is valid for ``device_id``, else None."""
+        if not self.enabled:
+            return None
+        try:
+            payload_text, mac_text = token.split(".", 1)
+            payload = _b64decode(payload_text)
+            mac = _b64decode(mac_text)
+        except (AttributeError, ValueError, binascii.Error):
+            self.rejected["invalid"] += 1
+            return None
+        if not hmac.compare_digest(mac, self._mac(payload)):
+            self.rejected["invalid"] += 1
+            return None
+        try:
+            version, token_device, user_id, device_name, expires = protocol.decode(payload)
+        except (*protocol.DECODE_ERRORS, ValueError):
+            self.rejected["invalid"] += 1
+            return None
+        if version != TOKEN_VERSION:
+            self.rejected["invalid"] += 1
+            return None
+        if token_device != device_id:
+            self.rejected["wrong_device"] += 1
+            return None
+        if expires < (time.time() if now is None else now):
+            self.rejected["expired"] += 1
+            return None
+        self.verified += 1
+        return user_id, device_name, expires
+
+    def needs_refresh(self, expires, now=None):
+        """Whether a token expiring at ``expires`` is past half its lifetime."""
+        return expires - (time.time() if now is None else now) < self.ttl / 2
+
+    def stale(self):
+        """Count a token that verified but that the caller knows is out of date."""
+        self.verified -= 1
+        self.rejected["stale"] += 1
+
+    def stats(self):
+        return {"enabled": self.enabled, "issued": self.issued, "verified": self.verified, "rejected": dict(self.rejected)}
@@ -0,0 +1,131 @@
+"""
+Storage backends for link state.
+
+`create_store(backend, db_file, **options)` builds the store server_ws uses.
+Every backend offers the `LinksStore` coroutine API (get_user_by_device,
+get_devices, link_device, update_device_name, unlink_device, unlink_user,
+flush, stats), `run()` / `run_sync()` for SQL helpers such as the ones in
+pairing_codes.py and device_router.py, and a ``shared`` flag telling
+callers whether other server processes see the same state.
+
+- "sqlite" (default): `LinksStore`, one server process owning links.db.
+- "shared-sqlite": `SharedLinksStore`, several server processes on one host
+  using the same DB file. WAL lets readers run alongside the single writer;
+  writers wait up to ``busy_timeout`` for the lock and are retried with
+  backoff if SQLite still reports the DB as busy. Each process follows the
+  `link_changes` log (filled by triggers on `devices`) and drops the
+  entries other processes changed from its LinkCache, so cached lookups are
+  at most ``change_poll_interval`` behind.
+"""
+import asyncio
+import logging
+import random
+import sqlite3
+import time
+
+from links_store import LinksStore, _trim_changes_sync
+
+SQL_LAST_CHANGE = "SELECT COALESCE(MAX(seq), 0) FROM link_changes"
+SQL_CHANGES_SINCE = "SELECT seq, user_id, device_id FROM link_changes WHERE seq > ? ORDER BY seq"
+
+
+def _last_change_sync(conn):
+    return conn.execute(SQL_LAST_CHANGE).fetchone()[0]
+
+
+def _changes_since_sync(conn, seq):
+    return conn.execute(SQL_CHANGES_SINCE, (seq,)).fetchall()
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class SharedLinksStore(LinksStore):
+    """`LinksStore` for a DB file shared by several server processes."""
+
+    shared = True
+    change_retention = 300.0
+
+    def __init__(self, db_file, busy_timeout=30.0, busy_retries=5, change_poll_interval=0.05, **options):
+        super().__init__(db_file, busy_timeout=busy_timeout, **options)
+        self.busy_retries = busy_retries
+        self.change_poll_interval = change_poll_interval
+        self._change_seq = 0
+        self._watcher = None
+        self._trimmed_at = time.monotonic()
+        self.busy_retried = 0
+        self.invalidations = 0
+
+    def _with_conn(self, fn, *args):
+        # the busy timeout covers waiting for the write lock, but a WAL
+        # reader upgrading to a writer can still fail straight away with
+        # SQLITE_BUSY; helpers run in `with conn`, so retrying is safe
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return super()._with_conn(fn, *args)
+            except sqlite3.OperationalError as e:
+                if attempt == self.busy_retries or not _is_busy(e):
+                    raise
+                self.busy_retried += 1
+                time.sleep(min(1.0, 0.01 * 2 ** attempt) * (0.5 + random.random()))
+
+    def open_sync(self):
+        super().open_sync()
+        # the cache starts empty, so older changes are irrelevant
+        self._change_seq = self._with_conn(_last_change_sync)
+
+    async def open(self):
+        await super().open()
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch_loop())
+
+    def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        super().close()
+
+    async def _watch_loop(self):
+        while True:
+            await asyncio.sleep(self.change_poll_interval)
+            try:
+                await self.poll_changes()
+                if time.monotonic() - self._trimmed_at > self.change_retention / 10:
+                    self._trimmed_at = time.monotonic()
+                    await self.run(_trim_changes_sync, time.time() - self.change_retention)
+            except Exception:
+                logging.exception("Failed to read link changes")
+
+    async def poll_changes(self):
+        """Drop cache entries for devices/users changed since the last poll."""
+        rows = await self.run(_changes_since_sync, self._change_seq)
+        if not rows:
+            return 0
+        cache = self.cache
+        # reads already in flight may have seen the old rows
+        cache.bump()
+        for _, user_id, device_id in rows:
+            cache.users.discard(user_id)
+            cache.devices.discard(device_id)
+        self._change_seq = rows[-1][0]
+        self.invalidations += len(rows)
+        return len(rows)
+
+    def stats(self):
+        return dict(super().stats(), busy_retried=self.busy_retried, invalidations=self.invalidations)
+
+
+BACKENDS = {
+    "sqlite": LinksStore,
+    "shared-sqlite": SharedLinksStore,
+}
+
+
+def create_store(backend="sqlite", db_file="links.db", **options):
+    try:
+        cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"unknown storage backend {backend!r} (expected one of {', '.join(BACKENDS)})") from None
+    return cls(db_file, **options)
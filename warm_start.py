@@ -0,0 +1,112 @@
+"""
+Connected-device snapshot: saved on graceful shutdown, loaded on start.
+
+Right after a restart the LinkCache is empty, so the reconnect storm and
+the first slash commands all go to SQLite. On a graceful shutdown
+server_ws calls `save()` with the devices that were connected; it reads
+their links (device -> user, and each user's device list) straight from
+the DB together with the `link_changes` sequence number, and writes them
+as JSON. `load()` on the next start preloads the cache from that file,
+but only if no link changed in between (same sequence number) and the
+file is younger than ``max_age``; either way the file is removed, so a
+snapshot is used at most once.
+
+Meant for the single-process "sqlite" backend; shared-sqlite processes
+keep their caches in step through link_changes instead.
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+from links_store import _get_devices_for_user_sync
+
+SNAPSHOT_VERSION = 1
+# link_changes uses AUTOINCREMENT, so this survives trimming the table
+SQL_LINK_SEQ = "SELECT seq FROM sqlite_sequence WHERE name='link_changes'"
+SQL_USERS_BY_DEVICES = "SELECT device_id, user_id FROM devices WHERE device_id IN ({})"
+# stay well below SQLite's host parameter limit
+_CHUNK = 500
+
+
+def _link_seq_sync(conn):
+    row = conn.execute(SQL_LINK_SEQ).fetchone()
+    return row[0] if row else 0
+
+
+def _read_links_sync(conn, device_ids):
+    """Return ``(seq, {device_id: user_id or None}, {user_id: devices})`` in one read transaction."""
+    conn.execute("BEGIN")
+    try:
+        seq = _link_seq_sync(conn)
+        owners = dict.fromkeys(device_ids)
+        for i in range(0, len(device_ids), _CHUNK):
+            chunk = device_ids[i:i + _CHUNK]
+            sql = SQL_USERS_BY_DEVICES.format(",".join("?" * len(chunk)))
+            owners.update(conn.execute(sql, chunk).fetchall())
+        users = {u: _get_devices_for_user_sync(conn, u) for u in set(owners.values()) if u}
+    finally:
+        conn.rollback()
+    return seq, owners, users
+
+
+def save(path, db_file, device_ids):
+    """Write the links of ``device_ids`` to ``path``; call after the store is closed (and flushed)."""
+    device_ids = list(device_ids)
+    if not device_ids:
+        return 0
+    try:
+        with closing(sqlite3.connect(db_file, isolation_level=None)) as conn:
+            seq, owners, users = _read_links_sync(conn, device_ids)
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "link_seq": seq,
+            "devices": owners,
+            "users": {u: [list(d) for d in devices] for u, devices in users.items()},
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+    except (OSError, sqlite3.Error) as e:
+        logging.warning("Could not save connected-device snapshot: %s", e)
+        return 0
+    logging.info("Saved %d connected devices to %s", len(owners), path)
+    return len(owners)
+
+
+async def load(path, store, max_age=3600.0):
+    """Preload ``store``'s LinkCache from a snapshot at ``path``; returns the number of devices loaded."""
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring unreadable snapshot %s: %s", path, e)
+        snapshot = None
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    if not snapshot or snapshot.get("version") != SNAPSHOT_VERSION:
+        return 0
+    age = time.time() - snapshot.get("saved_at", 0)
+    if age > max_age:
+        logging.info("Ignoring snapshot %s: %.0fs old", path, age)
+        return 0
+    seq = await store.run(_link_seq_sync)
+    if seq != snapshot.get("link_seq"):
+        logging.info("Ignoring snapshot %s: links changed since it was saved", path)
+        return 0
+    cache = store.cache
+    cache.bump()
+    for device_id, user_id in snapshot["devices"].items():
+        cache.devices.put(device_id, user_id)
+    for user_id, devices in snapshot["users"].items():
+        cache.users.put(user_id, tuple(tuple(d) for d in devices))
+    logging.info("Warm-loaded %d devices from %s", len(snapshot["devices"]), path)
+    return len(snapshot["devices"])
@@ -0,0 +1,187 @@
+"""
+Local IPC bus between the Discord bot process and WebSocket worker processes.
+
+With ``WS_WORKERS`` set, server_ws runs that many worker processes which all
+listen on the WebSocket port with SO_REUSEPORT, so the kernel spreads
+connections (and their JSON parsing) over several cores. Workers hold the
+device sockets; the bot process holds none. They talk over one Unix socket
+with newline-delimited JSON:
+
+  worker -> bot   {"op": "join", "worker": "<id>", "devices": [...]}
+  worker -> bot   {"op": "up" | "down", "device_id": ...}
+  bot -> worker   {"op": "send" | "broadcast" | "call", "call_id": ..., "args": {...}}
+  worker -> bot   {"op": "reply", "call_id": ..., "result": ...}
+
+`BusRouter` (bot side) keeps device_id -> worker in memory from the up/down
+events and hands `force_unlink`, `discord_message` and `get_library` to the
+worker that owns the device. `BusWorker` (worker side) reports its devices
+and serves those requests against its own registry. Both are
+`DeviceRouter`s, so the slash commands work unchanged with either.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+
+from device_router import DeviceRouter
+from device_rpc import DeviceOffline
+
+# a full (compacted) library reply travels as one line
+BUS_LINE_LIMIT = 16 * 1024 * 1024
+
+
+def _encode(message):
+    return json.dumps(message).encode() + b"\n"
+
+
+class BusRouter(DeviceRouter):
+    """Bot-process router: every device lives in some worker."""
+
+    def __init__(self, store, registry, rpc, path, node_id="bot"):
+        super().__init__(store, registry, rpc, node_id=node_id)
+        self.shared = True
+        self.path = path
+        self._server = None
+        # worker_id -> StreamWriter
+        self._workers = {}
+        # device_id -> worker_id
+        self._owners = {}
+
+    async def open(self):
+        if self._server is not None:
+            return
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._on_worker, self.path, limit=BUS_LINE_LIMIT)
+        logging.info("Worker bus listening on %s", self.path)
+
+    def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        self._server = None
+        for writer in self._workers.values():
+            writer.close()
+        for task in list(self._tasks):
+            task.cancel()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+
+    def device_connected(self, device_id):
+        pass
+
+    def device_disconnected(self, device_id):
+        pass
+
+    async def _on_worker(self, reader, writer):
+        worker_id = None
+        try:
+            async for line in reader:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                op = message.get("op")
+                if op == "up":
+                    self._owners[message["device_id"]] = worker_id
+                elif op == "down":
+                    if self._owners.get(message["device_id"]) == worker_id:
+                        del self._owners[message["device_id"]]
+                elif op == "join":
+                    worker_id = message["worker"]
+                    self._workers[worker_id] = writer
+                    for device_id in message.get("devices") or ():
+                        self._owners[device_id] = worker_id
+                    logging.info("Worker %s joined the bus", worker_id)
+                else:
+                    self._handle_message(message)
+        except Exception:
+            logging.exception("Worker bus connection to %s failed", worker_id)
+        finally:
+            if worker_id is not None and self._workers.get(worker_id) is writer:
+                del self._workers[worker_id]
+                for device_id in [d for d, w in self._owners.items() if w == worker_id]:
+                    del self._owners[device_id]
+                logging.warning("Worker %s left the bus", worker_id)
+            writer.close()
+
+    async def _locate_remote(self, device_ids):
+        return {d: w for d in device_ids if (w := self._owners.get(d)) is not None}
+
+    async def _other_nodes(self):
+        return list(self._workers)
+
+    async def _post(self, node_id, message):
+        writer = self._workers.get(node_id)
+        if writer is None:
+            raise DeviceOffline(f"Worker {node_id} is not running")
+        writer.write(_encode(message))
+        await writer.drain()
+
+    def _reply_slack(self):
+        return 1.0
+
+    def stats(self):
+        return dict(super().stats(), workers=len(self._workers), routed_devices=len(self._owners))
+
+
+class BusWorker(DeviceRouter):
+    """Worker-process router: serves its own devices, reports them to the bot."""
+
+    def __init__(self, store, registry, rpc, path, node_id):
+        super().__init__(store, registry, rpc, node_id=node_id)
+        # requests only ever come in over the bus; nothing here routes out
+        self.shared = False
+        self.path = path
+        self._writer = None
+        self._reader_task = None
+
+    async def open(self):
+        if self._writer is not None:
+            return
+        reader, self._writer = await asyncio.open_unix_connection(self.path, limit=BUS_LINE_LIMIT)
+        self._send({"op": "join", "worker": self.node_id, "devices": list(self.registry.device_ids())})
+        self._reader_task = asyncio.create_task(self._read_loop(reader))
+
+    def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def wait_closed(self):
+        """Return once the bot process has closed the bus."""
+        if self._reader_task is not None:
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reader_task
+
+    def _send(self, message):
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(_encode(message))
+
+    def device_connected(self, device_id):
+        self._send({"op": "up", "device_id": device_id})
+
+    def device_disconnected(self, device_id):
+        self._send({"op": "down", "device_id": device_id})
+
+    async def _read_loop(self, reader):
+        async for line in reader:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            self._handle_message(message)
+        logging.warning("Worker bus closed by the bot process")
+
+    async def _post(self, node_id, message):
+        # the only peer is the bot process
+        if self._writer is None:
+            raise ConnectionError("worker bus is closed")
+        self._send(message)
+        await self._writer.drain()
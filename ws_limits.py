@@ -0,0 +1,170 @@
+"""
+Connection limits, idle reaping and slow-reader protection for the device
+WebSocket server.
+
+`serve(..., create_protocol=guarded_protocol(limiter))` makes every
+connection go through `ConnectionLimiter`:
+
+- ``max_connections`` / ``max_per_ip`` are checked when the TCP connection
+  is accepted; over the limit, the upgrade is answered with HTTP 503 / 429
+  and no handler runs. ``max_per_ip`` is off (0) by default: behind a
+  reverse proxy or NAT every headset has the same peer address.
+- each connection records when it last received any bytes (frames or
+  pongs), so with websockets' keepalive pings a live headset is never idle
+  for long. `reap()` (run every ``reap_interval`` by `reap_loop()`) aborts
+  connections idle for more than ``idle_timeout`` and drops registry
+  entries whose socket is already closed.
+- a connection whose unsent output grows past ``write_high_water`` bytes
+  is not reading; sends to it abort the connection instead of queueing
+  more, and `reap()` catches the ones nobody is sending to right now.
+
+Limits are per process; with WS_WORKERS each worker enforces its own.
+"""
+import asyncio
+import functools
+import http
+import logging
+import time
+
+from websockets.legacy.server import WebSocketServerProtocol
+
+
+class SlowConsumer(ConnectionError):
+    """The peer stopped reading and its write buffer passed the high-water mark."""
+
+
+class ConnectionLimiter:
+    def __init__(self, max_connections=20000, max_per_ip=0, idle_timeout=90.0,
+                 write_high_water=1024 * 1024, reap_interval=5.0):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.idle_timeout = idle_timeout
+        self.write_high_water = write_high_water
+        self.reap_interval = reap_interval
+        self.active = set()
+        self._per_ip = {}
+        self.accepted = 0
+        self.peak = 0
+        self.rejected_total = 0
+        self.rejected_ip = 0
+        self.reaped_idle = 0
+        self.reaped_stale = 0
+        self.slow_disconnects = 0
+
+    def admit(self, ws, ip):
+        """Register a new connection; returns an HTTP status to refuse it with, or None."""
+        if len(self.active) >= self.max_connections:
+            self.rejected_total += 1
+            return http.HTTPStatus.SERVICE_UNAVAILABLE
+        count = self._per_ip.get(ip, 0)
+        if self.max_per_ip > 0 and count >= self.max_per_ip:
+            self.rejected_ip += 1
+            if self.rejected_ip == 1:
+                # usually many headsets behind one NAT or proxy, not an attack
+                logging.warning(
+                    "Refusing connections from %s: %d open from that address (max_per_ip); "
+                    "later refusals are only counted", ip, count,
+                )
+            return http.HTTPStatus.TOO_MANY_REQUESTS
+        self._per_ip[ip] = count + 1
+        self.active.add(ws)
+        self.accepted += 1
+        self.peak = max(self.peak, len(self.active))
+        return None
+
+    def release(self, ws, ip):
+        if ws not in self.active:
+            return
+        self.active.discard(ws)
+        count = self._per_ip.get(ip, 0) - 1
+        if count > 0:
+            self._per_ip[ip] = count
+        else:
+            self._per_ip.pop(ip, None)
+
+    def over_high_water(self, ws):
+        transport = ws.transport
+        return transport is not None and transport.get_write_buffer_size() > self.write_high_water
+
+    def drop_slow(self, ws):
+        self.slow_disconnects += 1
+        logging.warning("Disconnecting %s: write buffer over %d bytes", ws.remote_address, self.write_high_water)
+        ws.transport.abort()
+
+    def reap(self, registry, on_stale):
+        """Abort idle and backed-up connections; ``on_stale(device_id, ws)`` for dead registry entries."""
+        now = time.monotonic()
+        for ws in list(self.active):
+            if now - ws.last_seen > self.idle_timeout:
+                self.reaped_idle += 1
+                logging.info("Reaping idle connection %s (%.0fs silent)", ws.remote_address, now - ws.last_seen)
+                ws.transport.abort()
+            elif self.over_high_water(ws):
+                self.drop_slow(ws)
+        stale = 0
+        for device_id in list(registry.device_ids()):
+            ws = registry.get(device_id)
+            if ws is not None and getattr(ws, "closed", False):
+                stale += 1
+                on_stale(device_id, ws)
+        self.reaped_stale += stale
+
+    async def reap_loop(self, registry, on_stale):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                self.reap(registry, on_stale)
+            except Exception:
+                logging.exception("Connection reaper failed")
+
+    def stats(self):
+        return {
+            "active": len(self.active),
+            "peak": self.peak,
+            "accepted": self.accepted,
+            "rejected_total": self.rejected_total,
+            "rejected_ip": self.rejected_ip,
+            "reaped_idle": self.reaped_idle,
+            "reaped_stale": self.reaped_stale,
+            "slow_disconnects": self.slow_disconnects,
+            "ips": len(self._per_ip),
+        }
+
+
+class GuardedServerProtocol(WebSocketServerProtocol):
+    def __init__(self, *args, limiter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+        self.last_seen = time.monotonic()
+        self._peer_ip = None
+        self._refused = None
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        peer = transport.get_extra_info("peername")
+        self._peer_ip = peer[0] if peer else "unknown"
+        self._refused = self.limiter.admit(self, self._peer_ip)
+
+    def connection_lost(self, exc):
+        self.limiter.release(self, self._peer_ip)
+        super().connection_lost(exc)
+
+    def data_received(self, data):
+        self.last_seen = time.monotonic()
+        super().data_received(data)
+
+    async def process_request(self, path, request_headers):
+        if self._refused is not None:
+            return self._refused, [("Retry-After", "30")], b"Too many connections\n"
+        return await super().process_request(path, request_headers)
+
+    async def send(self, message):
+        if self.limiter.over_high_water(self):
+            self.limiter.drop_slow(self)
+            raise SlowConsumer(f"{self.remote_address} is not reading")
+        await super().send(message)
+
+
+def guarded_protocol(limiter):
+    """``create_protocol`` for serve() that enforces ``limiter``."""
+    return functools.partial(GuardedServerProtocol, limiter=limiter)